@@ -0,0 +1,293 @@
+"""Benchmarks for loading, merging, playing back and displaying histories
+
+Writes synthetic histories with utils.synth (reused between runs), then times
+each loader, merge_history, Playback iteration in every mode, seeks and
+HspApp.render_command, reporting throughput and peak RSS.  Each benchmark
+runs in a fresh process so that its peak RSS is its own.
+
+Results can be saved with -j and compared against a saved run with -c, to
+catch regressions before upgrading:
+
+    python bench.py -n 10k,1M -j before.json
+    python bench.py -n 10k,1M -c before.json
+
+Author: starksimilarity@gmail.com
+"""
+
+import asyncio
+import json
+import multiprocessing
+from optparse import OptionParser
+import os
+import queue
+import random
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+from commandtable import CommandTable
+from loader import PBLoader
+from playback import Playback, merge_history
+from utils import synth
+
+DEFAULT_FOLDER = os.path.join(tempfile.gettempdir(), "hsp_synth")
+DEFAULT_LIMIT = 100000  # most events played, seeked to or rendered per benchmark
+POLL_INTERVAL = 1.0  # seconds between checks that a benchmark is still running
+MODES = [Playback.MANUAL, Playback.REALTIME, Playback.EVENINTERVAL]
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in MiB, or None
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _load(folder, histfile, typehint):
+    hist = PBLoader.load_all(folder, histfile, typehint)
+    if not isinstance(hist, CommandTable):
+        hist = CommandTable(hist)
+    return hist
+
+
+def bench_load(folder, files, typehint, limit):
+    """Parse one history with the loader for its format
+    """
+    histfile = next(f for f, hint in files.items() if hint == typehint)
+    started = time.perf_counter()
+    hist = _load(folder, histfile, typehint)
+    return len(hist), time.perf_counter() - started
+
+
+def bench_merge(folder, files, _, limit):
+    """Merge the histories of every format into one Playback
+    """
+    playbacks = []
+    for histfile, typehint in files.items():
+        pb = Playback()
+        pb.hist = _load(folder, histfile, typehint)
+        playbacks.append(pb)
+    started = time.perf_counter()
+    merged = merge_history(playbacks)
+    return len(merged.hist), time.perf_counter() - started
+
+
+def _msf_playback(folder, files):
+    histfile = next(f for f, hint in files.items() if hint == "msf_prompt")
+    pb = Playback()
+    pb.hist = _load(folder, histfile, "msf_prompt")
+    return pb
+
+
+def bench_play(folder, files, mode, limit):
+    """Iterate a Playback asynchronously in one playback mode
+
+    The playback rate is set so high that no event has to wait for the
+    clock, so this measures the cost of scheduling and delivering events.
+    In MANUAL mode nothing holds loop_lock, so every step is released at
+    once.
+    """
+    pb = _msf_playback(folder, files)
+    pb.playback_mode = mode
+    pb.playback_rate = 1e12
+    count = min(limit, len(pb.hist) - 1)
+
+    async def play():
+        played = 0
+        async for _ in pb:
+            played += 1
+            if played == count:
+                break
+        return played
+
+    loop = asyncio.new_event_loop()
+    try:
+        pb.play()
+        started = time.perf_counter()
+        played = loop.run_until_complete(play())
+        return played, time.perf_counter() - started
+    finally:
+        loop.close()
+
+
+def bench_seek(folder, files, _, limit):
+    """Seek to random times, offsets and indexes
+    """
+    pb = _msf_playback(folder, files)
+    hist = pb.hist
+    rand = random.Random(0)
+    first, last = hist[0].time, hist[len(hist) - 1].time
+    span = (last - first).total_seconds()
+    count = min(limit, len(hist))
+    times = [first + (last - first) * rand.random() for _ in range(count)]
+    started = time.perf_counter()
+    for i, date_time in enumerate(times):
+        kind = i % 3
+        if kind == 0:
+            pb.goto_time(date_time)
+        elif kind == 1:
+            pb.seek(f"#{rand.randrange(len(hist))}")
+        else:
+            pb.seek(f"{rand.choice('+-')}{int(rand.random() * span / 100)}s")
+    return len(times), time.perf_counter() - started
+
+
+def bench_render(folder, files, _, limit):
+    """Render commands as HspApp displays them
+    """
+    from prompt_toolkit.input.base import DummyInput
+    from prompt_toolkit.output import DummyOutput
+    from hspApp import HspApp
+
+    pb = _msf_playback(folder, files)
+    app = HspApp(pb, output=DummyOutput(), input=DummyInput())
+    count = min(limit, len(pb.hist))
+    started = time.perf_counter()
+    for command in pb.hist[:count]:
+        app.render_command(command)
+    return count, time.perf_counter() - started
+
+
+def benchmarks(formats):
+    """Return (name, function, argument) for every benchmark
+    """
+    found = [(f"load:{fmt}", bench_load, fmt) for fmt in formats]
+    found.append(("merge", bench_merge, None))
+    if "msf_prompt" in formats:
+        found += [(f"play:{mode}", bench_play, mode) for mode in MODES]
+        found += [("seek", bench_seek, None), ("render", bench_render, None)]
+    return found
+
+
+def _run(function, folder, files, arg, limit, results):
+    """Benchmark process entry point
+    """
+    try:
+        events, seconds = function(folder, files, arg, limit)
+        results.put((events, seconds, peak_rss(), None))
+    except Exception as e:
+        results.put((0, 0.0, peak_rss(), f"{type(e).__name__}: {e}"))
+
+
+def run(name, function, folder, files, arg, limit):
+    """Run one benchmark in a new process
+
+    Returns
+    =======
+    result : dict
+        events, seconds, events/s, peak RSS in MiB and any error
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=_run, args=(function, folder, files, arg, limit, results))
+    proc.start()
+    while True:
+        try:
+            events, seconds, rss, error = results.get(timeout=POLL_INTERVAL)
+            break
+        except queue.Empty:
+            if proc.is_alive():
+                continue
+        try:
+            # it may have put its result just before exiting
+            events, seconds, rss, error = results.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            # died without one, e.g. killed for running out of memory
+            events, seconds, rss = 0, 0.0, None
+            if proc.exitcode < 0:
+                error = f"process killed by signal {-proc.exitcode}"
+            else:
+                error = f"process exited with code {proc.exitcode}"
+        break
+    proc.join()
+    return {
+        "benchmark": name,
+        "events": events,
+        "seconds": seconds,
+        "rate": events / seconds if seconds else 0.0,
+        "peak_rss": rss,
+        "error": error,
+    }
+
+
+def report(result, size, baseline=None):
+    """Print one result line, with the change in rate from a baseline
+    """
+    rss = "-" if result["peak_rss"] is None else f"{result['peak_rss']:.0f}"
+    line = (
+        f"{result['benchmark']:<24}{size:>10}{result['events']:>10}"
+        f"{result['seconds']:>10.3f}{result['rate']:>14,.0f}{rss:>10}"
+    )
+    if result["error"]:
+        line += f"  {result['error']}"
+    elif baseline and baseline.get("rate"):
+        line += f"{(result['rate'] / baseline['rate'] - 1) * 100:>+9.1f}%"
+    print(line, flush=True)
+
+
+def main():
+    p = OptionParser(usage="%prog [options]")
+    p.add_option(
+        "-n", dest="sizes", default="10k", help="comma-separated history sizes"
+    )
+    p.add_option(
+        "-o", dest="folder", default=DEFAULT_FOLDER, help="folder for the histories"
+    )
+    p.add_option(
+        "-f",
+        dest="formats",
+        default=",".join(synth.FORMATS),
+        help="comma-separated formats to load",
+    )
+    p.add_option(
+        "-b", dest="only", default=None, help="run only benchmarks starting with this"
+    )
+    p.add_option(
+        "-l",
+        dest="limit",
+        type="int",
+        default=DEFAULT_LIMIT,
+        help="most events to play, seek or render",
+    )
+    p.add_option("-j", dest="save", default=None, help="save results to a json file")
+    p.add_option(
+        "-c", dest="compare", default=None, help="compare with results saved by -j"
+    )
+    o, a = p.parse_args()
+
+    baseline = {}
+    if o.compare:
+        with open(o.compare) as infi:
+            baseline = {(r["benchmark"], r["size"]): r for r in json.load(infi)}
+
+    formats = o.formats.split(",")
+    print(
+        f"{'benchmark':<24}{'size':>10}{'events':>10}{'seconds':>10}"
+        f"{'events/s':>14}{'RSS MiB':>10}" + ("   change" if baseline else "")
+    )
+    results = []
+    for size in [synth.parse_count(n) for n in o.sizes.split(",")]:
+        files = synth.generate(o.folder, size, formats)
+        for name, function, arg in benchmarks(formats):
+            if o.only and not name.startswith(o.only):
+                continue
+            result = run(name, function, o.folder, files, arg, o.limit)
+            result["size"] = size
+            report(result, size, baseline.get((name, size)))
+            results.append(result)
+
+    if o.save:
+        with open(o.save, "w") as outfi:
+            json.dump(results, outfi, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Defines the on-disk cache of parsed histories
+
+Parsing a large log can take far longer than reading it back in the
+sessionfile format, and archived logs never change.  A ParseCache keeps each
+parsed history as a session file named by a hash of everything that decides
+what parsing would produce: the file's path, size and mtime, the loader and
+its version, and the hints given to it.  Changing any of those is a miss, so
+entries never need to be invalidated; old ones are evicted least recently
+used first once the cache grows past its size limit.
+
+A history got from the cache reads its text from the entry, so the entry is
+pinned (see lazytext.pin): its memory map stays open, and the history stays
+readable, even if another process sharing the cache evicts it.  Pinned
+entries are never evicted by this process.
+"""
+
+import hashlib
+import os
+
+import lazytext
+import sessionfile
+
+DEFAULT_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "hsp"
+)
+MAX_BYTES = 2 * 1024 ** 3
+
+_SUFFIX = ".hsp"
+
+
+class ParseCache:
+    """Size-bounded LRU cache of parsed histories
+
+    Attributes
+    ==========
+    directory : str
+        folder holding the cached session files
+    max_bytes : int
+        total size the cache is trimmed to
+    auto_evict : bool
+        trim the cache after each store; if False, call evict when done
+
+    Methods
+    =======
+    get(self, filename, loader, hints=None)
+        cached history of a file, or None on a miss
+    put(self, filename, loader, table, hints=None)
+        store the parsed history of a file
+    hold(self, table)
+        pin the entries a table reads its text from
+    evict(self)
+        remove least recently used entries until under max_bytes
+    clear(self)
+        remove every entry
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=MAX_BYTES, auto_evict=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.auto_evict = auto_evict
+
+    def _path(self, filename, loader, hints):
+        """Return the cache file for a history file, or None if it can't be cached
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        key = repr(
+            (
+                os.path.abspath(filename),
+                stat.st_size,
+                stat.st_mtime_ns,
+                f"{loader.__module__}.{loader.__qualname__}",
+                loader.version,
+                sorted((hints or {}).items()),
+                sessionfile.VERSION,
+            )
+        )
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + _SUFFIX)
+
+    def get(self, filename, loader, hints=None):
+        """cached history of a file, or None on a miss
+
+        Parameters
+        ==========
+        filename : str
+            history file
+        loader : loader.PBLoader subclass
+            loader that would parse it
+        hints : dict
+            user_hint, host_hint and date_hint that would be passed to it
+
+        Returns
+        =======
+        table : commandtable.CommandTable
+        """
+        path = self._path(filename, loader, hints)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            table = sessionfile.load(path)
+            lazytext.pin(path)
+        except (OSError, ValueError):
+            return None  # e.g. evicted since it was found
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return table
+
+    def put(self, filename, loader, table, hints=None):
+        """store the parsed history of a file
+
+        The entry is written to a temporary file and moved into place, so
+        processes sharing the cache never see a partial entry.
+        """
+        path = self._path(filename, loader, hints)
+        if path is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            sessionfile.save(table, tmp)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        if self.auto_evict:
+            self.evict()
+
+    def hold(self, table):
+        """pin the entries a table reads its text from
+
+        For a table got from the cache in another process (e.g. a loading
+        worker), which can't pin the entry for this one.
+        """
+        directory = os.path.abspath(self.directory)
+        for filename in table.text_files():
+            path = os.path.abspath(filename)
+            if os.path.dirname(path) == directory and path.endswith(_SUFFIX):
+                try:
+                    lazytext.pin(filename)
+                except (OSError, ValueError):
+                    pass  # already gone; nothing left to protect
+
+    def _entries(self):
+        """Return (mtime, size, path) of each entry, least recently used first
+        """
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        """remove least recently used entries until under max_bytes
+
+        Entries pinned by this process are kept.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if lazytext.pinned(path):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        """remove every entry
+        """
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
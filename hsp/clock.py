@@ -0,0 +1,169 @@
+"""Defines the virtual clock that keeps time during a playback
+
+Playback time is never advanced by a background task; it is computed on demand
+from a monotonic anchor, the playback time at that anchor, and the rate.
+"""
+
+import datetime
+import time
+
+
+class PlaybackClock:
+    """Virtual clock that computes the current playback time on demand
+
+    While running, the playback time is
+        offset + (time.monotonic() - anchor) * rate
+    Every pause, rate change, and seek moves the anchor to "now" so that each
+    change takes effect exactly from the moment it is made and no error builds
+    up between them.
+
+    Attributes
+    ==========
+    rate : (int, float)
+        Multiplier of playback time over wall-clock time
+    paused : bool
+        Is the clock currently stopped
+    lag : dict
+        Measured delivery lag in wall-clock seconds: count, last, mean, max
+
+    Methods
+    =======
+    now(self)
+        current playback time
+    play(self)
+        start the clock from the current playback time
+    pause(self)
+        stop the clock at the current playback time
+    seek(self, when)
+        set the current playback time
+    wall_delay(self, when)
+        wall-clock seconds until the clock reaches a playback time
+    record_lag(self, due)
+        record the delivery lag of an event that was due at a playback time
+    """
+
+    def __init__(self, start=None, rate=1, paused=True):
+        self._offset = start or datetime.datetime.fromordinal(1)
+        self._anchor = time.monotonic()
+        self._rate = rate
+        self._paused = paused
+        self._lag_count = 0
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        self._lag_last = 0.0
+
+    def now(self):
+        """current playback time
+
+        Returns
+        =======
+        _ : datetime.datetime
+            the playback time as of this call
+        """
+        if self._paused:
+            return self._offset
+        return self._offset + datetime.timedelta(
+            seconds=(time.monotonic() - self._anchor) * self._rate
+        )
+
+    def _rebase(self):
+        """Move the anchor to now without changing the playback time
+        """
+        self._offset = self.now()
+        self._anchor = time.monotonic()
+
+    def play(self):
+        """start the clock from the current playback time
+        """
+        if self._paused:
+            self._anchor = time.monotonic()
+            self._paused = False
+
+    def pause(self):
+        """stop the clock at the current playback time
+        """
+        if not self._paused:
+            self._rebase()
+            self._paused = True
+
+    def seek(self, when):
+        """set the current playback time
+
+        Parameters
+        ==========
+        when : datetime.datetime
+            new playback time
+        """
+        self._offset = when
+        self._anchor = time.monotonic()
+
+    def wall_delay(self, when):
+        """wall-clock seconds until the clock reaches a playback time
+
+        Parameters
+        ==========
+        when : datetime.datetime
+            playback time to wait for
+
+        Returns
+        =======
+        _ : float
+            seconds to wait; zero or less if already reached, None if the clock
+            is paused and will never reach it on its own
+        """
+        remaining = (when - self.now()).total_seconds()
+        if remaining <= 0:
+            return remaining
+        if self._paused or not self._rate:
+            return None
+        return remaining / self._rate
+
+    def record_lag(self, due):
+        """record the delivery lag of an event that was due at a playback time
+
+        Lag is how far the clock has run past the due time, converted back to
+        wall-clock seconds at the current rate.
+
+        Parameters
+        ==========
+        due : datetime.datetime
+            playback time at which the event should have been delivered
+
+        Returns
+        =======
+        lag : float
+            wall-clock seconds between the due time and now
+        """
+        lag = (self.now() - due).total_seconds()
+        if self._rate:
+            lag /= self._rate
+        lag = max(lag, 0.0)
+        self._lag_count += 1
+        self._lag_total += lag
+        self._lag_max = max(self._lag_max, lag)
+        self._lag_last = lag
+        return lag
+
+    @property
+    def lag(self):
+        """Measured delivery lag in wall-clock seconds
+        """
+        return {
+            "count": self._lag_count,
+            "last": self._lag_last,
+            "mean": self._lag_total / self._lag_count if self._lag_count else 0.0,
+            "max": self._lag_max,
+        }
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, val):
+        self._rebase()
+        self._rate = val
+
+    @property
+    def paused(self):
+        return self._paused
@@ -1,5 +1,47 @@
 import datetime
 
+from lazytext import resolve
+
+# Command times are kept to the second; columnar stores hold them as whole
+# seconds counted from the start of ordinal day 0 (the day before 0001-01-01)
+# so that every valid date is a positive int
+_SECONDS_AT_MIN = datetime.datetime.min.toordinal() * 86400
+
+
+def to_seconds(time):
+    """Return a datetime as whole seconds for a columnar store
+
+    tzinfo and microseconds are ignored.
+    """
+    return time.toordinal() * 86400 + time.hour * 3600 + time.minute * 60 + time.second
+
+
+def to_time(val):
+    """Return the datetime for a value a Command's time may be set to
+
+    Parameters
+    ==========
+    val : datetime.datetime or int
+        a datetime (microseconds are dropped), or a proleptic Gregorian
+        ordinal
+
+    Raises
+    ======
+    TypeError
+        if val is neither
+    """
+    if isinstance(val, datetime.datetime):
+        return val.replace(microsecond=0) if val.microsecond else val
+    if isinstance(val, int):
+        return datetime.datetime.fromordinal(val)
+    raise TypeError(f"Time must be of datetime or int type, got {val} instead")
+
+
+def from_seconds(seconds):
+    """Return the datetime for a value made by to_seconds
+    """
+    return datetime.datetime.min + datetime.timedelta(seconds=seconds - _SECONDS_AT_MIN)
+
 
 class Command:
     """Defines the structure of a single command
@@ -15,11 +57,14 @@ class Command:
     command : str
         the command the user issued
     result : str
-        the result from the command
+        the result from the command; may be set to a lazytext.LazyText so
+        that it is only read from the history file when accessed
     flagged : bool
         event is marked
     comments : str
-        comments for replay
+        comments for replay; may also be set to a lazytext.LazyText
+    source : str
+        history file the command was loaded from, if known
 
     Methods
     =======
@@ -29,6 +74,17 @@ class Command:
         how to display the command when printed
     """
 
+    __slots__ = (
+        "_time",
+        "_user",
+        "_hostUUID",
+        "_command",
+        "_result",
+        "_flagged",
+        "_comment",
+        "_source",
+    )
+
     def __init__(
         self,
         time,
@@ -38,6 +94,7 @@ class Command:
         result=None,
         flagged=False,
         comment="",
+        source=None,
         *args,
         **kwargs,
     ):
@@ -48,6 +105,7 @@ class Command:
         self.result = result
         self.flagged = flagged
         self.comment = comment
+        self.source = source
 
     def __str__(self):
         return (
@@ -57,6 +115,43 @@ class Command:
             f"{self.comment}\n"
         )
 
+    def __reduce__(self):
+        # pickle the text itself rather than references into history files;
+        # commandtable.CommandView rows are pickled as plain Commands too
+        return (
+            Command,
+            (
+                self.time,
+                self.user,
+                self.hostUUID,
+                self.command,
+                self.result,
+                self.flagged,
+                self.comment,
+                self.source,
+            ),
+        )
+
+    def __setstate__(self, state):
+        # Commands pickled before __slots__ was added carry their __dict__
+        for key, val in state.items():
+            try:
+                object.__setattr__(self, key, val)
+            except AttributeError:
+                pass
+        if not hasattr(self, "_source"):
+            self._source = None
+
+    def _raw_result(self):
+        """result as stored, without reading a lazytext.LazyText
+        """
+        return self._result
+
+    def _raw_comment(self):
+        """comment as stored, without reading a lazytext.LazyText
+        """
+        return self._comment
+
     def to_dict(self):
         """Return a dictionary representation of the command
         """
@@ -70,12 +165,7 @@ class Command:
 
     @time.setter
     def time(self, val):
-        if isinstance(val, datetime.datetime):
-            self._time = val.replace(microsecond=0)
-        elif isinstance(val, int):
-            self._time = datetime.datetime.fromordinal(val)
-        else:
-            raise TypeError(f"Time must be of datetime or int type, got {val} instead")
+        self._time = to_time(val)
 
     @property
     def user(self):
@@ -111,7 +201,7 @@ class Command:
     def result(self):
         """the result from the command
         """
-        return self._result
+        return resolve(self._result)
 
     @result.setter
     def result(self, val):
@@ -130,8 +220,18 @@ class Command:
 
     @property
     def comment(self):
-        return self._comment
+        return resolve(self._comment)
 
     @comment.setter
     def comment(self, val):
         self._comment = val
+
+    @property
+    def source(self):
+        """history file the command was loaded from, if known
+        """
+        return self._source
+
+    @source.setter
+    def source(self, val):
+        self._source = val
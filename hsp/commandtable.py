@@ -0,0 +1,630 @@
+"""Defines the columnar store that holds a Playback's history
+
+A CommandTable keeps each Command field in its own compact column instead of
+one Python object per command.  Rows are numbered in the order they were added
+and never move, so a row number is a stable identity for a command; a separate
+sorted index gives the time order that playback uses.  Indexing the table
+returns CommandView objects, light views that read and write a row through the
+usual Command attributes.
+"""
+
+from array import array
+import bisect
+from itertools import accumulate, chain, islice, repeat
+import pickle
+import re
+
+from command import Command, from_seconds, to_seconds, to_time
+from lazytext import LazyText, resolve
+
+_NONE = -2  # _TextColumn source for a value of None
+_HEAP = -1  # _TextColumn source for text held in the column's own heap
+_NONZERO = re.compile(b"[^\x00]")
+
+
+class _CodedColumn:
+    """Dictionary-encoded column for values that repeat a lot (e.g. users)
+
+    Each distinct value is stored once in values; codes holds its index for
+    every row.
+    """
+
+    __slots__ = ("values", "codes", "_index")
+
+    def __init__(self):
+        self.values = []
+        self.codes = array("i")
+        self._index = {}
+
+    def code(self, val):
+        """Return the code for val, adding it to values if it is new
+        """
+        try:
+            return self._index[val]
+        except KeyError:
+            code = self._index[val] = len(self.values)
+            self.values.append(val)
+            return code
+
+    def append(self, val):
+        self.codes.append(self.code(val))
+
+    def extend(self, vals):
+        index = self._index
+        code = self.code
+        self.codes.extend([index[val] if val in index else code(val) for val in vals])
+
+    def get(self, row):
+        return self.values[self.codes[row]]
+
+    def take(self, columns, picks):
+        """Append the values of rows picked from other columns
+
+        picks is a list of (index into columns, row) pairs.
+        """
+        remaps = [[self.code(val) for val in column.values] for column in columns]
+        codes = [column.codes for column in columns]
+        self.codes.extend([remaps[i][codes[i][row]] for i, row in picks])
+
+    def set(self, row, val):
+        self.codes[row] = self.code(val)
+
+    def __getstate__(self):
+        return self.values, self.codes
+
+    def __setstate__(self, state):
+        self.values, self.codes = state
+        self._index = {val: code for code, val in enumerate(self.values)}
+
+
+class _TextColumn:
+    """Column of text held as offsets into one utf-8 heap
+
+    A value may also be a lazytext.LazyText, which is kept as a reference
+    into its history file (source is the file's code in files) instead of
+    being read.
+    """
+
+    __slots__ = ("files", "source", "start", "length", "heap")
+
+    def __init__(self, files):
+        self.files = files  # _CodedColumn of filenames shared between columns
+        self.source = array("i")
+        self.start = array("q")
+        self.length = array("q")
+        self.heap = bytearray()
+
+    def _encode(self, val):
+        """Return (source, start, length) for a value
+        """
+        if val is None:
+            return _NONE, 0, 0
+        if isinstance(val, LazyText):
+            return self.files.code(val.filename), val.offset, val.length
+        raw = str(val).encode("utf-8", "surrogatepass")
+        start = len(self.heap)
+        self.heap += raw
+        return _HEAP, start, len(raw)
+
+    def append(self, val):
+        source, start, length = self._encode(val)
+        self.source.append(source)
+        self.start.append(start)
+        self.length.append(length)
+
+    def extend(self, vals):
+        """Append many values, in bulk when they are all plain text
+        """
+        try:
+            raws = [val.encode("utf-8", "surrogatepass") for val in vals]
+        except AttributeError:
+            # None or LazyText values; take them one at a time
+            for val in vals:
+                self.append(val)
+            return
+        lengths = array("q", map(len, raws))
+        starts = accumulate(chain((len(self.heap),), lengths))
+        self.source.extend(array("i", [_HEAP]) * len(raws))
+        self.start.extend(islice(starts, len(raws)))
+        self.length.extend(lengths)
+        self.heap += b"".join(raws)
+
+    def take(self, columns, picks):
+        """Append the values of rows picked from other columns
+
+        picks is a list of (index into columns, row) pairs.  The heaps of the
+        columns are appended whole, so it is meant for taking every row of
+        them (as a merge does).  LazyText references stay references.
+        """
+        remaps = []
+        bases = []
+        for column in columns:
+            remaps.append([self.files.code(val) for val in column.files.values])
+            bases.append(len(self.heap))
+            self.heap += column.heap
+        sources = [column.source for column in columns]
+        starts = [column.start for column in columns]
+        lengths = [column.length for column in columns]
+
+        source = self.source
+        start = self.start
+        for i, row in picks:
+            src = sources[i][row]
+            if src == _HEAP:
+                source.append(src)
+                start.append(starts[i][row] + bases[i])
+            else:
+                source.append(src if src == _NONE else remaps[i][src])
+                start.append(starts[i][row])
+        self.length.extend([lengths[i][row] for i, row in picks])
+
+    def get(self, row):
+        """Return the value of a row; LazyText references are not read
+        """
+        source = self.source[row]
+        start = self.start[row]
+        if source == _HEAP:
+            return self.heap[start : start + self.length[row]].decode(
+                "utf-8", "surrogatepass"
+            )
+        if source == _NONE:
+            return None
+        return LazyText(self.files.values[source], start, self.length[row])
+
+    def set(self, row, val):
+        # the old text is left in the heap; values are rarely replaced
+        self.source[row], self.start[row], self.length[row] = self._encode(val)
+
+    def materialized(self):
+        """Return the column with any LazyText references read into the heap
+        """
+        if max(self.source, default=_NONE) < 0:
+            return self
+        column = _TextColumn(self.files)
+        for row in range(len(self.source)):
+            column.append(resolve(self.get(row)))
+        return column
+
+
+class CommandTable:
+    """Columnar store of Commands kept sorted by time
+
+    Times are stored as whole seconds (see command.to_seconds), users and
+    hosts are dictionary-encoded, flags are packed eight to a byte, and
+    command, result and comment text live in per-column heaps.
+
+    Attributes
+    ==========
+    times : array.array
+        time in seconds of each position, in sorted order; suitable for bisect
+
+    Methods
+    =======
+    insert(self, command)
+        add a Command in time order and return its position
+    extend(self, commands)
+        add many Commands in time order
+    row(self, position)
+        stable row number of the command at a position
+    position(self, row)
+        current position of a row
+    flagged_positions(self)
+        sorted list of the positions of flagged commands
+    text_files(self)
+        files that LazyText values in the table are read from
+    tag_source(self, source)
+        record source as the history file of commands that have none
+    pack(self)
+        the table as bytes, for handing to another process
+    unpack(cls, data)
+        rebuild a table from the bytes returned by pack
+    merged(cls, tables)
+        new table holding the commands of several tables in time order
+    version(self, row)
+        number of changes made to a row since the table was made
+    """
+
+    def __init__(self, commands=None):
+        self._order = array("q")  # position -> row
+        self.times = array("q")  # position -> seconds
+        self._time = array("q")  # row -> seconds
+        self._users = _CodedColumn()
+        self._hosts = _CodedColumn()
+        self._sources = _CodedColumn()
+        self._files = _CodedColumn()
+        self._commands = _TextColumn(self._files)
+        self._results = _TextColumn(self._files)
+        self._comments = _TextColumn(self._files)
+        self._flags = bytearray()
+        self._versions = {}  # row -> changes made to it, if any
+
+        if commands:
+            self.extend(commands)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [CommandView(self, row) for row in self._order[position]]
+        return CommandView(self, self._order[position])
+
+    def __iter__(self):
+        for row in self._order:
+            yield CommandView(self, row)
+
+    def __getstate__(self):
+        # pickle the text itself rather than references into history files
+        state = dict(self.__dict__)
+        state["_results"] = self._results.materialized()
+        state["_comments"] = self._comments.materialized()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("_versions", {})
+        if "_sources" not in state:
+            # pickled before sources were recorded
+            self._sources = _CodedColumn()
+            self._sources.extend([None] * len(self._time))
+
+    def pack(self):
+        """the table as bytes, for handing to another process
+
+        Each column goes across as its raw array buffer, so this is far
+        smaller and quicker to load than a pickled list of Commands.  Unlike
+        pickling the table, LazyText references are kept as references; the
+        receiver must be able to open the same history files.
+
+        Returns
+        =======
+        data : bytes
+            serialized columns; pass to CommandTable.unpack
+        """
+        return pickle.dumps(self.__dict__, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def unpack(cls, data):
+        """rebuild a table from the bytes returned by pack
+
+        Parameters
+        ==========
+        data : bytes
+            output of CommandTable.pack
+
+        Returns
+        =======
+        table : CommandTable
+        """
+        table = cls.__new__(cls)
+        table.__setstate__(pickle.loads(data))
+        return table
+
+    @classmethod
+    def merged(cls, tables):
+        """new table holding the commands of several tables in time order
+
+        Each table is already sorted, so a stable sort of their concatenated
+        times only has to merge those runs (timsort finds them itself), and
+        ties keep the order of the tables.  The picked rows are then copied
+        column by column without making a Command for any of them.
+
+        Parameters
+        ==========
+        tables : list[CommandTable]
+            tables to merge
+
+        Returns
+        =======
+        table : CommandTable
+        """
+        tables = list(tables)
+        times = array("q")
+        owners = array("i")
+        rows = array("q")
+        for i, t in enumerate(tables):
+            times.extend(t.times)
+            owners.extend(repeat(i, len(t)))
+            rows.extend(t._order)
+        order = sorted(range(len(times)), key=times.__getitem__)
+        picks = [(owners[k], rows[k]) for k in order]
+
+        table = cls()
+        table.times.extend([times[k] for k in order])
+        table._time.extend(table.times)
+        table._order.extend(range(len(picks)))
+        table._users.take([t._users for t in tables], picks)
+        table._hosts.take([t._hosts for t in tables], picks)
+        table._sources.take([t._sources for t in tables], picks)
+        table._commands.take([t._commands for t in tables], picks)
+        table._results.take([t._results for t in tables], picks)
+        table._comments.take([t._comments for t in tables], picks)
+        table._flags.extend(bytes((len(picks) + 7) // 8))
+        flags = table._flags
+        for row, (i, old) in enumerate(picks):
+            if tables[i]._flags[old >> 3] & (1 << (old & 7)):
+                flags[row >> 3] |= 1 << (row & 7)
+        return table
+
+    def _append_row(self, command):
+        """Add a Command's fields to the columns and return its new row
+        """
+        row = len(self._time)
+        self._time.append(to_seconds(command.time))
+        self._users.append(command.user)
+        self._hosts.append(command.hostUUID)
+        self._sources.append(command.source)
+        self._commands.append(command.command)
+        self._results.append(command._raw_result())
+        self._comments.append(command._raw_comment())
+        if not row & 7:
+            self._flags.append(0)
+        if command.flagged:
+            self._flags[row >> 3] |= 1 << (row & 7)
+        return row
+
+    def insert(self, command):
+        """add a Command in time order
+
+        Commands with the same time as existing ones are placed after them.
+
+        Returns
+        =======
+        position : int
+            position of the new command
+        """
+        row = self._append_row(command)
+        seconds = self._time[row]
+        if not self.times or seconds >= self.times[-1]:
+            position = len(self.times)
+            self.times.append(seconds)
+            self._order.append(row)
+        else:
+            position = bisect.bisect_right(self.times, seconds)
+            self.times.insert(position, seconds)
+            self._order.insert(position, row)
+        return position
+
+    def extend(self, commands):
+        """add many Commands in time order
+
+        The commands are sorted first (stably, so ties keep their order).  If
+        they all come after the existing ones, as when loading into an empty
+        table, each column is filled in bulk.
+        """
+        commands = list(commands)
+        seconds = [to_seconds(c.time) for c in commands]
+        order = sorted(range(len(commands)), key=seconds.__getitem__)
+        commands = [commands[i] for i in order]
+        seconds = [seconds[i] for i in order]
+        if not commands:
+            return
+        if self.times and seconds[0] < self.times[-1]:
+            for command in commands:
+                self.insert(command)
+            return
+
+        first_row = len(self._time)
+        self._order.extend(range(first_row, first_row + len(commands)))
+        self.times.extend(seconds)
+        self._time.extend(seconds)
+        self._users.extend([c.user for c in commands])
+        self._hosts.extend([c.hostUUID for c in commands])
+        self._sources.extend([c.source for c in commands])
+        self._commands.extend([c.command for c in commands])
+        self._results.extend([c._raw_result() for c in commands])
+        self._comments.extend([c._raw_comment() for c in commands])
+        self._flags.extend(bytes((len(self._time) + 7) // 8 - len(self._flags)))
+        for row, command in enumerate(commands, first_row):
+            if command.flagged:
+                self._flags[row >> 3] |= 1 << (row & 7)
+
+    def row(self, position):
+        """stable row number of the command at a position
+        """
+        return self._order[position]
+
+    def position(self, row):
+        """current position of a row
+
+        Found by binary search on the row's time, then a scan of the commands
+        that share it.
+        """
+        seconds = self._time[row]
+        lo = bisect.bisect_left(self.times, seconds)
+        hi = bisect.bisect_right(self.times, seconds, lo)
+        for position in range(lo, hi):
+            if self._order[position] == row:
+                return position
+        raise IndexError(f"row {row} is not in the table")
+
+    def text_files(self):
+        """files that LazyText values in the table are read from
+        """
+        return list(self._files.values)
+
+    def tag_source(self, source):
+        """record source as the history file of commands that have none
+
+        Parameters
+        ==========
+        source : str
+            name of the history file the table was loaded from
+        """
+        sources = self._sources
+        unknown = sources._index.get(None)
+        if unknown is None:
+            return
+        if source not in sources._index:
+            # relabel the value in place rather than every row's code
+            sources.values[unknown] = source
+            del sources._index[None]
+            sources._index[source] = unknown
+            return
+        code = sources.code(source)
+        codes = sources.codes
+        for row in range(len(codes)):
+            if codes[row] == unknown:
+                codes[row] = code
+
+    def version(self, row):
+        """number of changes made to a row since the table was made
+
+        Every field set through a CommandView counts, so a cached rendering
+        of a row is current as long as the version it was made at is.
+        """
+        return self._versions.get(row, 0)
+
+    def _changed(self, row):
+        self._versions[row] = self._versions.get(row, 0) + 1
+
+    def flagged_positions(self):
+        """sorted list of the positions of flagged commands
+
+        Few commands are flagged, so the flag bytes are scanned for nonzero
+        ones and only the flagged rows are looked up.
+        """
+        positions = []
+        for match in _NONZERO.finditer(self._flags):
+            byte = match.start()
+            for bit in range(8):
+                if self._flags[byte] & (1 << bit):
+                    positions.append(self.position(byte * 8 + bit))
+        positions.sort()
+        return positions
+
+    ###################################################
+    # Row accessors used by CommandView
+    ###################################################
+
+    def get_time(self, row):
+        return from_seconds(self._time[row])
+
+    def set_time(self, row, val):
+        # convert first, so a bad time leaves the table as it was
+        seconds = to_seconds(to_time(val))
+        # move the row so the table stays sorted
+        self._changed(row)
+        position = self.position(row)
+        del self.times[position]
+        del self._order[position]
+        self._time[row] = seconds
+        position = bisect.bisect_right(self.times, seconds)
+        self.times.insert(position, seconds)
+        self._order.insert(position, row)
+
+    def get_flagged(self, row):
+        return bool(self._flags[row >> 3] & (1 << (row & 7)))
+
+    def set_flagged(self, row, val):
+        self._changed(row)
+        if val:
+            self._flags[row >> 3] |= 1 << (row & 7)
+        else:
+            self._flags[row >> 3] &= ~(1 << (row & 7)) & 0xFF
+
+
+class CommandView(Command):
+    """Command whose fields are a row of a CommandTable
+
+    Reading or setting an attribute reads or writes the table, so a view can
+    be used anywhere a Command is.  Views are cheap and made on demand; two
+    views of the same row are different objects.
+    """
+
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def _raw_result(self):
+        return self._table._results.get(self._row)
+
+    def _raw_comment(self):
+        return self._table._comments.get(self._row)
+
+    @property
+    def time(self):
+        """time that the command was run
+        """
+        return self._table.get_time(self._row)
+
+    @time.setter
+    def time(self, val):
+        self._table.set_time(self._row, val)
+
+    @property
+    def user(self):
+        """user who ran the command
+        """
+        return self._table._users.get(self._row)
+
+    @user.setter
+    def user(self, val):
+        self._table._users.set(self._row, val)
+        self._table._changed(self._row)
+
+    @property
+    def hostUUID(self):
+        """ID of the the host
+        """
+        return self._table._hosts.get(self._row)
+
+    @hostUUID.setter
+    def hostUUID(self, val):
+        self._table._hosts.set(self._row, val)
+        self._table._changed(self._row)
+
+    @property
+    def command(self):
+        """the command the user issued
+        """
+        return resolve(self._table._commands.get(self._row))
+
+    @command.setter
+    def command(self, val):
+        self._table._commands.set(self._row, val)
+        self._table._changed(self._row)
+
+    @property
+    def result(self):
+        """the result from the command
+        """
+        return resolve(self._table._results.get(self._row))
+
+    @result.setter
+    def result(self, val):
+        self._table._results.set(self._row, val)
+        self._table._changed(self._row)
+
+    @property
+    def source(self):
+        """history file the command was loaded from, if known
+        """
+        return self._table._sources.get(self._row)
+
+    @source.setter
+    def source(self, val):
+        self._table._sources.set(self._row, val)
+        self._table._changed(self._row)
+
+    @property
+    def flagged(self):
+        return self._table.get_flagged(self._row)
+
+    @flagged.setter
+    def flagged(self, val):
+        if isinstance(val, bool):
+            self._table.set_flagged(self._row, val)
+        else:
+            raise TypeError("flagged attribute must be of type bool")
+
+    @property
+    def comment(self):
+        return resolve(self._table._comments.get(self._row))
+
+    @comment.setter
+    def comment(self, val):
+        self._table._comments.set(self._row, val)
+        self._table._changed(self._row)
@@ -0,0 +1,413 @@
+"""Writes a Playback's history out without the TUI
+
+Commands are streamed from the history straight to a Writer, as fast as the
+disk takes them: no event loop or playback clock is involved.  Nothing is
+kept per command, and results left in their history files (lazy_results)
+are only read as each command is written, so memory stays bounded however
+long the history is.
+
+Writers are chosen by format name:
+
+    text        transcript as a reviewer would read it
+    asciicast   asciinema v2 recording, timed from Command.time
+    jsonl       one JSON object per command
+    csv         the columns GenericCsvPBLoader reads back
+
+and more can be added by subclassing Writer with a format, e.g.
+
+    class HtmlWriter(Writer, format="html"):
+        ...
+
+Usage (from the hsp folder; histories are listed as for hsp.py):
+
+    python export.py -f text -s host -o transcripts/debrief.txt
+    python export.py -f asciicast -r 4 -i 2 -o training.cast
+    python export.py -f jsonl -v "user=root flagged" -o root.jsonl
+
+Author: starksimilarity@gmail.com
+"""
+
+from abc import ABC, abstractmethod
+import csv
+import json
+from optparse import OptionParser
+import os
+import re
+import sys
+
+import cache
+import lazytext
+import metrics
+from playback import iter_merged, load_playbacks
+from utils.utils import parseconfig
+from views import parse_filter
+
+HISTFILE_LIST = "histfile_list"
+WRITE_BUFFER = 1024 * 1024  # bytes buffered per output file
+
+_UNSAFE = re.compile(r"[^\w.-]+")
+
+
+class Writer(ABC):
+    """Base class for the formats export writes
+
+    Subclasses register themselves under a name with a class keyword
+    argument, as loaders do with typehint.
+
+    Attributes
+    ==========
+    format : str
+        name the writer is chosen by
+    extension : str
+        usual file extension, with its dot
+    newline : str
+        newline argument to open the output file with
+
+    Methods
+    =======
+    write(self, command)
+        write one command
+    close(self)
+        write anything that follows the last command
+    """
+
+    format = None
+    extension = ".txt"
+    newline = None
+
+    _registry = {}  # format -> writer class, in registration order
+
+    def __init_subclass__(cls, format=None, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if format:
+            cls.format = format
+            Writer._registry[format] = cls
+
+    def __init__(self, outfi, title=None):
+        self.outfi = outfi
+        self.title = title
+
+    @abstractmethod
+    def write(self, command):
+        """write one command
+        """
+
+    def close(self):
+        """write anything that follows the last command
+        """
+
+
+class TextWriter(Writer, format="text"):
+    """Transcript of the commands, their results and comments
+    """
+
+    def write(self, command):
+        flag = " [FLAGGED]" if command.flagged else ""
+        self.outfi.write(
+            f"[{command.time}] {command.hostUUID}:{command.user}{flag} > "
+            f"{_one_line(command.command)}\n"
+        )
+        result = command.result
+        if result:
+            self.outfi.write(result if result.endswith("\n") else result + "\n")
+        for line in (command.comment or "").splitlines():
+            self.outfi.write(f"# {line}\n")
+        self.outfi.write("\n")
+
+
+class AsciicastWriter(Writer, format="asciicast"):
+    """asciinema asciicast v2 recording of the commands being typed and run
+
+    Each command is shown at its time since the first command, divided by
+    rate; gaps longer than idle_limit seconds (after scaling) are cut to
+    idle_limit, so long pauses in a session don't stall the recording.
+    """
+
+    extension = ".cast"
+    newline = "\n"
+
+    def __init__(
+        self, outfi, title=None, rate=1.0, idle_limit=None, width=120, height=40
+    ):
+        super().__init__(outfi, title)
+        self.rate = rate
+        self.idle_limit = idle_limit
+        self.width = width
+        self.height = height
+        self._start = None  # time of the first command
+        self._last = None  # time of the previous command
+        self._elapsed = 0.0  # seconds into the recording
+
+    def _header(self, command):
+        header = {"version": 2, "width": self.width, "height": self.height}
+        try:
+            timestamp = int(command.time.timestamp())
+        except (OverflowError, OSError, ValueError):
+            timestamp = -1
+        if timestamp >= 0:
+            # histories without dates are left at year 1, before the epoch
+            header["timestamp"] = timestamp
+        if self.idle_limit is not None:
+            header["idle_time_limit"] = self.idle_limit
+        if self.title:
+            header["title"] = self.title
+        self.outfi.write(json.dumps(header) + "\n")
+
+    def _event(self, text):
+        text = text.replace("\r\n", "\n").replace("\n", "\r\n")
+        self.outfi.write(json.dumps([round(self._elapsed, 6), "o", text]) + "\n")
+
+    def write(self, command):
+        if self._start is None:
+            self._header(command)
+            self._start = self._last = command.time
+        gap = (command.time - self._last).total_seconds() / self.rate
+        if self.idle_limit is not None:
+            gap = min(gap, self.idle_limit)
+        self._elapsed += max(gap, 0.0)
+        self._last = command.time
+        self._event(
+            f"\x1b[1m{command.hostUUID}:{command.user} > \x1b[0m"
+            f"{_one_line(command.command)}\n"
+        )
+        result = command.result
+        if result:
+            self._event(result if result.endswith("\n") else result + "\n")
+
+
+class JsonLinesWriter(Writer, format="jsonl"):
+    """One JSON object per command, one per line
+    """
+
+    extension = ".jsonl"
+    newline = "\n"
+
+    def write(self, command):
+        self.outfi.write(
+            json.dumps(
+                {
+                    "time": command.time.isoformat(),
+                    "host": command.hostUUID,
+                    "user": command.user,
+                    "command": command.command,
+                    "result": command.result,
+                    "flagged": command.flagged,
+                    "comment": command.comment,
+                    "source": command.source,
+                }
+            )
+            + "\n"
+        )
+
+
+class CsvWriter(Writer, format="csv"):
+    """The columns GenericCsvPBLoader reads, with a header row
+
+    Written files can be loaded back as generic_csv_hist.
+    """
+
+    extension = ".csv"
+    newline = ""  # the csv module writes its own line endings
+    FIELDS = ["Time", "Host", "User", "Command", "Result", "Flagged", "Comment"]
+
+    def __init__(self, outfi, title=None):
+        super().__init__(outfi, title)
+        self._writer = csv.writer(outfi)
+        self._writer.writerow(self.FIELDS)
+
+    def write(self, command):
+        self._writer.writerow(
+            [
+                # strftime's %Y doesn't pad, and undated histories are at year 1
+                command.time.isoformat(sep=" ", timespec="seconds"),
+                command.hostUUID,
+                command.user,
+                command.command,
+                command.result,
+                command.flagged,
+                command.comment,
+            ]
+        )
+
+
+def _one_line(text):
+    """Return a command without the newline some loaders leave on it
+    """
+    return "" if text is None else str(text).rstrip("\r\n")
+
+
+def writer_class(fmt):
+    """Return the Writer registered for a format
+
+    Raises
+    ======
+    ValueError
+        if no Writer is registered for fmt
+    """
+    try:
+        return Writer._registry[fmt]
+    except KeyError:
+        raise ValueError(
+            f"unknown export format {fmt!r}; choose from {', '.join(Writer._registry)}"
+        )
+
+
+def split_filename(filename, key):
+    """Return the file a split export writes the commands for key to
+
+    e.g. transcripts/debrief.txt and host1 -> transcripts/debrief.host1.txt
+    """
+    stem, ext = os.path.splitext(filename)
+    key = _UNSAFE.sub("_", str(key)).strip("._") or "unknown"
+    return f"{stem}.{key}{ext}"
+
+
+def export(commands, fmt, filename, split=None, **options):
+    """Write commands to a file with the Writer for a format
+
+    Parameters
+    ==========
+    commands : iterable
+        Commands in time order, e.g. a CommandTable, a HistoryView or
+        playback.iter_merged
+    fmt : str
+        format of the Writer to use
+    filename : str
+        file to write
+    split : str
+        Command attribute (e.g. "hostUUID" or "user") to write a separate
+        file for each value of, named by split_filename; None for one file
+    options : dict
+        passed on to the Writer, e.g. rate and idle_limit for asciicast
+
+    Returns
+    =======
+    files : dict
+        filename -> number of commands written to it
+    """
+    cls = writer_class(fmt)
+    writers = {}  # split value -> (filename, open file, Writer)
+    counts = {}
+
+    def writer_for(key):
+        name = filename if split is None else split_filename(filename, key)
+        outfi = open(name, "w", newline=cls.newline, buffering=WRITE_BUFFER)
+        title = os.path.basename(os.path.splitext(name)[0])
+        writers[key] = (name, outfi, cls(outfi, title=title, **options))
+        counts[name] = 0
+        return writers[key]
+
+    try:
+        # each text is read once, so don't push the cached ones out for it
+        with lazytext.uncached():
+            for command in commands:
+                key = None if split is None else getattr(command, split)
+                try:
+                    name, _, writer = writers[key]
+                except KeyError:
+                    name, _, writer = writer_for(key)
+                writer.write(command)
+                counts[name] += 1
+        if split is None and not writers:
+            writer_for(None)  # an empty history still gets its file
+    finally:
+        for name, outfi, writer in writers.values():
+            try:
+                writer.close()
+            finally:
+                outfi.close()
+    metrics.inc("hsp_export_rows_total", sum(counts.values()), format=fmt)
+    return counts
+
+
+SPLITS = {"host": "hostUUID", "user": "user", "source": "source"}
+
+
+def main():
+    p = OptionParser(usage="%prog [options] [histfile[:typehint] ...]")
+    p.add_option(
+        "-f",
+        dest="format",
+        default="text",
+        help=f"output format: {', '.join(Writer._registry)}",
+    )
+    p.add_option("-o", dest="output", help="file to write")
+    p.add_option(
+        "-s", dest="split", default=None, help="write a file per host, user or source",
+    )
+    p.add_option(
+        "-c",
+        dest="config",
+        default=HISTFILE_LIST,
+        help="histories to load when none are given",
+    )
+    p.add_option("-v", dest="filter", default="", help="only commands passing a filter")
+    p.add_option(
+        "-r",
+        dest="rate",
+        type="float",
+        default=1.0,
+        help="asciicast: times faster than the session was run",
+    )
+    p.add_option(
+        "-i",
+        dest="idle_limit",
+        type="float",
+        default=None,
+        help="asciicast: longest pause, in seconds",
+    )
+    p.add_option(
+        "-w",
+        dest="workers",
+        type="int",
+        default=None,
+        help="processes loading histories; 0 for none",
+    )
+    o, a = p.parse_args()
+
+    if not o.output:
+        p.error("an output file (-o) is required")
+    if o.split is not None and o.split not in SPLITS:
+        p.error(f"-s must be one of {', '.join(SPLITS)}")
+    try:
+        writer_class(o.format)
+    except ValueError as e:
+        p.error(str(e))
+
+    if a:
+        files = {}
+        for arg in a:
+            histfile, _, typehint = arg.partition(":")
+            files[histfile] = typehint or None
+    else:
+        files = parseconfig(o.config)
+
+    options = {}
+    if o.format == "asciicast":
+        options = {"rate": o.rate, "idle_limit": o.idle_limit}
+
+    playbacks = load_playbacks(
+        files,
+        lazy_results=True,
+        workers=o.workers,
+        progress=lambda line: print(line, file=sys.stderr),
+        cache_dir=cache.DEFAULT_DIR,
+    )
+    try:
+        histories = [parse_filter(pb.view(), o.filter) for pb in playbacks]
+    except ValueError as e:
+        p.error(str(e))
+
+    counts = export(
+        iter_merged(histories),
+        o.format,
+        o.output,
+        split=SPLITS.get(o.split),
+        **options,
+    )
+    for name, count in counts.items():
+        print(f"{name}: {count} commands", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,13 +9,30 @@ Author: starksimilarity@gmail.com
 import asyncio
 from prompt_toolkit.eventloop import use_asyncio_event_loop
 
-from playback import Playback, merge_history
+import cache
+import metrics
+from follow import follow, followers_for
+from journal import AnnotationJournal, JOURNAL_FILE
+from playback import (
+    SESSION_FOLDER,
+    Playback,
+    expand_histfiles,
+    load_playbacks,
+    merge_history,
+)
+from search import SearchIndex, index_in_background
 from utils.utils import parseconfig
 from hspApp import HspApp
 
 DEFAULT_HIST = "sessions/histfile"
 HISTFILE_LIST = "histfile_list"
 SAVE_LOCATION = "SavedPlayback"
+LAZY_RESULTS = True  # read command results from the history files on demand
+LOAD_WORKERS = None  # processes loading histories; None for one per CPU, 0 for none
+PARSE_CACHE = cache.DEFAULT_DIR  # reuse parsed histories from here; None to bypass
+FOLLOW = False  # keep reading commands appended to the history files
+METRICS = False  # collect timings for the debug overlay (d)
+METRICS_FILE = None  # write metrics here on exit; .json, else Prometheus text
 
 
 def main():
@@ -26,38 +43,62 @@ def main():
     # Setting Up Playback object
     ###################################################
 
+    if METRICS or METRICS_FILE:
+        metrics.enable()
+
     files = parseconfig("histfile_list")
 
-    playback_list = []
-    for fi, hint in files.items():
-        playback_list.append(Playback(fi, hint))
+    followers = []
+    if FOLLOW:
+        # files that can be followed are read by their followers from the
+        # start, so nothing written to them while the others load is lost
+        followers = followers_for(
+            expand_histfiles(files), SESSION_FOLDER, from_start=True
+        )
+        followed = {follower.source for follower in followers}
+        files = {fi: hint for fi, hint in expand_histfiles(files) if fi not in followed}
+
+    playback_list = load_playbacks(
+        files, lazy_results=LAZY_RESULTS, workers=LOAD_WORKERS, cache_dir=PARSE_CACHE
+    )
+    for follower in followers:
+        followed_playback = Playback()
+        followed_playback.hist = follower.catch_up()
+        playback_list.append(followed_playback)
 
     playback = merge_history(playback_list)
     playback.playback_mode = "MANUAL"
+    playback.attach_journal(AnnotationJournal(JOURNAL_FILE))
 
     ###################################################
     # Setting Up HspApp object
     ###################################################
-    hspApp = HspApp(playback, SAVE_LOCATION)
+    search_index = SearchIndex(playback.hist)
+    hspApp = HspApp(playback, SAVE_LOCATION, search_index)
 
     ###################################################
     # Setting Up async loop
     ###################################################
     loop = asyncio.get_event_loop()
     use_asyncio_event_loop()
+    tasks = [
+        hspApp.command_loop(),
+        hspApp.run_async().to_asyncio_future(),
+        hspApp.toolbar_clock(),
+        index_in_background(search_index),
+    ]
+    if followers:
+        tasks.append(
+            follow(playback, followers, on_update=lambda _: hspApp.request_redraw())
+        )
     try:
         # Run command_loop and hspApp.run_async next to each other
         # future: handle when one completes before the other
-        loop.run_until_complete(
-            asyncio.gather(
-                hspApp.command_loop(),
-                hspApp.run_async().to_asyncio_future(),
-                hspApp.playback.run_async(),
-                hspApp.redraw_timer(),
-            )
-        )
+        loop.run_until_complete(asyncio.gather(*tasks))
     finally:
         loop.close()
+        if METRICS_FILE:
+            metrics.write(METRICS_FILE)
 
 
 if __name__ == "__main__":
@@ -6,11 +6,12 @@ Author: starksimilarity@gmail.com
 """
 
 import asyncio
-from collections import deque
+from collections import OrderedDict, deque
 from contextlib import contextmanager
 import datetime
 from functools import partial
-import pickle
+import re
+import time
 
 from prompt_toolkit import PromptSession, HTML
 from prompt_toolkit.application import Application
@@ -19,16 +20,33 @@ from prompt_toolkit.eventloop import use_asyncio_event_loop
 from prompt_toolkit.filters import Condition
 from prompt_toolkit.formatted_text import HTML, FormattedText
 from prompt_toolkit.key_binding import KeyBindings
-from prompt_toolkit.layout.containers import HSplit, Window
+from prompt_toolkit.layout.containers import (
+    ConditionalContainer,
+    Float,
+    FloatContainer,
+    HSplit,
+    VSplit,
+    Window,
+)
 from prompt_toolkit.layout.controls import FormattedTextControl, BufferControl
 from prompt_toolkit.layout import Layout, Dimension
 from prompt_toolkit.widgets import Box, Frame, TextArea
 from prompt_toolkit.widgets.toolbars import FormattedTextToolbar
 
+import metrics
+from outputpane import OutputControl
 from playback import Playback, merge_history
+from search import SearchIndex
+from timeline import TimelineControl
+from views import HistoryView, parse_filter
+import sessionfile
 from utils.utils import parseconfig
 
 SAVE_LOCATION = "SavedPlayback"
+MAX_FPS = 30  # most redraws a second caused by playback
+TOOLBAR_TICK = 0.25  # seconds between toolbar clock updates while playing
+RENDER_CACHE_SIZE = 256  # rendered commands kept for redisplay
+PRERENDER_AHEAD = 8  # commands after the cursor rendered while idle
 
 
 class HspApp(Application):
@@ -38,6 +56,10 @@ class HspApp(Application):
     ==========
     displayingHelpScreen : bool
         used to toggle between help screen and normal view
+    displayingDebug : bool
+        used to toggle the metrics overlay
+    displayingTimeline : bool
+        used to toggle the timeline of played commands
     disabled_bindings : bool
         used to toggle key_bindings
     save_location : str
@@ -46,8 +68,17 @@ class HspApp(Application):
         Playback object that is being controlled by the app
     command_cache : collections.deque
         Local reference to the most recent command objects from playback hist
+    render_cache : collections.OrderedDict
+        Recently rendered commands by (table id, row, row version), least
+        recently used first
+    timeline : timeline.TimelineControl
+        lists every command played so far, scrolling independently of playback
     main_view : prompt_toolkit.layout.containers.HSplit
         main layout for the app
+    search_index : search.SearchIndex
+        index used to search the playback's history; None to search by scanning
+    max_fps : float
+        most redraws a second that request_redraw will cause
 
         
 
@@ -60,23 +91,55 @@ class HspApp(Application):
         Returns bottom toolbar for app
     render_command(self, command)
         Return string of command object specific to this UI
+    prerender(self)
+        Renders the commands just after the playback position into render_cache
+    get_user_input(self, title, accept_handler, multiline=True)
+        Modifies the display to add an area for the user to enter text
     get_user_comment(self)
         Modifies the display to add an area to enter a comment for a command
     _set_user_comment(self, buff)
         Callback fuction from the BufferControl created for user comments
+    get_goto_target(self)
+        Modifies the display to add an area to enter where to seek to
+    _set_goto_target(self, buff)
+        Callback function from the BufferControl created for seeking
+    get_search_query(self)
+        Modifies the display to add an area to enter a search query
+    _set_search_query(self, buff)
+        Callback function from the BufferControl created for searching
+    goto_match(self, forward=True)
+        Seeks the playback to the next or previous search match
+    get_view_filter(self)
+        Modifies the display to add an area to enter a filter for the playback
+    _set_view_filter(self, buff)
+        Callback function from the BufferControl created for filtering
+    refresh_after_seek(self)
+        Reloads the local cache from the playback's new position
     update_display
         displays last N commands in the local cache
+    debug_text(self)
+        Returns the text of the metrics overlay
+    request_redraw(self)
+        Asks for a redraw, coalescing requests to at most max_fps a second
 
 
     Async Methods
     =============
     command_loop(self)
         Primary loop for receiving/displaying commands from playback
-    redraw_timer(self)
-        Async method to force a redraw of the app every hundreth second
+    toolbar_clock(self)
+        Async method to redraw the toolbar's playback time while playing
     """
 
-    def __init__(self, playback, save_location=None, *args, **kwargs):
+    def __init__(
+        self,
+        playback,
+        save_location=None,
+        search_index=None,
+        max_fps=MAX_FPS,
+        *args,
+        **kwargs,
+    ):
 
         self.mainViewCondition = partial(self.mainView, self)
         self.mainViewCondition = Condition(self.mainViewCondition)
@@ -91,37 +154,76 @@ class HspApp(Application):
         self.displayingHelpScreen = (
             False
         )  # used to toggle between help screen on normal
+        self.displayingDebug = False
+        self.displayingTimeline = True
+        self.max_fps = max_fps
+        self._redraw_pending = False
+        self._last_redraw = 0.0
+        self._render_started = None
+        self.before_render += self._before_render
+        self.after_render += self._after_render
 
         if save_location:
             self.save_location = save_location
         else:
             self.save_location = SAVE_LOCATION
         self.playback = playback
+        self.search_index = search_index or SearchIndex(playback.table)
+        self._search = None  # (query, regex) of the last search
+        self._matches = []
+        self._matched_length = 0  # history length when _matches was found
         self._savedLayout = Layout(Window())
         self.command_cache = deque([], maxlen=5)
+        self.render_cache = OrderedDict()
+        self._prerender_scheduled = False
 
         ##########################################
         ### Setting up views
         ##########################################
 
-        self.old_command_window = FormattedTextControl(
-            text="Output goes here", focusable=True
-        )
-        self.new_command_window = FormattedTextControl(
-            text="Output goes here", focusable=True
-        )
-
-        self.body = Frame(
-            HSplit(
-                [
-                    Frame(Window(self.old_command_window)),
-                    Frame(Window(self.new_command_window)),
-                ]
-            )
+        self.old_command_window = OutputControl(text="Output goes here", focusable=True)
+        self.new_command_window = OutputControl(text="Output goes here", focusable=True)
+
+        self.timeline = TimelineControl(playback, on_seek=self.refresh_after_seek)
+
+        self.body = FloatContainer(
+            Frame(
+                VSplit(
+                    [
+                        ConditionalContainer(
+                            Frame(
+                                Window(self.timeline, width=Dimension(weight=1)),
+                                title="timeline",
+                            ),
+                            filter=Condition(lambda: self.displayingTimeline),
+                        ),
+                        HSplit(
+                            [
+                                Frame(Window(self.old_command_window)),
+                                Frame(Window(self.new_command_window)),
+                            ],
+                            width=Dimension(weight=2),
+                        ),
+                    ]
+                )
+            ),
+            floats=[
+                Float(
+                    ConditionalContainer(
+                        Frame(
+                            Window(FormattedTextControl(self.debug_text)),
+                            title="metrics (d to close)",
+                        ),
+                        filter=Condition(lambda: self.displayingDebug),
+                    ),
+                    top=1,
+                    right=2,
+                )
+            ],
         )
         self.toolbar = Window(
             FormattedTextControl(text=self.toolbar_text),
-            height=Dimension(max=1, weight=10000),
+            height=Dimension.exact(1),
             dont_extend_height=True,
         )
 
@@ -150,7 +252,7 @@ class HspApp(Application):
         self._saved_layout = self.layout
         yield
         self.layout = self._saved_layout
-        self.invalidate()
+        self.request_redraw()
 
     @contextmanager
     def paused_playback(self):
@@ -230,15 +332,93 @@ class HspApp(Application):
         @bindings.add("c-s", filter=self.mainViewCondition)
         def _(event):
             time = datetime.datetime.now()
-            with open(
-                self.save_location + f"_{time.strftime('%Y%m%d%H%M')}", "wb+"
-            ) as outfi:
-                pickle.dump(self.playback.hist, outfi)
+            sessionfile.save(
+                self.playback.table,
+                self.save_location + f"_{time.strftime('%Y%m%d%H%M')}",
+            )
 
         @bindings.add("g", filter=self.mainViewCondition)
         def _(event):
-            # future: goto time
-            pass
+            self.get_goto_target()
+
+        @bindings.add("]", filter=self.mainViewCondition)
+        def _(event):
+            if self.playback.goto_flagged(forward=True):
+                self.refresh_after_seek()
+
+        @bindings.add("[", filter=self.mainViewCondition)
+        def _(event):
+            if self.playback.goto_flagged(forward=False):
+                self.refresh_after_seek()
+
+        @bindings.add("/", filter=self.mainViewCondition)
+        def _(event):
+            self.get_search_query()
+
+        @bindings.add(".", filter=self.mainViewCondition)
+        def _(event):
+            self.goto_match(forward=True)
+
+        @bindings.add(",", filter=self.mainViewCondition)
+        def _(event):
+            self.goto_match(forward=False)
+
+        @bindings.add("v", filter=self.mainViewCondition)
+        def _(event):
+            self.get_view_filter()
+
+        @bindings.add("pagedown", filter=self.mainViewCondition)
+        def _(event):
+            self.new_command_window.page_down()
+
+        @bindings.add("pageup", filter=self.mainViewCondition)
+        def _(event):
+            self.new_command_window.page_up()
+
+        @bindings.add("j", filter=self.mainViewCondition)
+        def _(event):
+            self.new_command_window.scroll(1)
+
+        @bindings.add("k", filter=self.mainViewCondition)
+        def _(event):
+            self.new_command_window.scroll(-1)
+
+        @bindings.add("home", filter=self.mainViewCondition)
+        def _(event):
+            self.new_command_window.home()
+
+        @bindings.add("end", filter=self.mainViewCondition)
+        def _(event):
+            self.new_command_window.end()
+
+        @bindings.add("t", filter=self.mainViewCondition)
+        def _(event):
+            self.displayingTimeline = not self.displayingTimeline
+
+        @bindings.add("J", filter=self.mainViewCondition)
+        def _(event):
+            self.timeline.scroll(1)
+
+        @bindings.add("K", filter=self.mainViewCondition)
+        def _(event):
+            self.timeline.scroll(-1)
+
+        @bindings.add("c-d", filter=self.mainViewCondition)
+        def _(event):
+            self.timeline.page_down()
+
+        @bindings.add("c-u", filter=self.mainViewCondition)
+        def _(event):
+            self.timeline.page_up()
+
+        @bindings.add("G", filter=self.mainViewCondition)
+        def _(event):
+            self.timeline.end()
+
+        @bindings.add("d", filter=self.mainViewCondition)
+        def _(event):
+            self.displayingDebug = not self.displayingDebug
+            self.request_redraw()
 
         @bindings.add("h")
         def _(event):
@@ -248,14 +428,14 @@ class HspApp(Application):
                 event.app.displayingHelpScreen = False
                 self.playback.pause()
                 event.app.layout = event.app.savedLayout
-                event.app.invalidate()
+                self.request_redraw()
 
             else:
                 # display help screen
                 event.app.displayingHelpScreen = True
                 event.app.savedLayout = event.app.layout
                 event.app.layout = self.helpLayout
-                event.app.invalidate()
+                self.request_redraw()
 
     helpLayout = Layout(
         Frame(
@@ -266,7 +446,21 @@ class HspApp(Application):
                     "s -        slow down\n"
                     "p -        toggle play/pause\n"
                     "c -        add comment to current command\n"
-                    "g -        goto specific time in history\n"
+                    "g -        goto time, +/-offset (e.g. -30s, +5m), or #index\n"
+                    "] / [      next / previous flagged event\n"
+                    "/ -        search commands and results (re:<regex> for a regex)\n"
+                    ". / ,      next / previous search match\n"
+                    "v -        play only matching commands (user=, host=, source=,\n"
+                    "           from=, to=, flagged, re:<regex>); empty for all\n"
+                    "j / k      scroll the current command's output by a line\n"
+                    "pgdn/pgup  scroll the current command's output by a page\n"
+                    "home/end   jump to the start / end of the output\n"
+                    "t -        toggle the timeline of played commands\n"
+                    "J / K      scroll the timeline by a command\n"
+                    "ctrl-d/u   scroll the timeline by a page\n"
+                    "G -        follow the latest command in the timeline\n"
+                    "           (click a command in the timeline to go back to it)\n"
+                    "d -        toggle metrics overlay\n"
                     "ctrl-m     change self.playback mode\n"
                     "ctrl-f     flag event\n"
                     "ctrl-s     save playback object to file\n"
@@ -315,7 +509,48 @@ class HspApp(Application):
         =======
         _ : str
             String representation of Command object
+
+        Commands that are rows of a CommandTable are rendered once per
+        version of the row (see CommandTable.version) and kept in
+        render_cache, so flagging or commenting a command only re-renders
+        that command.
+        """
+        try:
+            table = command._table
+            key = (id(table), command._row, table.version(command._row))
+        except AttributeError:
+            # not a row of a table; nothing to key a cache entry on
+            with metrics.timer("hsp_render_command_seconds"):
+                return self._render_command(command)
+        try:
+            cached_table, fragments = self.render_cache[key]
+        except KeyError:
+            pass
+        else:
+            if cached_table is table:
+                self.render_cache.move_to_end(key)
+                metrics.inc("hsp_render_cache_hits_total")
+                return fragments
+        with metrics.timer("hsp_render_command_seconds"):
+            fragments = self._render_command(command)
+        self.render_cache[key] = (table, fragments)
+        if len(self.render_cache) > RENDER_CACHE_SIZE:
+            self.render_cache.popitem(last=False)
+        return fragments
+
+    def prerender(self):
+        """Renders the commands just after the playback position into render_cache
+
+        Run while the event loop is idle after a display update, so that
+        reading and formatting the next commands (including results still in
+        their history files) is done before they are due.
         """
+        self._prerender_scheduled = False
+        position = self.playback.playback_position
+        for command in self.playback.hist[position : position + PRERENDER_AHEAD]:
+            self.render_command(command)
+
+    def _render_command(self, command):
         try:
             if command.flagged:
                 color = "ansired"
@@ -340,33 +575,52 @@ class HspApp(Application):
             # but we can have it rendered in the window anyway
             return [(color, str(command))]
 
-    def get_user_comment(self):
-        """Modifies the display to add an area to enter a comment for a command
+    def get_user_input(self, title, accept_handler, multiline=True):
+        """Modifies the display to add an area for the user to enter text
 
         Creates a BufferControl in a Frame and replaces the toolbar with the Frame
 
+        Parameters
+        ==========
+        title : str
+            Title of the frame around the input area
+        accept_handler : callable
+            Called with the Buffer when the user submits the text
+        multiline : bool
+            If True, Enter adds a newline and alt-Enter submits;
+            otherwise Enter submits
+
         #bug: the new toolbar is unable to get focus right away; it requires the user to click 
                 in the area
         """
         self._savedLayout = self.layout
-        self.disabled_bindings=True
-        commentControl = BufferControl(
-            Buffer(accept_handler=self._set_user_comment), focus_on_click=True
+        self.disabled_bindings = True
+        inputControl = BufferControl(
+            Buffer(accept_handler=accept_handler, multiline=multiline),
+            focus_on_click=True,
         )
-        user_in_area = Frame(
-            Window(
-                commentControl,
-                height=Dimension(max=1, weight=10000),
-                dont_extend_height=True,
-            ),
-            title="Enter Comment (alt-Enter to submit)",
+        input_window = Window(
+            inputControl, height=Dimension.exact(1), dont_extend_height=True
         )
+        user_in_area = Frame(input_window, title=title)
 
         self.toolbar = user_in_area
         self.main_view = HSplit([self.body, self.toolbar], padding_char="-")
-        self.layout = Layout(self.main_view, focused_element=user_in_area.body)
-        self.layout.focus(user_in_area.body)
-        self.invalidate()
+        self.layout = Layout(self.main_view, focused_element=input_window)
+        self.request_redraw()
+
+    def _restore_user_input(self):
+        """Replaces the original layout after get_user_input
+        """
+        self.disabled_bindings = False
+        self.layout = self._savedLayout
+
+    def get_user_comment(self):
+        """Modifies the display to add an area to enter a comment for a command
+        """
+        self.get_user_input(
+            "Enter Comment (alt-Enter to submit)", self._set_user_comment
+        )
 
     def _set_user_comment(self, buff):
         """Callback fuction from the BufferControl created for user comments
@@ -374,11 +628,142 @@ class HspApp(Application):
         Takes the user comment and sets that as the current command's comment.
         Then replaces the original layout.
         """
-        self.playback.hist[self.playback.playback_position - 1].comment = buff.text
-        self.disabled_bindings=False
-        self.layout = self._savedLayout
+        self.playback.comment_current_command(buff.text)
+        self._restore_user_input()
+        self.update_display()
+        self.request_redraw()
+
+    def get_goto_target(self):
+        """Modifies the display to add an area to enter where to seek to
+
+        Accepts anything Playback.seek does: a date and/or time, a relative
+        offset such as -30s or +5m, or #index.
+        """
+        self.get_user_input(
+            "Go to time, +/-offset, or #index (Enter to submit)",
+            self._set_goto_target,
+            multiline=False,
+        )
+
+    def _set_goto_target(self, buff):
+        """Callback function from the BufferControl created for seeking
+
+        Seeks the playback to the entered position and replaces the original
+        layout.  Input that can't be understood leaves the playback where it was.
+        """
+        self._restore_user_input()
+        try:
+            self.playback.seek(buff.text)
+        except ValueError:
+            pass
+        else:
+            self.refresh_after_seek()
+        self.request_redraw()
+
+    def get_search_query(self):
+        """Modifies the display to add an area to enter a search query
+
+        The query is found anywhere in a command or its result, ignoring case;
+        a query starting with re: is a regular expression instead.
+        """
+        self.get_user_input(
+            "Search (re:<regex> for a regex; Enter to submit)",
+            self._set_search_query,
+            multiline=False,
+        )
+
+    def _set_search_query(self, buff):
+        """Callback function from the BufferControl created for searching
+
+        Finds the matches for the entered query and seeks the playback to the
+        first one after the current command.  An invalid regex or a query with
+        no matches leaves the playback where it was.
+        """
+        self._restore_user_input()
+        query = buff.text
+        regex = query.startswith("re:")
+        if regex:
+            query = query[len("re:") :]
+        if query:
+            self._search = (query, regex)
+            self._matched_length = -1  # search again
+            self.goto_match(forward=True)
+        self.request_redraw()
+
+    def goto_match(self, forward=True):
+        """Seeks the playback to the next or previous search match
+
+        Matches are found again if the history has grown since the last
+        search, e.g. in follow mode.
+
+        Parameters
+        ==========
+        forward : bool
+            seek to the match after the current command if True, before it
+            otherwise
+        """
+        if self._search is None:
+            return
+        if self._matched_length != len(self.playback.table):
+            query, regex = self._search
+            try:
+                self._matches = self.search_index.search(query, regex)
+            except re.error:
+                self._search = None
+                self._matches = []
+                return
+            self._matched_length = len(self.playback.table)
+        matches = self._matches
+        if isinstance(self.playback.hist, HistoryView):
+            matches = self.playback.hist.local_positions(matches)
+        if self.playback.goto_next_of(matches, forward):
+            self.refresh_after_seek()
+
+    def get_view_filter(self):
+        """Modifies the display to add an area to enter a filter for the playback
+
+        Accepts anything views.parse_filter does, e.g. user=root flagged
+        """
+        self.get_user_input(
+            "Filter: user= host= source= from= to= flagged re: (Enter to submit)",
+            self._set_view_filter,
+            multiline=False,
+        )
+
+    def _set_view_filter(self, buff):
+        """Callback function from the BufferControl created for filtering
+
+        Plays only the commands passing the entered filter, or the whole
+        history if it is empty.  A filter that can't be understood leaves the
+        playback as it was.
+        """
+        self._restore_user_input()
+        try:
+            view = parse_filter(
+                self.playback.view(),
+                buff.text,
+                default=self.playback.current_time.replace(microsecond=0),
+            )
+        except ValueError:
+            pass
+        else:
+            self.playback.play_view(view if buff.text.strip() else None)
+            self.refresh_after_seek()
+        self.request_redraw()
+
+    def refresh_after_seek(self):
+        """Reloads the local cache from the playback's new position
+
+        After a seek the commands in command_cache are no longer the most
+        recent ones played, so replace them with the commands just before the
+        new playback position.
+        """
+        position = self.playback.playback_position
+        self.command_cache.clear()
+        self.command_cache.extend(
+            self.playback.hist[max(position - self.command_cache.maxlen, 0) : position]
+        )
         self.update_display()
-        self.invalidate()
 
     def update_display(self):
         """displays last N commands in the local cache
@@ -389,6 +774,10 @@ class HspApp(Application):
         #future: allow the number of commands displayed to grow to the size of the 
                 available screen realastate
         """
+        with metrics.timer("hsp_update_display_seconds"):
+            self._update_display()
+
+    def _update_display(self):
 
         self.layout.focus(self.old_command_window)
         if len(self.command_cache) > 1:
@@ -405,8 +794,63 @@ class HspApp(Application):
             )
         else:
             self.layout.current_control.text = "COMMAND OUTPUT HERE"
+        self.request_redraw()
+        if not self._prerender_scheduled:
+            self._prerender_scheduled = True
+            asyncio.get_event_loop().call_soon(self.prerender)
+
+    def debug_text(self):
+        """Returns the text of the metrics overlay
+
+        Returns
+        =======
+        _ : str
+            collected metrics and the playback's delivery lag
+        """
+        lag = self.playback.lag
+        return (
+            f"{metrics.format_text()}\n\n"
+            f"lag: last={lag['last'] * 1000:.1f}ms mean={lag['mean'] * 1000:.1f}ms "
+            f"max={lag['max'] * 1000:.1f}ms over {lag['count']} events"
+        )
+
+    def request_redraw(self):
+        """Asks for a redraw, coalescing requests to at most max_fps a second
+
+        Everything that changes what is on screen calls this rather than
+        invalidate.  A request made less than 1/max_fps seconds after the
+        last redraw is put off until then, and any more requests before that
+        share the one redraw.
+        """
+        metrics.inc("hsp_redraw_requests_total")
+        if self._redraw_pending:
+            return
+        delay = self._last_redraw + 1 / self.max_fps - time.monotonic()
+        if delay <= 0:
+            self._redraw()
+        else:
+            self._redraw_pending = True
+            asyncio.get_event_loop().call_later(delay, self._redraw)
+
+    def _redraw(self):
+        self._redraw_pending = False
+        self._last_redraw = time.monotonic()
         self.invalidate()
 
+    def _before_render(self, app):
+        if metrics.enabled:
+            self._render_started = time.perf_counter()
+
+    def _after_render(self, app):
+        # key presses redraw without going through request_redraw
+        self._last_redraw = time.monotonic()
+        metrics.inc("hsp_redraws_total")
+        if self._render_started is not None:
+            metrics.observe(
+                "hsp_redraw_seconds", time.perf_counter() - self._render_started
+            )
+            self._render_started = None
+
     ###################################################
     # Setting Up Loop to async iter over history
     ###################################################
@@ -433,12 +877,13 @@ class HspApp(Application):
             self.command_cache.append(command)
             self.update_display()
 
-    async def redraw_timer(self):
-        """Async method to force a redraw of the app every hundreth second
+    async def toolbar_clock(self):
+        """Async method to redraw the toolbar's playback time while playing
 
-        Never terminates
-        # future: do some more checking and error handling
+        The playback time only changes on its own while the playback is
+        playing, so nothing is redrawn while it is paused.  Never terminates
         """
         while True:
-            await asyncio.sleep(0.01)
-            self.invalidate()
+            await asyncio.sleep(TOOLBAR_TICK)
+            if not self.playback.paused:
+                self.request_redraw()
@@ -0,0 +1,245 @@
+"""Defines the append-only journal that keeps annotations between sessions
+
+Flagging a command or commenting on it appends one small record to a sidecar
+file, so annotations are kept as they are made instead of only when the whole
+history is saved.  Records name a command by its identity (see command_key)
+rather than its position, so they still apply when the same histories are
+loaded again, merged in a different order, or saved and reopened as a session.
+"""
+
+import bisect
+import json
+import os
+
+JOURNAL_FILE = "sessions/annotations.journal"
+
+# annotation fields a journal may change, and the type of each
+FIELDS = {"flagged": bool, "comment": str}
+
+
+def command_key(table, position):
+    """Return the stable identity of the command at a position of a table
+
+    A command is identified by its source file, time, user, host and command
+    text, plus how many identical commands come before it at the same time.
+
+    Parameters
+    ==========
+    table : commandtable.CommandTable
+        history holding the command
+    position : int
+        position of the command in table
+
+    Returns
+    =======
+    key : list
+        [source, seconds, user, hostUUID, command, n]; a list so that it
+        round-trips through json unchanged
+    """
+    seconds = table.times[position]
+    command = table[position]
+    fields = [command.source, seconds, command.user, command.hostUUID, command.command]
+    n = 0
+    for earlier in range(bisect.bisect_left(table.times, seconds), position):
+        if _fields(table, earlier) == fields:
+            n += 1
+    return fields + [n]
+
+
+def find_command(table, key):
+    """Return the position of the command with a key, or None if it isn't there
+
+    Parameters
+    ==========
+    table : commandtable.CommandTable
+        history to search
+    key : list
+        identity returned by command_key
+
+    Returns
+    =======
+    position : int
+    """
+    *fields, n = key
+    seconds = fields[1]
+    lo = bisect.bisect_left(table.times, seconds)
+    hi = bisect.bisect_right(table.times, seconds, lo)
+    for position in range(lo, hi):
+        if _fields(table, position) == fields:
+            if not n:
+                return position
+            n -= 1
+    return None
+
+
+def _fields(table, position):
+    command = table[position]
+    return [
+        command.source,
+        table.times[position],
+        command.user,
+        command.hostUUID,
+        command.command,
+    ]
+
+
+def _ends_line(filename):
+    """Return True if a file is empty or ends with a newline
+    """
+    with open(filename, "rb") as infi:
+        infi.seek(0, os.SEEK_END)
+        if not infi.tell():
+            return True
+        infi.seek(-1, os.SEEK_END)
+        return infi.read(1) == b"\n"
+
+
+class AnnotationJournal:
+    """Append-only file of flag and comment changes
+
+    Each change is one json line: {"key": <command_key>, "flagged": bool} or
+    {"key": <command_key>, "comment": str}.  Lines are flushed to disk as they
+    are written.  A partial last line (e.g. from a crash) is ignored, as are
+other lines that aren't such records and any other fields.
+
+    Attributes
+    ==========
+    filename : str
+        location of the journal file
+    records : int
+        number of records in the file
+
+    Methods
+    =======
+    read(self)
+        latest annotations in the journal by command key
+    apply(self, table)
+        set the journal's annotations on the commands of a table
+    record(self, table, position, **changes)
+        append a change to the command at a position of a table
+    compact(self, annotations=None)
+        rewrite the journal with only the latest annotation of each command
+    close(self)
+        close the journal file
+    """
+
+    # compact when at least this many records are superseded
+    COMPACT_MIN = 1000
+
+    def __init__(self, filename=JOURNAL_FILE):
+        self.filename = filename
+        self.records = 0
+        self._outfi = None
+
+    def read(self):
+        """latest annotations in the journal by command key
+
+        Returns
+        =======
+        annotations : dict
+            tuple(command_key) -> {"flagged": bool, "comment": str}, holding
+            only the fields that have been changed
+        """
+        annotations = {}
+        self.records = 0
+        try:
+            infi = open(self.filename, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return annotations
+        with infi:
+            for line in infi:
+                try:
+                    record = json.loads(line)
+                    key = tuple(record["key"])
+                    hash(key)
+                except (ValueError, KeyError, TypeError):
+                    continue  # e.g. a line cut off or corrupted
+                changes = {
+                    field: val
+                    for field, val in record.items()
+                    if field in FIELDS and isinstance(val, FIELDS[field])
+                }
+                if changes:
+                    annotations.setdefault(key, {}).update(changes)
+                    self.records += 1
+        return annotations
+
+    def apply(self, table):
+        """set the journal's annotations on the commands of a table
+
+        Annotations for commands that aren't in table are kept in the journal
+        for when they are loaded again.  If most of the journal has been
+        superseded it is compacted.
+
+        Parameters
+        ==========
+        table : commandtable.CommandTable
+            history to annotate
+
+        Returns
+        =======
+        positions : list[int]
+            positions of the commands that were annotated
+        """
+        annotations = self.read()
+        positions = []
+        for key, changes in annotations.items():
+            position = find_command(table, list(key))
+            if position is None:
+                continue
+            command = table[position]
+            for field, val in changes.items():
+                setattr(command, field, val)
+            positions.append(position)
+        if self.records - len(annotations) >= self.COMPACT_MIN:
+            self.compact(annotations)
+        return positions
+
+    def record(self, table, position, **changes):
+        """append a change to the command at a position of a table
+
+        Parameters
+        ==========
+        table : commandtable.CommandTable
+            history holding the command
+        position : int
+            position of the command in table
+        changes : dict
+            new values of flagged and/or comment
+        """
+        if self._outfi is None:
+            self._outfi = open(self.filename, "a", encoding="utf-8")
+            if not _ends_line(self.filename):
+                # don't run on from a partial record left by a crash
+                self._outfi.write("\n")
+        changes["key"] = command_key(table, position)
+        self._outfi.write(json.dumps(changes) + "\n")
+        self._outfi.flush()
+        os.fsync(self._outfi.fileno())
+        self.records += 1
+
+    def compact(self, annotations=None):
+        """rewrite the journal with only the latest annotation of each command
+
+        The new journal is written beside the old one and moved over it, so a
+        crash part way through leaves the old journal intact.
+        """
+        if annotations is None:
+            annotations = self.read()
+        self.close()
+        tmp = self.filename + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as outfi:
+            for key, changes in annotations.items():
+                changes = dict(changes, key=list(key))
+                outfi.write(json.dumps(changes) + "\n")
+            outfi.flush()
+            os.fsync(outfi.fileno())
+        os.replace(tmp, self.filename)
+        self.records = len(annotations)
+
+    def close(self):
+        """close the journal file
+        """
+        if self._outfi is not None:
+            self._outfi.close()
+            self._outfi = None
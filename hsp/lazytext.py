@@ -0,0 +1,181 @@
+"""Defines references to text that stays in its source file until it is needed
+
+Loaders can record where a command's result (or comment) lives in the history
+file instead of reading it into memory.  The text is read through a memory map
+on first access and recently used text is kept in a bounded LRU cache.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import mmap
+
+CACHE_LIMIT = 64 * 1024 * 1024  # characters of decoded text kept in the cache
+
+_cache = OrderedDict()  # (filename, offset, length) -> str, oldest first
+_cache_size = 0
+_maps = {}  # filename -> mmap.mmap
+_pinned = set()  # filenames whose maps are kept open, see pin
+_uncached = 0  # depth of uncached() blocks being run
+
+
+class LazyText:
+    """Reference to text stored in a file, read on first access
+
+    Attributes
+    ==========
+    filename : str
+        file containing the text
+    offset : int
+        byte offset of the text in the file
+    length : int
+        length of the text in bytes
+
+    Methods
+    =======
+    read(self)
+        return the text, reading it from the file if it isn't cached
+    """
+
+    __slots__ = ("filename", "offset", "length")
+
+    def __init__(self, filename, offset, length):
+        self.filename = filename
+        self.offset = offset
+        self.length = length
+
+    def __repr__(self):
+        return f"LazyText({self.filename!r}, {self.offset}, {self.length})"
+
+    def __str__(self):
+        return self.read()
+
+    def read(self):
+        """return the text, reading it from the file if it isn't cached
+
+        Returns
+        =======
+        _ : str
+            the decoded text
+        """
+        global _cache_size
+
+        if _uncached:
+            return decode(_read(self.filename, self.offset, self.length))
+        key = (self.filename, self.offset, self.length)
+        try:
+            _cache.move_to_end(key)
+            return _cache[key]
+        except KeyError:
+            pass
+
+        text = decode(_read(self.filename, self.offset, self.length))
+        _cache[key] = text
+        _cache_size += len(text)
+        while _cache_size > CACHE_LIMIT and len(_cache) > 1:
+            _, old = _cache.popitem(last=False)
+            _cache_size -= len(old)
+        return text
+
+
+def resolve(val):
+    """Return val, or the text it refers to if it is a LazyText
+    """
+    if isinstance(val, LazyText):
+        return val.read()
+    return val
+
+
+def decode(raw):
+    """Decode bytes read from a history file as text mode would
+
+    Parameters
+    ==========
+    raw : bytes
+        bytes from the file
+
+    Returns
+    =======
+    text : str
+        utf-8 decoded text with Windows line endings normalized
+    """
+    text = raw.decode("utf-8", "replace")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+    return text
+
+
+@contextmanager
+def uncached():
+    """Context manager in which text is read from its file without the cache
+
+    For a single pass over a whole history, such as an export: caching each
+    text would only push the text being displayed out of the cache.
+    """
+    global _uncached
+
+    _uncached += 1
+    try:
+        yield
+    finally:
+        _uncached -= 1
+
+
+def clear_cache():
+    """Drop cached text and close the memory maps of source files
+
+    Maps of pinned files are kept, since their files may be gone.
+    """
+    global _cache_size
+
+    _cache.clear()
+    _cache_size = 0
+    for filename in list(_maps):
+        if filename not in _pinned:
+            _maps.pop(filename).close()
+
+
+def pin(filename):
+    """Map a file now and keep it mapped for the life of the process
+
+    A mapping outlives the removal of its file, so text can still be read
+    from a file that something else may delete, e.g. a cache.ParseCache
+    entry evicted by another process.
+
+    Raises
+    ======
+    OSError
+        if the file can't be opened
+    """
+    if filename not in _pinned:
+        _map(filename, 0)
+        _pinned.add(filename)
+
+
+def pinned(filename):
+    """Return whether a file has been pinned
+    """
+    return filename in _pinned
+
+
+def _map(filename, end):
+    """Return the shared memory map of a file, mapping at least end bytes
+
+    The map is re-created if the file has grown past the end of the current
+    one, e.g. a log that is still being written.
+    """
+    mm = _maps.get(filename)
+    if mm is None or end > len(mm):
+        with open(filename, "rb") as infi:
+            new = mmap.mmap(infi.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm is not None:
+            mm.close()
+        mm = _maps[filename] = new
+    return mm
+
+
+def _read(filename, offset, length):
+    """Read bytes from a file through a shared memory map
+    """
+    if not length:
+        return b""
+    return _map(filename, offset + length)[offset : offset + length]
@@ -1,23 +1,53 @@
 """module that defines history loaders
 
 The root class is PBLoader, an AbstractBaseClass.  To implement a new loader,
-inherit from PBLoader and implement the 'load' classmethod; then update the load_all
-method to point a keyword to the class.
+inherit from PBLoader with the histfile_typehint keyword it handles, e.g.
 
-In the future, users will be able to create a new PBLoader and allow the sub-class
-to register for histfile_typehint keywords directly without having to mod the 
-master class.
+    class MyPBLoader(PBLoader, typehint="my_format"):
+
+and implement the 'load' classmethod, plus 'sniff' if files of that type can be
+recognized from their first few KB.  Subclasses register themselves, so
+load_all needs no changes.
+
+Loaders in other packages can register under the "hsp.loaders" entry point
+group (name = typehint, value = "module:Class"); their modules are only
+imported when their typehint is used or no built-in loader recognizes a file.
 """
 
 from abc import ABC, abstractmethod
 import csv
 import datetime as dt
 from dateutil.parser import parse as parsedate
+from functools import partial
+from itertools import islice
 import json
+import logging
+import mmap
 import pickle
 import re
+import time
+
+try:
+    import orjson  # optional; parses JSON Lines faster than json
+except ImportError:
+    orjson = None
+
+from command import Command, to_seconds
+from commandtable import CommandTable
+from lazytext import LazyText, decode
+import metrics
+import sessionfile
+
+# parsers also run under the full-screen app (follow mode), where printing
+# would write over it, so what they report is logged, and shown only where
+# logging has been configured
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
 
-from command import Command
+
+class UnknownFormatError(ValueError):
+    """Raised when no loader is registered for, or recognizes, a history file
+    """
 
 
 class PBLoader(ABC):
@@ -32,8 +62,45 @@ class PBLoader(ABC):
     @abstractmethod
     load(cls, filename) -> list[command.Command]
         load a history from a filename
+
+    @classmethod
+    iter_load(cls, filename) -> iterator[command.Command]
+        yield the Commands of a history one at a time
+
+    @classmethod
+    sniff(cls, head) -> bool
+        does the start of a file look like this loader's format
+
+    Class Attributes
+    ================
+    typehint : str
+        histfile_typehint keyword the loader is registered under
+    supports_lazy : bool
+        load accepts lazy=True to leave results in the file
+    version : int
+        bump whenever a change to the loader alters what it returns, so that
+        histories parsed by the old version are dropped from the parse cache
+    cacheable : bool
+        whether parsed histories are worth keeping in a cache.ParseCache
     """
 
+    typehint = None
+    supports_lazy = False
+    version = 1
+    cacheable = True
+
+    SNIFF_SIZE = 4096  # bytes read from the start of a file to detect its type
+    ENTRY_POINT_GROUP = "hsp.loaders"
+
+    _registry = {}  # typehint -> loader class, in registration order
+    _plugins = None  # typehint -> entry point not yet imported
+
+    def __init_subclass__(cls, typehint=None, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if typehint:
+            cls.typehint = typehint
+            PBLoader._registry[typehint] = cls
+
     @classmethod
     @abstractmethod
     def load(cls, filename, user_hint=None, host_hint=None, date_hint=None):
@@ -59,55 +126,286 @@ class PBLoader(ABC):
         return []
 
     @classmethod
-    def load_all(cls, session_folder, histfile, histfile_typehint=None, hints=None):
-        if histfile_typehint == "pickle":
-            return PicklePBLoader.load(f"{session_folder}/{histfile}", **hints)
-        elif histfile_typehint == "msf_prompt":
-            return OffPromptPBLoader.load(f"{session_folder}/{histfile}", **hints)
-        elif histfile_typehint == "bash_hist":
-            return BashHistoryPBLoader.load(f"{session_folder}/{histfile}", **hints)
-        elif histfile_typehint == "generic_csv_hist":
-            return GenericCsvPBLoader.load(f"{session_folder}/{histfile}", **hints)
-        elif histfile_typehint == "generic_json_hist":
-            return GenericJsonPBLoader.load(f"{session_folder}/{histfile}", **hints)
-        elif histfile_typehint == "win_event_log_csv":
-            return WinEventLogCsvPBLoader.load(f"{session_folder}/{histfile}", **hints)
+    def iter_load(cls, filename, user_hint=None, host_hint=None, date_hint=None):
+        """Yield the Commands of a history one at a time
+
+        Loaders that can parse a file incrementally override this (and build
+        load from it) so that callers can stream a history without holding
+        every Command at once; the default just iterates over load.
+
+        Yields
+        ======
+        command.Command
+            Commands from the history in file order
+        """
+        for command in cls.load(filename, user_hint, host_hint, date_hint):
+            yield command
+
+    @classmethod
+    def sniff(cls, head):
+        """Does the start of a file look like this loader's format
+
+        Parameters
+        ==========
+        head : bytes
+            up to SNIFF_SIZE bytes from the start of the file
+
+        Returns
+        =======
+        bool
+            True if this loader should be used for the file
+        """
+        return False
+
+    @classmethod
+    def follow_parser(cls, filename, user_hint=None, host_hint=None, date_hint=None):
+        """Return a parser for data appended to a history file, for follow.py
+
+        Loaders that can parse a growing file a piece at a time override this.
+        The parser's feed(data) takes the bytes appended since the last call
+        and returns the Commands they complete; idle() is called when nothing
+        new was appended and returns any Commands that were being held back
+        in case more of them arrived.
+
+        Returns
+        =======
+        parser : object
+            None if the loader can't follow a file
+        """
+        return None
+
+    @classmethod
+    def _entry_points(cls):
+        """Return the plugin loaders' entry points by typehint, not yet imported
+        """
+        if PBLoader._plugins is None:
+            PBLoader._plugins = {}
+            try:
+                from importlib.metadata import entry_points
+
+                found = entry_points()
+                if hasattr(found, "select"):
+                    found = found.select(group=cls.ENTRY_POINT_GROUP)
+                else:
+                    found = found.get(cls.ENTRY_POINT_GROUP, [])
+            except ImportError:
+                try:
+                    from pkg_resources import iter_entry_points
+                except ImportError:
+                    return PBLoader._plugins
+                found = iter_entry_points(cls.ENTRY_POINT_GROUP)
+            for entry_point in found:
+                if entry_point.name not in PBLoader._registry:
+                    PBLoader._plugins[entry_point.name] = entry_point
+        return PBLoader._plugins
+
+    @classmethod
+    def get_loader(cls, typehint):
+        """Return the loader class registered for a typehint
+
+        A plugin loader's module is imported the first time it is asked for.
+
+        Returns
+        =======
+        loader : PBLoader subclass
+            None if no loader handles typehint
+        """
+        try:
+            return PBLoader._registry[typehint]
+        except KeyError:
+            pass
+        entry_point = cls._entry_points().pop(typehint, None)
+        if entry_point is None:
+            return None
+        loader = entry_point.load()
+        PBLoader._registry.setdefault(typehint, loader)
+        return PBLoader._registry[typehint]
+
+    @classmethod
+    def detect(cls, filename):
+        """Return the loader for a file by sniffing its first few KB
+
+        Registered loaders are asked in order; plugin modules are only
+        imported if none of the already registered loaders claim the file.
+
+        Returns
+        =======
+        loader : PBLoader subclass
+            None if no loader recognizes the file
+        """
+        with open(filename, "rb") as infi:
+            head = infi.read(cls.SNIFF_SIZE)
+        for loader in list(PBLoader._registry.values()):
+            if loader.sniff(head):
+                return loader
+        for typehint in list(cls._entry_points()):
+            loader = cls.get_loader(typehint)
+            if loader is not None and loader.sniff(head):
+                return loader
+        return None
+
+    @classmethod
+    def load_all(
+        cls,
+        session_folder,
+        histfile,
+        histfile_typehint=None,
+        hints=None,
+        lazy=False,
+        cache=None,
+    ):
+        """Load a history with the loader that matches histfile_typehint
+
+        Without a typehint, the loader is chosen by sniffing the start of the
+        file (see detect).
+
+        Parameters
+        ==========
+        session_folder : str
+            folder containing the history file
+        histfile : str
+            filename of the history file
+        histfile_typehint : str
+            keyword for the format of the history file
+        hints : dict
+            user_hint, host_hint and date_hint passed to the loader
+        lazy : bool
+            leave command results in the history file until they are used,
+            for loaders that support it
+        cache : cache.ParseCache
+            cache to look the parsed history up in and store it to; None to
+            always parse
+
+        Returns
+        =======
+        list[command.Command] or commandtable.CommandTable
+            Command objects from the history
+
+        Raises
+        ======
+        UnknownFormatError
+            if there is no loader for histfile_typehint, or none recognizes
+            the file
+        """
+        hints = hints or {}
+        filename = f"{session_folder}/{histfile}"
+        if histfile_typehint:
+            loader = cls.get_loader(histfile_typehint)
         else:
-            return []
+            loader = cls.detect(filename)
+        if loader is None:
+            raise UnknownFormatError(
+                f"no loader for {filename} ({histfile_typehint or 'unrecognized'})"
+            )
+        if cache is not None and loader.cacheable:
+            hist = cache.get(filename, loader, hints)
+            if hist is not None:
+                metrics.inc("hsp_parse_cache_hits_total", loader=loader.typehint)
+                return hist
+        started = time.perf_counter()
+        try:
+            if loader.supports_lazy:
+                hist = loader.load(filename, lazy=lazy, **hints)
+            else:
+                hist = loader.load(filename, **hints)
+        except Exception:
+            metrics.inc("hsp_loader_errors_total", loader=loader.typehint)
+            raise
+        metrics.inc("hsp_loader_rows_total", len(hist), loader=loader.typehint)
+        metrics.inc(
+            "hsp_loader_seconds_total",
+            time.perf_counter() - started,
+            loader=loader.typehint,
+        )
+        if cache is not None and loader.cacheable:
+            if not isinstance(hist, CommandTable):
+                hist = CommandTable(hist)
+            cache.put(filename, loader, hist, hints)
+        return hist
 
 
-class PicklePBLoader(PBLoader):
+class PicklePBLoader(PBLoader, typehint="pickle"):
     """Class for loading pickled lists of commands.
     """
 
+    @classmethod
+    def sniff(cls, head):
+        # protocol 2 and later start with the PROTO opcode
+        return len(head) > 1 and head[0] == 0x80 and 2 <= head[1] <= 5
+
     @classmethod
     def load(cls, filename, user_hint=None, host_hint=None, date_hint=None):
         """Load history for pickled list of Commands
 
         This loader assumes that the pickle being loaded is already
-        a list of Command objects.  It creates a new list to verify that
-        what was loaded is in fact a list of Command objects and will drop
-        anything that is not.
+        a list of Command objects or a commandtable.CommandTable.  For a list,
+        it creates a new list to verify that what was loaded is in fact a list
+        of Command objects and will drop anything that is not.
 
         Returns
         =======
-        list[command.Command]
-            List of Command objects from pickle file
+        list[command.Command] or commandtable.CommandTable
+            Command objects from pickle file
         """
 
         commands = pickle.load(open(filename, "rb"))
+        if isinstance(commands, CommandTable):
+            return commands
         hist = [x for x in commands if isinstance(x, Command)]
         return hist
 
 
-class OffPromptPBLoader(PBLoader):
-    """Class for loading histories generated by an msf_prompt.OffPromptSession 
+class SessionPBLoader(PBLoader, typehint="session"):
+    """Class for loading sessions saved in the sessionfile binary format
     """
 
+    cacheable = False  # already as quick to open as a cache entry
+
+    @classmethod
+    def sniff(cls, head):
+        return head.startswith(sessionfile.MAGIC)
+
     @classmethod
     def load(cls, filename, user_hint=None, host_hint=None, date_hint=None):
+        """Load history from a session file
+
+        The file is memory-mapped rather than read; see sessionfile.load.
+
+        Returns
+        =======
+        commandtable.CommandTable
+            Commands from the session file
+        """
+        return sessionfile.load(filename)
+
+
+class OffPromptPBLoader(PBLoader, typehint="msf_prompt"):
+    """Class for loading histories generated by an msf_prompt.OffPromptSession 
+    """
+
+    supports_lazy = True
+
+    _COMMAND_TAG = b"[COMMAND][USER: "
+    _RESULT_TAG = b"[RESULT]"
+
+    @classmethod
+    def sniff(cls, head):
+        return _FIRST_RECORD.match(head) is not None
+
+    @classmethod
+    def load(cls, filename, user_hint=None, host_hint=None, date_hint=None, lazy=False):
         """Load log from msf_prompt.OffPromptSession
 
+        See iter_load for the log format.
+        """
+        return list(cls.iter_load(filename, user_hint, host_hint, date_hint, lazy))
+
+    @classmethod
+    def iter_load(
+        cls, filename, user_hint=None, host_hint=None, date_hint=None, lazy=False
+    ):
+        """Yield Commands from an msf_prompt.OffPromptSession log
+
         For an OffPromptSession, a history only includes the command and timestamp,
         but the log file contains time, user, command, and result.  
         The format of an OffPromptSession log is :
@@ -121,62 +419,196 @@ class OffPromptPBLoader(PBLoader):
             <time>
             [RESULT]
             <result>
-        """
-        commandhist = []
-        rawhist = ""
-        with open(filename, "r+") as infi:
-            rawhist = infi.read()
-
-        # future : consider making this more performant
-        commands = re.findall(
-            "=\n([0-9\-\W:,]+)\n"  # datetime
-            "\[COMMAND\]\[USER: (.*?)\]\n"  # user
-            "(.*?)={4,}.*?\[RESULT\]"  # command
-            "(.*?)={8,}\n",  # result
-            rawhist,
-            re.DOTALL,
-        )
 
-        for c in commands:
+        A command takes the first [RESULT] record that follows it; other
+        records in between (e.g. session start messages) are skipped.
+
+        The log is read through a memory map one record at a time, so memory
+        use is bounded by the largest record rather than the file size.
+        If lazy is True, results are left in the file as lazytext.LazyText
+        references and only read when displayed.
+        """
+        state = _OffPromptState(filename if lazy else None)
+        with open(filename, "rb") as infi:
             try:
-                # datetime.datetime.fromisoformat would solve this perfectly,
-                # but is not introduced until python 3.7
-                yr, mon, day, hr, mn, sec = re.findall(
-                    "([0-9]{4})-"  # yr
-                    "([0-9]{2})-"  # mon
-                    "([0-9]{2}) "  # day
-                    "([0-9]{2}):"  # hr
-                    "([0-9]{2}):"  # mn
-                    "([0-9]{2})",
-                    c[0],
-                )[
-                    0
-                ]  # only expecting one result so grab the first and unpack
-
-                # this portion isn't strictly necessary but it makes the
-                # build of Command so much cleaner
-                time = dt.datetime(
-                    int(yr), int(mon), int(day), int(hr), int(mn), int(sec)
+                mm = mmap.mmap(infi.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return  # empty files can't be mapped
+
+            with mm:
+                for record, end in _records(mm):
+                    yield from state.record(mm, record, end)
+        yield from state.finish()
+
+    @classmethod
+    def follow_parser(cls, filename, user_hint=None, host_hint=None, date_hint=None):
+        """Return a parser for records appended to an OffPromptSession log
+
+        A record is only parsed once the next one has started (or nothing
+        has been appended for a poll), since until then more of its text
+        may still be on the way.
+        """
+        return _OffPromptFeed()
+
+
+class _OffPromptState:
+    """Turns OffPromptSession log records into Commands
+
+    Holds the command waiting for its [RESULT] record between records.
+    """
+
+    def __init__(self, lazy_filename=None, base=0):
+        self.pending = None
+        self.lazy_filename = lazy_filename  # make results LazyText into this file
+        self.base = base  # file offset of data[0], for LazyText
+
+    def record(self, data, record, end):
+        """Return the Commands completed by a record (a _records match)
+        """
+        done = []
+        header = record.group(2).rstrip(b"\r")
+        if header.startswith(OffPromptPBLoader._COMMAND_TAG) and header.endswith(b"]"):
+            time = _parse_record_time(record.group(1))
+            if time is None:
+                return done
+            if self.pending is not None:
+                # no result was logged before the next command
+                done.append(self.pending)
+            user = decode(header[len(OffPromptPBLoader._COMMAND_TAG) : -1])
+            user_command = decode(data[record.end() + 1 : end])
+            user_command = user_command.strip("+").strip()
+            self.pending = Command(time, user, "unknown", user_command, "")
+            if user_command == "exit":
+                # this prevents the new session from being the "result" of exit
+                done.append(self.pending)
+                self.pending = None
+        elif (
+            header.startswith(OffPromptPBLoader._RESULT_TAG)
+            and self.pending is not None
+        ):
+            # the result is everything after the tag, including
+            # the rest of the tag's line and its newline
+            result_start = record.start(2) + len(OffPromptPBLoader._RESULT_TAG)
+            if self.lazy_filename:
+                self.pending.result = LazyText(
+                    self.lazy_filename, self.base + result_start, end - result_start
                 )
-                user = c[1]
-                user_command = c[2].strip("+").strip()
-                if user_command == "exit":
-                    # this prevents the new session from being the "result" of exit
-                    result = ""
-                else:
-                    result = c[3]
+            else:
+                self.pending.result = decode(data[result_start:end])
+            done.append(self.pending)
+            self.pending = None
+        return done
 
-                commandhist.append(Command(time, user, "unknown", user_command, result))
-            except Exception as e:
-                print(e)
+    def finish(self):
+        """Return the command still waiting for a result, if any
+        """
+        done = [self.pending] if self.pending is not None else []
+        self.pending = None
+        return done
 
-        return commandhist
+
+class _OffPromptFeed:
+    """Incremental parser for an OffPromptSession log that is being written
+    """
+
+    def __init__(self):
+        self._state = _OffPromptState()
+        self._buffer = b""
+
+    def feed(self, data):
+        self._buffer += data
+        records = list(_records(self._buffer))
+        if not records:
+            return []
+        done = []
+        for record, end in records[:-1]:
+            done.extend(self._state.record(self._buffer, record, end))
+        # keep the last record; more of its text may still be appended
+        self._buffer = self._buffer[records[-1][0].start() :]
+        return done
+
+    def idle(self):
+        if not self._buffer.endswith(b"\n"):
+            return []
+        done = []
+        for record, end in _records(self._buffer):
+            done.extend(self._state.record(self._buffer, record, end))
+        self._buffer = b""
+        return done
+
+
+def _records(mm):
+    """Split an OffPromptSession log into records in a single pass
+
+    Scans the memory-mapped log for separator lines, so nothing but the
+    time and header lines is copied out of the file here.  A record starts
+    with a line of '=' characters followed by a timestamp line; a line of '='
+    that isn't followed by a timestamp is treated as part of the text of the
+    current record.
+
+    Yields
+    ======
+    (re.Match, int)
+        match of the record's separator, time (group 1) and header (group 2)
+        lines, and the offset where the record's text ends
+    """
+    previous = _FIRST_RECORD.match(mm)
+    for match in _RECORD_START.finditer(mm):
+        if previous is not None:
+            # the newline before the separator still belongs to the text
+            yield previous, match.start() + 1
+        previous = match
+    if previous is not None:
+        yield previous, len(mm)
+
+
+# a separator line followed by a "YYYY-MM-DD HH:MM:SS" line and a header line;
+# the pattern starts with a literal newline rather than ^ so the regex engine
+# can skip ahead to candidates instead of trying every offset
+_RECORD = (
+    rb"====+\r?\n"
+    rb"([0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}[^\n]*)\n"
+    rb"([^\n]*)(?=\n|\Z)"
+)
+_RECORD_START = re.compile(rb"\n" + _RECORD)
+_FIRST_RECORD = re.compile(_RECORD)
+
+
+def _parse_record_time(line):
+    """Parse a raw "YYYY-MM-DD HH:MM:SS,mmm" line by fixed offsets
+
+    Milliseconds are dropped since Command times are kept to the second.
+
+    Returns
+    =======
+    _ : datetime.datetime
+        the parsed time, or None if the line isn't a valid date
+    """
+    try:
+        return dt.datetime(
+            int(line[0:4]),
+            int(line[5:7]),
+            int(line[8:10]),
+            int(line[11:13]),
+            int(line[14:16]),
+            int(line[17:19]),
+        )
+    except ValueError:
+        return None
 
 
-class BashHistoryPBLoader(PBLoader):
+class BashHistoryPBLoader(PBLoader, typehint="bash_hist"):
     """Class for loading histories generated by bash terminal
     """
 
+    _LINE = re.compile(rb" *\d+  ")
+
+    @classmethod
+    def sniff(cls, head):
+        # every complete line is "num  command" as printed by `history`
+        lines = [line for line in head.split(b"\n")[:-1] if line.strip()]
+        return bool(lines) and all(cls._LINE.match(line) for line in lines)
+
     @classmethod
     def load(cls, filename, user_hint=None, host_hint=None, date_hint=None):
         """Loads bash terminal history files
@@ -190,21 +622,149 @@ class BashHistoryPBLoader(PBLoader):
         with open(filename, "r+") as infi:
             for line in infi:
                 try:
-                    num, comm = line.split("  ", 1)
                     commandhist.append(
-                        Command(
-                            time=base_date + dt.timedelta(minutes=int(num)),
-                            user=user_hint or "unknown",
-                            hostUUID=host_hint or "unknown",
-                            command=comm,
-                        )
+                        cls._line_command(line, base_date, user_hint, host_hint)
                     )
                 except Exception as e:
+                    metrics.inc("hsp_loader_errors_total", loader=cls.typehint)
                     print(e)
         return commandhist
 
+    @classmethod
+    def _line_command(cls, line, base_date, user_hint=None, host_hint=None):
+        """Return the Command for one "num  command" line
+        """
+        num, comm = line.lstrip().split("  ", 1)
+        return Command(
+            time=base_date + dt.timedelta(minutes=int(num)),
+            user=user_hint or "unknown",
+            hostUUID=host_hint or "unknown",
+            command=comm,
+        )
 
-class GenericCsvPBLoader(PBLoader):
+    @classmethod
+    def follow_parser(cls, filename, user_hint=None, host_hint=None, date_hint=None):
+        """Return a parser for lines appended to a bash history
+        """
+        base_date = date_hint or dt.datetime.fromordinal(1)
+
+        def parse(line):
+            try:
+                return cls._line_command(line + "\n", base_date, user_hint, host_hint)
+            except ValueError:
+                return None
+
+        return _LineFeed(parse)
+
+
+class TimestampParser:
+    """Parses the timestamps of one file, choosing a fast path from the first rows
+
+    dateutil's parser handles almost any format but is slow.  The first
+    SNIFF_ROWS values are parsed with dateutil, and the first candidate format
+    that gives the same result for all of them is used from then on.  Values
+    the fast path can't handle fall back to dateutil.  Recently parsed strings
+    are cached since event logs repeat timestamps a lot.
+
+    Methods
+    =======
+    parse(self, val)
+        return the datetime for a timestamp string
+    """
+
+    SNIFF_ROWS = 20
+    CACHE_SIZE = 4096
+
+    # strptime formats tried after the fixed-offset slicer and fromisoformat
+    FORMATS = [
+        "%Y-%m-%d %H:%M:%S",
+        "%Y-%m-%dT%H:%M:%S",
+        "%Y-%m-%d %H:%M:%S.%f",
+        "%Y/%m/%d %H:%M:%S",
+        "%m/%d/%Y %I:%M:%S %p",  # PowerShell Export-Csv in en-US
+        "%m/%d/%Y %H:%M:%S",
+        "%d/%m/%Y %H:%M:%S",
+        "%a %b %d %H:%M:%S %Y",  # ctime
+    ]
+
+    def __init__(self):
+        self._fast = None
+        self._samples = []
+        self._cache = {}
+
+    def parse(self, val):
+        """return the datetime for a timestamp string
+
+        Raises the same errors as dateutil.parser.parse for values that can't
+        be parsed.
+        """
+        try:
+            return self._cache[val]
+        except KeyError:
+            pass
+        except TypeError:
+            return parsedate(val)  # unhashable; let dateutil raise
+
+        time = None
+        if self._fast is not None:
+            try:
+                time = self._fast(val)
+            except (TypeError, ValueError):
+                pass
+        if time is None:
+            time = parsedate(val)
+            if self._fast is None and len(self._samples) < self.SNIFF_ROWS:
+                self._samples.append((val, time))
+                if len(self._samples) == self.SNIFF_ROWS:
+                    self._fast = self._sniff()
+
+        if len(self._cache) >= self.CACHE_SIZE:
+            self._cache.clear()
+        self._cache[val] = time
+        return time
+
+    def _sniff(self):
+        """Return the first candidate parser that agrees with every sample
+        """
+        for candidate in self._candidates():
+            try:
+                if all(candidate(val) == time for val, time in self._samples):
+                    return candidate
+            except (TypeError, ValueError):
+                continue
+        return None
+
+    def _candidates(self):
+        yield _slice_timestamp
+        if hasattr(dt.datetime, "fromisoformat"):
+            yield dt.datetime.fromisoformat
+        for fmt in self.FORMATS:
+            yield partial(_strptime, fmt=fmt)
+
+
+def _slice_timestamp(val):
+    """Parse "YYYY-MM-DD HH:MM:SS" (or with a T) by fixed offsets
+
+    Only the exact 19 character form is accepted so that a fraction or
+    timezone is never silently dropped.
+    """
+    if len(val) != 19 or val[4] != "-" or val[10] not in " T" or val[13] != ":":
+        raise ValueError(f"not a fixed-offset timestamp: {val}")
+    return dt.datetime(
+        int(val[0:4]),
+        int(val[5:7]),
+        int(val[8:10]),
+        int(val[11:13]),
+        int(val[14:16]),
+        int(val[17:19]),
+    )
+
+
+def _strptime(val, fmt):
+    return dt.datetime.strptime(val.strip(), fmt)
+
+
+class GenericCsvPBLoader(PBLoader, typehint="generic_csv_hist"):
     """Class for loading CSVs with the required columns
 
     Format of loaded CSVs must be 'time, host, user, command, result, flagged, comment'
@@ -217,12 +777,20 @@ class GenericCsvPBLoader(PBLoader):
     # future: incorporate hints and missing columns
     """
 
+    @classmethod
+    def sniff(cls, head):
+        # only files with a header row can be told apart from other text
+        header = head.split(b"\n", 1)[0].lower()
+        fields = [field.strip(b' \t\r"') for field in header.split(b",")]
+        return b"time" in fields and b"command" in fields
+
     @classmethod
     def load(cls, filename, user_hint=None, host_hint=None, date_hint=None):
         """
         """
 
         commandhist = []
+        timestamps = TimestampParser()
 
         with open(filename, "r+") as infi:
             header = False
@@ -241,83 +809,453 @@ class GenericCsvPBLoader(PBLoader):
                 print("header found")
                 csvreader = csv.DictReader(infi)
                 for row in csvreader:
-                    row = dict(
-                        (k.lower().strip(), v) for k, v in row.items() if k is not None
-                    )
-                    try:
-                        time = parsedate(row.get("time"))
-                    except (TypeError, ValueError) as e:
-                        try:
-                            time = dt.datetime.fromordinal(int(time))
-                        except:
-                            raise
-
-                    f = row.get("flagged", "").strip().lower()
-                    if f == "true":
-                        flagged = True
-                    else:
-                        flagged = False
-
-                    commandhist.append(
-                        Command(
-                            time,
-                            hostUUID=row.get("host", None),
-                            user=row.get("user", None),
-                            command=row.get("command", None),
-                            result=row.get("result", None),
-                            flagged=flagged,
-                            comment=row.get("comment", ""),
-                        )
-                    )
+                    commandhist.append(cls._row_command(row, timestamps))
 
             if not header:
-                csvreader = csv.reader()
+                csvreader = csv.reader(infi)
                 for row in csvreader:
                     try:
-                        time, host, user, command, result, flagged, comment, *_ = row
-                        try:
-                            time = parsedate(time)
-
-                        except (TypeError, ValueError) as e:
-                            try:
-                                time = dt.datetime.fromordinal(int(time))
-                            except:
-                                raise
-
-                        commandhist.append(
-                            Command(
-                                time=time,
-                                hostUUID=host,
-                                user=user,
-                                command=command,
-                                result=result,
-                                flagged=bool(flagged),
-                                comment=comment,
-                            )
-                        )
+                        commandhist.append(cls._fields_command(row, timestamps))
                     except Exception as e:
+                        metrics.inc("hsp_loader_errors_total", loader=cls.typehint)
                         print(e)
         return commandhist
 
+    @classmethod
+    def _row_command(cls, row, timestamps):
+        """Return the Command for a row read with a header (a dict)
+        """
+        row = dict((k.lower().strip(), v) for k, v in row.items() if k is not None)
+        try:
+            time = timestamps.parse(row.get("time"))
+        except (TypeError, ValueError) as e:
+            try:
+                time = dt.datetime.fromordinal(int(row.get("time")))
+            except:
+                raise
 
-class GenericJsonPBLoader(PBLoader):
-    """
+        f = (row.get("flagged") or "").strip().lower()
+        if f == "true":
+            flagged = True
+        else:
+            flagged = False
+
+        return Command(
+            time,
+            hostUUID=row.get("host", None),
+            user=row.get("user", None),
+            command=row.get("command", None),
+            result=row.get("result", None),
+            flagged=flagged,
+            comment=row.get("comment", ""),
+        )
+
+    @classmethod
+    def _fields_command(cls, row, timestamps):
+        """Return the Command for a row without a header (a list)
+        """
+        time, host, user, command, result, flagged, comment, *_ = row
+        try:
+            time = timestamps.parse(time)
+
+        except (TypeError, ValueError) as e:
+            try:
+                time = dt.datetime.fromordinal(int(time))
+            except:
+                raise
+
+        return Command(
+            time=time,
+            hostUUID=host,
+            user=user,
+            command=command,
+            result=result,
+            flagged=bool(flagged),
+            comment=comment,
+        )
+
+    @classmethod
+    def follow_parser(cls, filename, user_hint=None, host_hint=None, date_hint=None):
+        """Return a parser for rows appended to a csv history
+        """
+
+        def is_header(fields):
+            return any(val.lower().strip() == "time" for val in fields)
+
+        return _CsvFeed(
+            filename, cls.typehint, cls._row_command, is_header, cls._fields_command
+        )
+
+
+class GenericJsonPBLoader(PBLoader, typehint="generic_json_hist"):
+    """Class for loading JSON arrays or JSON Lines of commands
+
+    A record is an object whose keys are mapped to Command attributes by
+    FIELDS, or an array of values: named by the first array if that is a
+    header row (as json_hist_example has), otherwise in the order of
+    POSITIONS.  Keys are matched ignoring case and surrounding spaces, and a
+    dotted name such as "host.name" looks inside a nested object.  To load
+    records with other field names, subclass with a new typehint, e.g.
+
+        class MyToolPBLoader(GenericJsonPBLoader, typehint="mytool_json"):
+            FIELDS = dict(GenericJsonPBLoader.FIELDS, command=("argv",))
+
+    Files are read a chunk at a time and Commands are made as records are
+    parsed, so memory is bounded by the largest record and the CommandTable
+    being built, not the file size.
     """
 
+    version = 2
+
+    # Command attribute -> record keys it may be stored under, in order
+    FIELDS = {
+        "time": ("time", "timestamp", "@timestamp", "ts", "date"),
+        "hostUUID": ("host", "hostuuid", "hostname", "host.name"),
+        "user": ("user", "username", "user.name"),
+        "command": ("command", "cmd", "command_line", "process.command_line"),
+        "result": ("result", "output", "stdout"),
+        "flagged": ("flagged",),
+        "comment": ("comment", "comments"),
+    }
+    # keys of the values of array records without a header row
+    POSITIONS = ("time", "host", "user", "command", "result", "flagged", "comment")
+    CHUNK_SIZE = 1024 * 1024  # characters read from the file at a time
+    LOAD_BATCH = 50000  # Commands added to the CommandTable at a time
+
+    @classmethod
+    def sniff(cls, head):
+        return head.lstrip()[:1] in (b"[", b"{")
+
     @classmethod
     def load(cls, filename, user_hint=None, host_hint=None, date_hint=None):
-        """Loads JSON saved history
+        """Load a JSON array or JSON Lines history
 
-        Assumed format is list of commands
+        See iter_load for the format.
 
-        #NOT IMPLEMENTED
+        Returns
+        =======
+        commandtable.CommandTable
+            Commands from the history
         """
-        return []
+        # each batch extends the current run of sorted commands, or starts a
+        # new one if it goes back in time; the runs are merged once at the end
+        runs = [CommandTable()]
+        commands = cls.iter_load(filename, user_hint, host_hint, date_hint)
+        while True:
+            batch = list(islice(commands, cls.LOAD_BATCH))
+            if not batch:
+                break
+            run = runs[-1]
+            first = min(to_seconds(c.time) for c in batch)
+            if run.times and first < run.times[-1]:
+                runs.append(CommandTable(batch))
+            else:
+                run.extend(batch)
+        if len(runs) == 1:
+            return runs[0]
+        return CommandTable.merged(runs)
+
+    @classmethod
+    def iter_load(cls, filename, user_hint=None, host_hint=None, date_hint=None):
+        """Yield Commands from a JSON array or JSON Lines history
+
+        A file whose first line is a whole JSON object is JSON Lines, one
+        record per line, parsed with orjson if it is installed.  Otherwise
+        the file is parsed as JSON values one after another (e.g. an array,
+        or pretty-printed objects), and the elements of top-level arrays are
+        the records, e.g.
+
+            [{"time": "2019-10-26 14:50:37", "user": "stark", "command": "ls"}]
+
+        Records that can't be made into Commands (e.g. without a time) are
+        reported and skipped; a file that isn't valid JSON raises ValueError
+        at the point it stops being valid.  user_hint and host_hint fill in
+        records without a user or host.
+        """
+        fields = _JsonFields(cls.FIELDS, cls.POSITIONS, user_hint, host_hint)
+        loads = orjson.loads if orjson is not None else json.loads
+        with open(filename, "r", errors="replace") as infi:
+            head = infi.read(cls.CHUNK_SIZE)
+            if _is_json_line(head, loads):
+                lines = _chain_first(head, infi)
+                for lineno, line in enumerate(lines, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        command = fields.command(loads(line))
+                    except (TypeError, ValueError, OverflowError) as e:
+                        metrics.inc("hsp_loader_errors_total", loader=cls.typehint)
+                        log.warning("%s:%d: %s", filename, lineno, e)
+                        continue
+                    if command is not None:
+                        yield command
+            else:
+                records = _json_records(infi, head, cls.CHUNK_SIZE)
+                for number, record in enumerate(records, 1):
+                    try:
+                        command = fields.command(record)
+                    except (TypeError, ValueError, OverflowError) as e:
+                        metrics.inc("hsp_loader_errors_total", loader=cls.typehint)
+                        log.warning("%s: record %d: %s", filename, number, e)
+                        continue
+                    if command is not None:
+                        yield command
+
+    @classmethod
+    def follow_parser(cls, filename, user_hint=None, host_hint=None, date_hint=None):
+        """Return a parser for lines appended to a JSON Lines history
+
+        A JSON array can't be followed, since a record appended to one is
+        written before its closing ].
+        """
+        with open(filename, "rb") as infi:
+            if infi.read(cls.CHUNK_SIZE).lstrip()[:1] == b"[":
+                return None
+        fields = _JsonFields(cls.FIELDS, cls.POSITIONS, user_hint, host_hint)
+        loads = orjson.loads if orjson is not None else json.loads
+
+        def parse_line(line):
+            if not line.strip():
+                return None
+            try:
+                return fields.command(loads(line))
+            except (TypeError, ValueError, OverflowError) as e:
+                metrics.inc("hsp_loader_errors_total", loader=cls.typehint)
+                log.warning("%s: bad record: %s", cls.typehint, e)
+                return None
+
+        return _LineFeed(parse_line)
+
 
+class _JsonFields:
+    """Makes Commands from JSON records, matching their keys to attributes
 
-class WinEventLogCsvPBLoader(PBLoader):
+    How the keys of a record map to attributes is worked out once for each
+    distinct set of keys, so records of the same shape cost a dict lookup.
     """
+
+    MAX_SHAPES = 1024  # distinct sets of keys remembered
+    ATTRIBUTES = ("time", "hostUUID", "user", "command", "result", "flagged", "comment")
+
+    def __init__(self, fields, positions, user_hint=None, host_hint=None):
+        self.fields = fields
+        self.positions = positions
+        self.user_hint = user_hint
+        self.host_hint = host_hint
+        self._header = None
+        self._started = False  # first record (maybe a header) has been seen
+        self._plans = {}  # tuple of record keys -> [(attribute, key path)]
+        self._timestamps = TimestampParser()
+
+    def _plan(self, record):
+        """Return where each of ATTRIBUTES is found in records like this one
+
+        Each is a key of the record, a tuple of keys into nested objects, or
+        None if the record doesn't have the attribute.
+        """
+        keys = {}
+        for key in record:
+            keys.setdefault(str(key).strip().lower(), key)
+        plan = []
+        for attribute in self.ATTRIBUTES:
+            found = None
+            for name in self.fields.get(attribute, ()):
+                key = keys.get(name)
+                if key is not None and not isinstance(record[key], dict):
+                    found = key
+                    break
+                first, dot, rest = name.partition(".")
+                key = keys.get(first)
+                if dot and key is not None and isinstance(record[key], dict):
+                    found = (key,) + tuple(rest.split("."))
+                    break
+            plan.append(found)
+        return plan
+
+    def command(self, record):
+        """Return the Command for a record, or None for a header row
+
+        Raises
+        ======
+        ValueError
+            if the record isn't an object or array, or has no usable time
+        """
+        if isinstance(record, list):
+            if not self._started:
+                self._started = True
+                if any(
+                    isinstance(val, str) and val.strip().lower() == "time"
+                    for val in record
+                ):
+                    self._header = record
+                    return None
+            record = dict(zip(self._header or self.positions, record))
+        elif not isinstance(record, dict):
+            raise ValueError(f"not a JSON object or array: {record!r:.80}")
+        self._started = True
+
+        shape = tuple(record)
+        plan = self._plans.get(shape)
+        if plan is None:
+            if len(self._plans) >= self.MAX_SHAPES:
+                self._plans.clear()
+            plan = self._plans[shape] = self._plan(record)
+        get = record.get
+        time, host, user, command, result, flagged, comment = [
+            get(where) if where.__class__ is not tuple else _nested(record, where)
+            for where in plan
+        ]
+
+        if isinstance(flagged, str):
+            flagged = flagged.strip().lower() == "true"
+        comment = _json_text(comment)
+        return Command(
+            self._time(time),
+            user=_json_text(user) or self.user_hint,
+            hostUUID=_json_text(host) or self.host_hint,
+            command=_json_text(command),
+            result=_json_text(result),
+            flagged=bool(flagged),
+            comment="" if comment is None else comment,
+        )
+
+    def _time(self, val):
+        """Return the datetime for a record's time
+        """
+        if val is None or isinstance(val, bool):
+            raise ValueError("record has no time")
+        if isinstance(val, (int, float)):
+            if val > 1e11:
+                val /= 1000  # milliseconds since the epoch
+            return dt.datetime.fromtimestamp(val)
+        try:
+            return self._timestamps.parse(val)
+        except (TypeError, ValueError, OverflowError):
+            return dt.datetime.fromordinal(int(val))
+
+
+def _is_json_line(head, loads):
+    """Is the first line of head a whole JSON object
     """
+    line = head.lstrip().partition("\n")[0]
+    if line[:1] != "{":
+        return False
+    try:
+        return isinstance(loads(line), dict)
+    except ValueError:
+        return False
+
+
+def _nested(record, keys):
+    """Return the value at a path of keys into nested objects, or None
+    """
+    val = record
+    for key in keys:
+        if not isinstance(val, dict):
+            return None
+        val = val.get(key)
+    return val
+
+
+def _json_text(val):
+    """Return a record's value as Command text
+    """
+    if val is None or isinstance(val, str):
+        return val
+    if isinstance(val, list):
+        return " ".join(map(str, val))  # e.g. an argv
+    if isinstance(val, dict):
+        return json.dumps(val)
+    return str(val)
+
+
+def _chain_first(head, infi):
+    """Yield the lines of a file of which head has already been read
+    """
+    first, newline, rest = head.rpartition("\n")
+    if not newline:
+        # no complete line in head
+        rest = head + infi.readline()
+        yield from rest.splitlines()
+        yield from infi
+        return
+    yield from first.split("\n")
+    yield rest + infi.readline()
+    yield from infi
+
+
+_JSON_SKIP = re.compile(r"[\s,]*")
+
+
+def _json_records(infi, buf, chunk_size):
+    """Yield the records of a file of JSON values, reading it a chunk at a time
+
+    Top-level arrays are stepped into, so their elements are yielded one by
+    one rather than the array being parsed whole.  A value cut off by the
+    end of the buffer is parsed again once more of the file has been read.
+
+    Parameters
+    ==========
+    infi : file
+        file opened in text mode, positioned after buf
+    buf : str
+        text already read from the start of the file
+    chunk_size : int
+        characters to read at a time
+
+    Raises
+    ======
+    ValueError
+        if the file isn't valid JSON
+    """
+    decode = json.JSONDecoder().raw_decode
+    pos = 0
+    eof = not buf
+    in_array = False
+    while True:
+        pos = _JSON_SKIP.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                return
+            buf = infi.read(chunk_size)
+            pos = 0
+            eof = not buf
+            continue
+        char = buf[pos]
+        if char == "[" and not in_array:
+            in_array = True
+            pos += 1
+            continue
+        if char == "]" and in_array:
+            in_array = False
+            pos += 1
+            continue
+        try:
+            record, end = decode(buf, pos)
+            complete = end < len(buf) or eof  # a number may go on
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if complete:
+            pos = end
+            yield record
+            continue
+        # the value runs past the buffer; read at least as much again
+        more = infi.read(max(chunk_size, len(buf) - pos))
+        buf = buf[pos:] + more
+        pos = 0
+        eof = not more
+
+
+class WinEventLogCsvPBLoader(PBLoader, typehint="win_event_log_csv"):
+    """
+    """
+
+    @classmethod
+    def sniff(cls, head):
+        lines = head.lstrip(b"\xef\xbb\xbf").split(b"\n", 2)
+        return lines[0].startswith(b"#TYPE") or b"TimeGenerated" in lines[0]
 
     @classmethod
     def load(cls, filename, user_hint=None, host_hint=None, date_hint=None):
@@ -330,6 +1268,7 @@ class WinEventLogCsvPBLoader(PBLoader):
         result = Message
         """
         commandhist = []
+        timestamps = TimestampParser()
 
         with open(filename, "r+") as infi:
             firstline = infi.readline()
@@ -342,23 +1281,172 @@ class WinEventLogCsvPBLoader(PBLoader):
                 infi.seek(0)
             csvreader = csv.DictReader(infi)
             for row in csvreader:
-                time = row.get("TimeGenerated", "")
-                host = row.get("MachineName", None)
-                user = row.get("UserName", None)
-                if len(user) < 1:
-                    user = "UNKNOWN USER"
-                result = row.get("Message", None)
-                command = "UNKNOWN COMMAND"
-                try:
-                    time = parsedate(time)
-                except (TypeError, ValueError) as e:
-                    print(f"something went wrong {e}")
-                    time = dt.datetime.fromordinal(1)
-
-                commandhist.append(
-                    Command(
-                        time, hostUUID=host, user=user, result=result, command=command
-                    )
-                )
+                commandhist.append(cls._row_command(row, timestamps))
 
         return commandhist
+
+    @classmethod
+    def _row_command(cls, row, timestamps):
+        """Return the Command for one event
+        """
+        time = row.get("TimeGenerated", "")
+        host = row.get("MachineName", None)
+        user = row.get("UserName", None)
+        if not user:
+            user = "UNKNOWN USER"
+        result = row.get("Message", None)
+        command = "UNKNOWN COMMAND"
+        try:
+            time = timestamps.parse(time)
+        except (TypeError, ValueError) as e:
+            metrics.inc("hsp_loader_errors_total", loader=cls.typehint)
+            log.warning("%s: bad TimeGenerated: %s", cls.typehint, e)
+            time = dt.datetime.fromordinal(1)
+
+        return Command(time, hostUUID=host, user=user, result=result, command=command)
+
+    @classmethod
+    def follow_parser(cls, filename, user_hint=None, host_hint=None, date_hint=None):
+        """Return a parser for events appended to an event log csv
+        """
+
+        def is_header(fields):
+            return True  # the first line that isn't #TYPE
+
+        return _CsvFeed(filename, cls.typehint, cls._row_command, is_header)
+
+
+class _LineFeed:
+    """Incremental parser for formats with one record per line
+
+    Appended data is split into complete lines and each is passed to
+    parse_line, which returns a Command or None; a partial last line waits
+    for the rest of it.
+    """
+
+    def __init__(self, parse_line):
+        self._parse_line = parse_line
+        self._buffer = b""
+
+    def _lines(self, data):
+        """Return the complete lines in the buffer plus data, decoded
+        """
+        lines, newline, rest = (self._buffer + data).rpartition(b"\n")
+        if not newline:
+            self._buffer = rest
+            return []
+        self._buffer = rest
+        return decode(lines).split("\n")
+
+    def feed(self, data):
+        commands = []
+        for line in self._lines(data):
+            command = self._parse_line(line)
+            if command is not None:
+                commands.append(command)
+        return commands
+
+    def idle(self):
+        return []
+
+
+class _CsvFeed(_LineFeed):
+    """Incremental parser for a csv history that is being written
+
+    The header is read from the start of the file when the feed is made (or
+    from the first record appended, if the file is empty).  Rows then go to
+    row_command as dicts, or to fields_command as lists if the file turned
+    out to have no header.
+
+    Complete lines are parsed with one csv.reader, so a quoted field may
+    span lines (as an event's Message does); a record whose closing quote
+    hasn't been written yet waits for the rest of it.
+    """
+
+    def __init__(self, filename, typehint, row_command, is_header, fields_command=None):
+        super().__init__(None)
+        self._typehint = typehint
+        self._row_command = row_command
+        self._fields_command = fields_command
+        self._is_header = is_header
+        self._timestamps = TimestampParser()
+        self._header = None
+        self._started = False  # header (or its absence) has been seen
+        self._pending = []  # lines of a record that isn't complete yet
+        with open(filename, "rb") as infi:
+            head = infi.read(self.SNIFF_SIZE)
+        for fields in self._records(head):
+            if self._started:
+                break
+            self._row(fields)
+        self._buffer = b""
+        self._pending = []
+
+    SNIFF_SIZE = 64 * 1024
+
+    def _records(self, data):
+        """Return the complete records in the buffer plus data, as field lists
+        """
+        lines = self._pending + [line + "\n" for line in self._lines(data)]
+        self._pending = []
+        taken = 0  # lines handed to the reader
+        exhausted = False
+
+        def source():
+            nonlocal taken, exhausted
+            for line in lines:
+                taken += 1
+                yield line
+            exhausted = True
+
+        reader = csv.reader(source())
+        records = []
+        while True:
+            start = taken
+            try:
+                fields = next(reader)
+            except StopIteration:
+                return records
+            except csv.Error as e:
+                metrics.inc("hsp_loader_errors_total", loader=self._typehint)
+                log.warning("%s: bad csv record: %s", self._typehint, e)
+                continue
+            if exhausted:
+                # the lines ran out inside a quoted field
+                self._pending = lines[start:]
+                return records
+            records.append(fields)
+
+    def _row(self, fields):
+        """Return the Command for one record, or None for a header or bad row
+        """
+        if len(fields) < 2 and not "".join(fields).strip():
+            return None  # blank line
+        if not self._started and fields[0].startswith("#TYPE"):
+            return None
+        if not self._started:
+            self._started = True
+            if self._is_header(fields):
+                self._header = fields
+                return None
+        elif fields == self._header:
+            return None  # header again, e.g. the file was rewritten
+        try:
+            if self._header is not None:
+                return self._row_command(
+                    dict(zip(self._header, fields)), self._timestamps
+                )
+            if self._fields_command is not None:
+                return self._fields_command(fields, self._timestamps)
+        except (TypeError, ValueError) as e:
+            metrics.inc("hsp_loader_errors_total", loader=self._typehint)
+            log.warning("%s: bad row: %s", self._typehint, e)
+        return None
+
+    def feed(self, data):
+        commands = []
+        for fields in self._records(data):
+            command = self._row(fields)
+            if command is not None:
+                commands.append(command)
+        return commands
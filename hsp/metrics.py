@@ -0,0 +1,369 @@
+"""Defines the optional counters and histograms that show where time goes
+
+Instrumented code calls the module functions (inc, observe, timer) with a
+metric name and optional labels, e.g.
+
+    metrics.inc("hsp_loader_rows_total", len(hist), loader="msf_prompt")
+
+Metrics are off unless enable() is called.  While off, each call returns as
+soon as it has checked the module's enabled flag, so instrumentation can stay
+in hot paths such as Playback.__anext__.
+
+Collected metrics can be shown with format_text (HspApp's debug overlay) and
+written to a file with write_json or write_prometheus (the Prometheus text
+exposition format, e.g. for node_exporter's textfile collector).
+"""
+
+import bisect
+import json
+import os
+import time
+
+enabled = False
+
+# upper bounds in seconds of the histogram buckets, as Prometheus uses
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> _Histogram
+_help = {}  # name -> description
+
+
+class _Histogram:
+    """Counts of observed values by bucket, with their sum and maximum
+    """
+
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, val):
+        self.counts[bisect.bisect_left(BUCKETS, val)] += 1
+        self.count += 1
+        self.sum += val
+        if val > self.max:
+            self.max = val
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding the q quantile
+        """
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+def enable():
+    """start collecting metrics
+    """
+    global enabled
+    enabled = True
+
+
+def disable():
+    """stop collecting metrics; what was collected is kept
+    """
+    global enabled
+    enabled = False
+
+
+def reset():
+    """forget every collected metric
+    """
+    _counters.clear()
+    _histograms.clear()
+
+
+def describe(name, text):
+    """set the help text exported with a metric
+    """
+    _help[name] = text
+
+
+def inc(name, val=1, **labels):
+    """add val to a counter
+
+    Parameters
+    ==========
+    name : str
+        metric name; counters end in _total by convention
+    val : int or float
+        amount to add
+    labels : dict
+        label name -> value distinguishing series of the same metric
+    """
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    _counters[key] = _counters.get(key, 0) + val
+
+
+def observe(name, val, **labels):
+    """record a value (usually seconds) in a histogram
+
+    Parameters
+    ==========
+    name : str
+        metric name; durations end in _seconds by convention
+    val : float
+        value observed
+    labels : dict
+        label name -> value distinguishing series of the same metric
+    """
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    try:
+        _histograms[key].observe(val)
+    except KeyError:
+        histogram = _histograms[key] = _Histogram()
+        histogram.observe(val)
+
+
+class _Timer:
+    """Context manager that observes how long its block took
+    """
+
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class _NullTimer:
+    """Context manager that does nothing, used while metrics are off
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name, **labels):
+    """context manager that observes how long its block took in a histogram
+    """
+    if not enabled:
+        return _NULL_TIMER
+    return _Timer(name, labels)
+
+
+def collected():
+    """the raw collected metrics, for merge in another process
+    """
+    return _counters, _histograms
+
+
+def merge(state):
+    """add metrics collected in another process (see collected) to these
+
+    Parameters
+    ==========
+    state : tuple
+        value returned by collected; None is ignored
+    """
+    if state is None:
+        return
+    counters, histograms = state
+    for key, val in counters.items():
+        _counters[key] = _counters.get(key, 0) + val
+    for key, other in histograms.items():
+        histogram = _histograms.setdefault(key, _Histogram())
+        histogram.counts = [a + b for a, b in zip(histogram.counts, other.counts)]
+        histogram.count += other.count
+        histogram.sum += other.sum
+        histogram.max = max(histogram.max, other.max)
+
+
+def counter(name, **labels):
+    """current value of a counter
+    """
+    return _counters.get((name, tuple(sorted(labels.items()))), 0)
+
+
+def snapshot():
+    """every collected metric as plain data
+
+    Returns
+    =======
+    _ : dict
+        {"counters": [...], "histograms": [...]}, each entry holding the
+        metric's name and labels and its value or summary
+    """
+    counters = [
+        {"name": name, "labels": dict(labels), "value": val}
+        for (name, labels), val in sorted(_counters.items())
+    ]
+    histograms = []
+    for (name, labels), h in sorted(_histograms.items(), key=lambda item: item[0]):
+        histograms.append(
+            {
+                "name": name,
+                "labels": dict(labels),
+                "count": h.count,
+                "sum": h.sum,
+                "max": h.max,
+                "p50": h.quantile(0.5),
+                "p99": h.quantile(0.99),
+                "buckets": dict(zip(map(str, BUCKETS + ("+Inf",)), h.counts)),
+            }
+        )
+    return {"counters": counters, "histograms": histograms}
+
+
+def _label_text(labels):
+    return ",".join(f"{k}={v}" for k, v in labels)
+
+
+def format_text():
+    """collected metrics as lines of text, for display
+
+    Loader rows per second are worked out from the rows and seconds counters.
+    """
+    if not enabled:
+        return "metrics are disabled"
+    lines = []
+    for (name, labels), val in sorted(_counters.items()):
+        label_text = f"{{{_label_text(labels)}}}" if labels else ""
+        lines.append(f"{name}{label_text} {val:g}")
+        if name == "hsp_loader_rows_total":
+            seconds = _counters.get(("hsp_loader_seconds_total", labels))
+            if seconds:
+                lines.append(f"  {val / seconds:,.0f} rows/s")
+    for (name, labels), h in sorted(_histograms.items(), key=lambda item: item[0]):
+        label_text = f"{{{_label_text(labels)}}}" if labels else ""
+        mean = h.sum / h.count if h.count else 0.0
+        lines.append(
+            f"{name}{label_text} n={h.count} mean={mean * 1000:.2f}ms "
+            f"p50<={h.quantile(0.5) * 1000:.2f}ms p99<={h.quantile(0.99) * 1000:.2f}ms "
+            f"max={h.max * 1000:.2f}ms"
+        )
+    return "\n".join(lines) or "no metrics collected yet"
+
+
+def _prometheus_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ""
+    text = ",".join(
+        '{}="{}"'.format(
+            k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for k, v in labels
+    )
+    return "{" + text + "}"
+
+
+def format_prometheus():
+    """collected metrics in the Prometheus text exposition format
+    """
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), val in sorted(_counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_prometheus_labels(labels)} {val}")
+    for (name, labels), h in sorted(_histograms.items(), key=lambda item: item[0]):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), h.counts):
+            cumulative += count
+            le = _prometheus_labels(labels, [("le", bound)])
+            lines.append(f"{name}_bucket{le} {cumulative}")
+        lines.append(f"{name}_sum{_prometheus_labels(labels)} {h.sum}")
+        lines.append(f"{name}_count{_prometheus_labels(labels)} {h.count}")
+    return "\n".join(lines) + "\n"
+
+
+def _write(filename, text):
+    """Write text to filename through a temporary file, so readers never see
+    a partial file
+    """
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp, "w") as outfi:
+        outfi.write(text)
+    os.replace(tmp, filename)
+
+
+def write_json(filename):
+    """write the collected metrics to a json file (see snapshot)
+    """
+    _write(filename, json.dumps(snapshot(), indent=1))
+
+
+def write_prometheus(filename):
+    """write the collected metrics to a Prometheus text file
+    """
+    _write(filename, format_prometheus())
+
+
+def write(filename):
+    """write the collected metrics, as json if filename ends in .json and in
+    the Prometheus text format otherwise
+    """
+    if filename.endswith(".json"):
+        write_json(filename)
+    else:
+        write_prometheus(filename)
+
+
+describe("hsp_loader_rows_total", "Commands parsed, by loader")
+describe("hsp_loader_seconds_total", "Seconds spent parsing, by loader")
+describe("hsp_loader_errors_total", "Records a loader could not parse, by loader")
+describe("hsp_parse_cache_hits_total", "Histories read from the parse cache")
+describe("hsp_hist_build_seconds", "Time to sort or merge a history, by step")
+describe("hsp_schedule_wakeups_total", "Times the playback scheduler woke up")
+describe("hsp_schedule_lag_seconds", "Delay between an event's due and delivery")
+describe("hsp_update_display_seconds", "Time spent in HspApp.update_display")
+describe("hsp_render_command_seconds", "Time to render one command for display")
+describe("hsp_render_cache_hits_total", "Commands displayed from the render cache")
+describe("hsp_export_rows_total", "Commands written by export, by format")
+describe("hsp_redraw_requests_total", "Redraws asked for by HspApp")
+describe("hsp_redraws_total", "Screen redraws by prompt_toolkit")
+describe("hsp_redraw_seconds", "Time prompt_toolkit took to redraw the screen")
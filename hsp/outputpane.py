@@ -0,0 +1,212 @@
+"""Defines the pane HspApp shows a command and its result in
+
+A result can be a multi-megabyte nmap or msf dump.  prompt_toolkit's
+FormattedTextControl splits its whole text into lines on every redraw, so a
+large result makes each redraw slow.  OutputControl instead lays out only the
+lines on screen, finding where they start with a LineIndex that is built as
+far as it has been read, so a redraw costs about the same for any size of
+result.
+"""
+
+from array import array
+import bisect
+
+from prompt_toolkit.formatted_text import to_formatted_text
+from prompt_toolkit.layout.controls import UIContent, UIControl
+from prompt_toolkit.mouse_events import MouseEventType
+
+SCROLL_LINES = 3  # lines scrolled by a turn of the mouse wheel
+
+
+class LineIndex:
+    """Offsets in a text of the starts of its lines, found as they are needed
+
+    Lines are found from the start of the text as far as the furthest line
+    read so far, and from the end as far back as the earliest line read
+    there, so reading the first or the last screenful of a large text only
+    looks at those lines.
+
+    Attributes
+    ==========
+    text : str
+        text being indexed
+
+    Methods
+    =======
+    line(self, lineno)
+        the text of a line, without its newline
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._head = array("q", [0])  # starts of the first lines
+        self._tail = array("q")  # starts of the last lines, last line first
+        self._count = None
+
+    def __len__(self):
+        # like str.split("\n"), a trailing newline ends with an empty line
+        if self._count is None:
+            self._count = self.text.count("\n") + 1
+        return self._count
+
+    def _start(self, lineno):
+        """Return the offset of the start of a line
+        """
+        head, tail = self._head, self._tail
+        if lineno < len(head):
+            return head[lineno]
+        back = len(self) - 1 - lineno  # lines after this one
+        if back < len(tail):
+            return tail[back]
+        if back - len(tail) < lineno - len(head):
+            # nearer the end than the furthest line found from the start
+            rfind = self.text.rfind
+            end = tail[-1] - 1 if tail else len(self.text)
+            while len(tail) <= back:
+                end = rfind("\n", 0, end)
+                tail.append(end + 1)
+            return tail[back]
+        find = self.text.find
+        start = head[-1]
+        while len(head) <= lineno:
+            start = find("\n", start) + 1
+            head.append(start)
+        return head[lineno]
+
+    def span(self, lineno):
+        """Return the offsets of the start and end (before its newline) of a line
+        """
+        start = self._start(lineno)
+        if lineno + 1 < len(self):
+            return start, self._start(lineno + 1) - 1
+        return start, len(self.text)
+
+    def line(self, lineno):
+        """the text of a line, without its newline
+        """
+        start, end = self.span(lineno)
+        return self.text[start:end]
+
+
+class OutputControl(UIControl):
+    """Control showing formatted text a screenful at a time
+
+    Set text to a str or a list of (style, text) fragments, as for
+    FormattedTextControl.  Setting it to something else scrolls back to the
+    top; setting the same object again (e.g. a command from HspApp's
+    render_cache) keeps the scroll position.
+
+    Attributes
+    ==========
+    text : str or list[tuple]
+        text shown
+    top : int
+        first line shown
+    height : int
+        lines shown at the last redraw
+
+    Methods
+    =======
+    scroll(self, lines)
+        scroll down (or up, if lines is negative) by lines
+    page_down(self)
+        scroll down by a screenful
+    page_up(self)
+        scroll up by a screenful
+    home(self)
+        scroll to the first line
+    end(self)
+        scroll to the last screenful
+    """
+
+    def __init__(self, text="", focusable=False):
+        self.focusable = focusable
+        self.height = 1
+        self.text = text
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        if text is getattr(self, "_text", None):
+            return
+        self._text = text
+        self.top = 0
+        fragments = text if isinstance(text, list) else to_formatted_text(text)
+        self._index = LineIndex("".join(fragment[1] for fragment in fragments))
+        # start offset and style of each fragment, for styling a line
+        self._starts = []
+        self._styles = []
+        offset = 0
+        for fragment in fragments:
+            self._starts.append(offset)
+            self._styles.append(fragment[0])
+            offset += len(fragment[1])
+
+    def is_focusable(self):
+        return self.focusable
+
+    def preferred_height(self, width, max_available_height, wrap_lines):
+        return min(len(self._index), max_available_height)
+
+    def _fragments(self, lineno, width):
+        """Return the styled fragments of a line, cut off at width characters
+        """
+        start, end = self._index.span(lineno)
+        end = min(end, start + width)
+        text = self._index.text
+        starts, styles = self._starts, self._styles
+        i = max(bisect.bisect_right(starts, start) - 1, 0)
+        fragments = []
+        while start < end:
+            stop = starts[i + 1] if i + 1 < len(starts) else end
+            stop = min(stop, end)
+            if stop > start:
+                fragments.append((styles[i], text[start:stop]))
+            start = stop
+            i += 1
+        return fragments
+
+    def create_content(self, width, height):
+        self.height = max(height or 1, 1)
+        self.top = max(min(self.top, len(self._index) - self.height), 0)
+        top = self.top
+        return UIContent(
+            get_line=lambda i: self._fragments(top + i, width),
+            line_count=min(self.height, len(self._index) - top),
+        )
+
+    def mouse_handler(self, mouse_event):
+        if mouse_event.event_type == MouseEventType.SCROLL_DOWN:
+            self.scroll(SCROLL_LINES)
+        elif mouse_event.event_type == MouseEventType.SCROLL_UP:
+            self.scroll(-SCROLL_LINES)
+        else:
+            return NotImplemented
+
+    def scroll(self, lines):
+        """scroll down (or up, if lines is negative) by lines
+        """
+        self.top = max(min(self.top + lines, len(self._index) - self.height), 0)
+
+    def page_down(self):
+        """scroll down by a screenful
+        """
+        self.scroll(self.height)
+
+    def page_up(self):
+        """scroll up by a screenful
+        """
+        self.scroll(-self.height)
+
+    def home(self):
+        """scroll to the first line
+        """
+        self.top = 0
+
+    def end(self):
+        """scroll to the last screenful
+        """
+        self.top = max(len(self._index) - self.height, 0)
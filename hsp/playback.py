@@ -4,14 +4,29 @@ Author: starksimilarity@gmail.com
 """
 
 import asyncio
+import bisect
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import datetime
+import glob
+import heapq
+from operator import itemgetter
+import os
+import time
+from dateutil.parser import parse as parsedate
 
 SESSION_FOLDER = "sessions"
 DEFAULT_HIST = "sessions/histfile"
 HISTFILE_LIST = "histfile_list"
 
-from command import Command
-from loader import PBLoader
+from cache import ParseCache
+from clock import PlaybackClock
+from command import Command, to_seconds
+from commandtable import CommandTable
+from views import HistoryView
+from journal import JOURNAL_FILE
+from loader import PBLoader, UnknownFormatError
+import metrics
+from utils.utils import parse_offset
 
 
 class Playback:
@@ -21,10 +36,16 @@ class Playback:
     ==========
     current_time : datetime.datetime
         The time that the playback session is set to
+    clock : clock.PlaybackClock
+        Virtual clock that computes current_time on demand
     playback_mode : int
         The type of playback for the session (e.g. real-time, manual, eveninterval)
-    hist : list[Command]
-        List of Commands to replay during the Playback
+    hist : commandtable.CommandTable or views.HistoryView
+        Commands to replay during the Playback, kept sorted by time
+    table : commandtable.CommandTable
+        the whole history, which hist is a view of when filtered
+    histfile : str
+        history file the Playback was loaded from, if any
     playback_position : int
         offset into the hist list that is the current command
     playback_interval : int
@@ -35,17 +56,26 @@ class Playback:
         use hint for host during loading history if it can't be read explicitly
     date_hint : datetime.date 
         use hint for date during loading history if it can't be read explicitly
+    lazy_results : bool
+        leave command results in the history file until they are displayed
+        (for loaders that support it)
     self.loop_lock : asyncio.Lock()
         Lock for "MANUAL" playback mode
     paused : bool
         Is the playback currently paused
     playback_rate : (int, float)
         Multiplier for "REALTIME" playback mode
+    lag : dict
+        Measured delay between when events were due and when they were delivered
+    journal : journal.AnnotationJournal
+        where flag and comment changes are recorded as they are made, if set
     
     Methods
     =======
     _load_hist(histfile, histfile_typehint)
         set the Playback's history
+    add_command(self, command)
+        insert a Command into the history in time order
     play(self):
         start playback from last pause position
     pause(self):
@@ -56,10 +86,30 @@ class Playback:
         half playback speed
     goto_time(self, date_time):
         jump to date_time in the playback
+    goto_index(self, index):
+        jump so that hist[index] is the next command played
+    goto_command(self, position):
+        jump so that hist[position] is the command just played
+    goto_offset(self, delta):
+        jump forward or back from the current playback time
+    goto_flagged(self, forward=True):
+        jump to the next or previous flagged command
+    goto_next_of(self, positions, forward=True):
+        jump to the next or previous command out of a sorted list of positions
+    seek(self, spec):
+        jump to a position described by a string (time, offset, or index)
     change_playback_mode(self):
         cycle through the available playback modes
     flag_current_command(self):
         toggle the flagged setting for the current Command object
+    comment_current_command(self, comment):
+        set the comment of the current Command object
+    attach_journal(self, journal):
+        apply a journal's annotations and record later ones to it
+    view(self):
+        a views.HistoryView of the whole history, to filter
+    play_view(self, view=None):
+        play only the commands in a view, or the whole history again
     """
 
     MANUAL = "MANUAL"
@@ -77,23 +127,28 @@ class Playback:
         host_hint=None,
         date_hint=None,
         playback_mode=None,
+        lazy_results=False,
     ):
+        self._wakeup = asyncio.Event()  # set whenever the schedule changes
+        self.clock = PlaybackClock()
         self.current_time = 1
         self.playback_position = 0
         self.user_hint = user_hint
         self.host_hint = host_hint
         self.date_hint = date_hint
+        self.lazy_results = lazy_results
+        self.histfile = histfile
+        self.journal = None
         self.playback_mode = playback_mode
         self.loop_lock = asyncio.Lock()
         self.paused = True
         self.playback_rate = 5
-        self._start_time = datetime.datetime.now()  # when the replay was unpaused;
-        self._elapsed_time_at_pause = datetime.timedelta(0)
-        self._suspend_time = datetime.datetime.now()
-        self._time_since_last_event = datetime.timedelta(0)
+        # playback time of the last delivered event, for EVENINTERVAL mode
+        self._last_event_time = self.current_time
 
         if histfile:
             self.hist = self._load_hist(histfile, histfile_typehint)
+            self.hist.tag_source(histfile)
         else:
             self.hist = []
 
@@ -109,73 +164,115 @@ class Playback:
         except IndexError as e:
             raise StopIteration(e)
 
-    async def __aiter__(self):
-        # initialize internal timers
-        self._start_time = datetime.datetime.now()
-        self._elapsed_time_at_pause = datetime.timedelta(0)
+    def __aiter__(self):
+        # start the clock at the first event to be played
         self.current_time = self.hist[self.playback_position].time
+        self._last_event_time = self.current_time
         return self
 
     async def __anext__(self):
         try:
             while True:
-                if self.paused:
-                    # longer sleep period while paused
-                    await asyncio.sleep(1)
-                    continue
+                # anything that changes when the next event is due sets
+                # _wakeup, so clear it before working out how long to wait
+                self._wakeup.clear()
+                metrics.inc("hsp_schedule_wakeups_total")
+
                 # These if statements control when the function should
                 # return an object; break is used to exit the While True
                 # and return an object
-                elif self.playback_mode == "MANUAL":
-                    async with self.loop_lock:
-                        # this blocks so we can't switch to other modes mid loop
-                        # future: find a non-blocking way to do this
-                        break
-                elif self.playback_mode == "REALTIME":
-                    # check to see if current_playback time is greater
-                    # than the time of the next event
-                    if self.current_time > self.hist[self.playback_position].time:
-                        break
-
-                elif self.playback_mode == "EVENINTERVAL":
-                    # yield for pre-determined amount of time
-                    # future: change this to be a loop that checks to see if
-                    #       the apprpriate amount of un-pasued time has passed
-                    if self._time_since_last_event > datetime.timedelta(
-                        seconds=self._SPEEDCONST
-                    ):
+                if self.paused:
+                    # nothing is released until the playback state changes
+                    await self._wait()
+                    continue
+                elif self.playback_mode == self.MANUAL:
+                    if await self._wait_for_step():
                         break
+                    continue
 
-                await asyncio.sleep(0.001)
+                delay = self.clock.wall_delay(self._next_event_due())
+                if delay is not None and delay <= 0:
+                    break
+                await self._wait(delay)
 
             # condition has been met to return an event
+            event = self.hist[self.playback_position]
+            if self.playback_mode != self.MANUAL:
+                lag = self.clock.record_lag(self._next_event_due())
+                metrics.observe("hsp_schedule_lag_seconds", lag)
             self.playback_position += 1
-            self.current_time = self.hist[self.playback_position - 1].time
-            self._time_since_last_event = datetime.timedelta(0)
-            self._suspend_time = datetime.datetime.now()
+            if self.playback_mode != self.REALTIME:
+                # REALTIME keeps the clock running untouched so delivery
+                # delays don't accumulate; other modes jump to the event
+                self.current_time = event.time
+            self._last_event_time = self.current_time
 
-            return self.hist[self.playback_position - 1]
+            return event
         except IndexError as e:
             raise StopAsyncIteration(e)
 
-    async def run_async(self):
-        """Runs internal playback timers for async mode
+    def _next_event_due(self):
+        """Playback time at which the next event should be delivered
+
+        Raises IndexError if there is no next event.
+
+        Returns
+        =======
+        _ : datetime.datetime
+            the time of the next event in REALTIME mode, or _SPEEDCONST
+            seconds of playback time after the last event in EVENINTERVAL mode
         """
-        while True:
-            if not self.paused:
-                self.current_time = (
-                    self.current_time
-                    + (datetime.datetime.now() - self._suspend_time)
-                    * self.playback_rate
-                )
-                self._time_since_last_event = (
-                    self._time_since_last_event
-                    + (datetime.datetime.now() - self._suspend_time)
-                    * self.playback_rate
-                )
+        next_event = self.hist[self.playback_position]
+        if self.playback_mode == self.REALTIME:
+            return next_event.time
+        return self._last_event_time + datetime.timedelta(seconds=self._SPEEDCONST)
+
+    async def _wait(self, delay=None):
+        """Sleep until the playback state changes or delay seconds pass
+
+        Parameters
+        ==========
+        delay : float
+            longest time to sleep; None waits only for a state change
+        """
+        timer = None
+        if delay is not None:
+            timer = asyncio.get_event_loop().call_later(delay, self._wakeup.set)
+        try:
+            await self._wakeup.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    async def _wait_for_step(self):
+        """Wait for a MANUAL step or for the playback state to change
 
-            self._suspend_time = datetime.datetime.now()
-            await asyncio.sleep(0.001)
+        The UI holds loop_lock and releases it to step forward one event.
+
+        Returns
+        =======
+        _ : bool
+            True if the lock was released for a step, False if woken by a
+            state change (e.g. pause or mode change) instead
+        """
+        step = asyncio.ensure_future(self.loop_lock.acquire())
+        wake = asyncio.ensure_future(self._wakeup.wait())
+        done, pending = await asyncio.wait(
+            [step, wake], return_when=asyncio.FIRST_COMPLETED
+        )
+        for fut in pending:
+            fut.cancel()
+        if step in done:
+            # hand the lock straight back; the UI re-acquires it once it
+            # has displayed the event
+            self.loop_lock.release()
+            return True
+        return False
+
+    def _notify(self):
+        """Wake __anext__ so it re-evaluates when the next event is due
+        """
+        self._wakeup.set()
 
     def _load_hist(self, histfile, histfile_typehint=None):
         """Sets the playback's history.
@@ -191,39 +288,103 @@ class Playback:
         =======
         hist : list[Commands]
             Ordered list of Commands
+
+        Raises
+        ======
+        loader.UnknownFormatError
+            if no loader can read the history file
         """
         hints = {
             "user_hint": self.user_hint,
             "host_hint": self.host_hint,
             "date_hint": self.date_hint,
         }
-        return PBLoader.load_all(SESSION_FOLDER, histfile, histfile_typehint, hints)
+        return PBLoader.load_all(
+            SESSION_FOLDER, histfile, histfile_typehint, hints, self.lazy_results
+        )
 
     @property
     def current_time(self):
-        return self._current_time
+        return self.clock.now()
 
     @current_time.setter
     def current_time(self, val):
         if isinstance(val, datetime.datetime):
-            self._current_time = val
+            self.clock.seek(val)
         elif isinstance(val, int) and val > 0:
-            self._current_time = datetime.datetime.fromordinal(val)
+            self.clock.seek(datetime.datetime.fromordinal(val))
         else:
             raise TypeError("current_time must be datetime object or int")
 
     @property
     def hist(self):
         """the command history for the playback sorted by time
+
+        The history is a CommandTable that is sorted once when it is set and
+        kept in order by add_command, so this returns the Playback's own table
+        rather than a copy.  Use add_command to add to it.
         """
-        return sorted(self._hist, key=lambda x: x.time)
+        return self._hist
 
     @hist.setter
     def hist(self, val):
-        if isinstance(val, list):
+        if isinstance(val, (CommandTable, HistoryView)):
             self._hist = val
+        elif isinstance(val, list):
+            # the sort is stable so commands sharing a timestamp keep load order
+            with metrics.timer("hsp_hist_build_seconds", step="sort"):
+                self._hist = CommandTable(val)
         else:
             raise TypeError("History must be a list of Command objects")
+        self._flagged = self._hist.flagged_positions()
+
+    @property
+    def table(self):
+        """the whole history, which hist is a view of when filtered
+        """
+        if isinstance(self._hist, HistoryView):
+            return self._hist.table
+        return self._hist
+
+    def _in_table(self, position):
+        """Return the position in table of the command at a position of hist
+        """
+        if isinstance(self._hist, HistoryView):
+            return self._hist.base_position(position)
+        return position
+
+    def add_command(self, command):
+        """Insert a Command into the history in time order
+
+        Commands with the same time as existing ones are placed after them.
+        If the command lands before the current playback position, the
+        position is advanced so the same command stays current.
+
+        Parameters
+        ==========
+        command : command.Command
+            Command to add to the history
+
+        Returns
+        =======
+        index : int
+            offset into the hist list where the command was inserted, or
+            None if hist is a view the command isn't in
+        """
+        index = self._hist.insert(command)
+        self._notify()
+        if index is None:
+            return None
+
+        # flagged positions at or after the insert point move down by one
+        f = bisect.bisect_left(self._flagged, index)
+        self._flagged[f:] = [i + 1 for i in self._flagged[f:]]
+        if command.flagged:
+            self._flagged.insert(f, index)
+
+        if index < self.playback_position:
+            self.playback_position += 1
+        return index
 
     @property
     def playback_mode(self):
@@ -235,6 +396,7 @@ class Playback:
             self._playback_mode = val
         else:
             self._playback_mode = "MANUAL"
+        self._notify()
 
     @property
     def playback_interval(self):
@@ -242,20 +404,33 @@ class Playback:
 
     @property
     def playback_rate(self):
-        return self._playback_rate
+        return self.clock.rate
 
     @playback_rate.setter
     def playback_rate(self, val):
-        self._playback_rate = val
+        self.clock.rate = val
+        self._notify()
+
+    @property
+    def lag(self):
+        """Measured delay between when events were due and when they were delivered
+
+        Values are in wall-clock seconds; see clock.PlaybackClock.lag
+        """
+        return self.clock.lag
 
     @property
     def paused(self):
-        return self._paused
+        return self.clock.paused
 
     @paused.setter
     def paused(self, val):
         if isinstance(val, bool):
-            self._paused = val
+            if val:
+                self.clock.pause()
+            else:
+                self.clock.play()
+            self._notify()
         else:
             raise TypeError("Paused state must be of type bool")
 
@@ -264,9 +439,6 @@ class Playback:
         """
         if self.paused:
             return  # don't reset any values or do anything if already paused
-
-        self._elapsed_time_at_pause += datetime.datetime.now() - self._start_time
-        # print(f"elapsed_time = {self._elapsed_time_at_pause}")  # debugging
         self.paused = True
 
     def play(self):
@@ -274,59 +446,156 @@ class Playback:
         """
         if not self.paused:
             return  # don't reset any values or do anything if already playing
-        self._start_time = datetime.datetime.now()
-        # print(f"start_time = {self._start_time}")  # debugging
         self.paused = False
 
     def speedup(self):
         """Double the rate of playback
         """
         # future: set max rate
-        # future: consider the side effects of pause/play
-        # pause/play wrapping is added to reset the time elapsed checking
-        # otherwise you'd end up with multiplying time that had elapsed
-        # at a different rate
-        orginally_paused = self.paused
-        if not self.paused:
-            self.pause()
-
+        # the clock re-anchors on a rate change so time that already elapsed
+        # is never multiplied by the new rate
         self.playback_rate *= 2
 
-        if not orginally_paused:
-            self.play()
-
     def slowdown(self):
         """Halve the rate of playback
         """
         # future: set min rate
-        # future: consider the side effects of pause/play
-        # pause/play wrapping is added to reset the time elapsed checking
-        # otherwise you'd end up with multiplying time that had elapsed
-        # at a different rate
-        orginally_paused = self.paused
-        if not self.paused:
-            self.pause()
-
         self.playback_rate *= 0.5
 
-        if not orginally_paused:
-            self.play()
+    def _move_cursor(self, position, date_time):
+        """Set the playback position and time together and reschedule
+
+        Parameters
+        ==========
+        position : int
+            offset into hist of the next command to play
+        date_time : datetime.datetime
+            playback time to continue from
+        """
+        self.playback_position = position
+        self.current_time = date_time
+        self._last_event_time = date_time
+        self._notify()
 
     def goto_time(self, date_time):
+        """jump to date_time in the playback
+
+        The next command played is the first one at or after date_time.
+        """
         if isinstance(date_time, datetime.datetime):
-            orginally_paused = self.paused
-            if not self.paused:
-                self.pause()
-            self.current_time = date_time
-            # future: need a lot more checking for weird cases here (e.g. no hist)
-            # set the elapsed time as the delta between the desired set time
-            # and the time of the first command
-            self._elapsed_time_at_pause = date_time - self.hist[0].time
-            if not orginally_paused:
-                self.play()
+            position = bisect.bisect_left(self._hist.times, to_seconds(date_time))
+            self._move_cursor(position, date_time)
         else:
             raise TypeError("date_time must be datetime.datetime object")
 
+    def goto_index(self, index):
+        """jump so that hist[index] is the next command played
+
+        Indexes past either end of the history are clamped to it.
+        """
+        if not len(self._hist):
+            return
+        index = max(0, min(index, len(self._hist)))
+        self._move_cursor(index, self._hist[min(index, len(self._hist) - 1)].time)
+
+    def goto_command(self, position):
+        """jump so that hist[position] is the command just played
+
+        The playback time is the command's own, so the command after it is
+        only played when its time comes.
+        """
+        self._move_cursor(position + 1, self._hist[position].time)
+
+    def goto_offset(self, delta):
+        """jump forward or back from the current playback time
+
+        Parameters
+        ==========
+        delta : datetime.timedelta
+            amount of playback time to move by; negative moves backwards
+        """
+        self.goto_time(self.current_time + delta)
+
+    def goto_flagged(self, forward=True):
+        """jump to the next or previous flagged command
+
+        The flagged command becomes the current command, as if it had just
+        been played.
+
+        Parameters
+        ==========
+        forward : bool
+            search after the current command if True, before it otherwise
+
+        Returns
+        =======
+        _ : bool
+            False if there is no flagged command in that direction
+        """
+        return self.goto_next_of(self._flagged, forward)
+
+    def goto_next_of(self, positions, forward=True):
+        """jump to the next or previous command out of a sorted list of positions
+
+        The command jumped to becomes the current command, as if it had just
+        been played.
+
+        Parameters
+        ==========
+        positions : list[int]
+            sorted positions in hist, e.g. search matches
+        forward : bool
+            search after the current command if True, before it otherwise
+
+        Returns
+        =======
+        _ : bool
+            False if there is no position in that direction
+        """
+        current = self.playback_position - 1
+        if forward:
+            i = bisect.bisect_right(positions, current)
+        else:
+            i = bisect.bisect_left(positions, current) - 1
+        if not 0 <= i < len(positions):
+            return False
+        self.goto_command(positions[i])
+        return True
+
+    def seek(self, spec):
+        """jump to a position described by a string
+
+        Accepted forms are a relative offset ("+5m", "-30s", "+1h30m"),
+        an index into the history ("#120"), or a date and/or time
+        ("2019-10-20 17:24:00", "17:24"); missing parts of a date or time
+        are taken from the current playback time.
+
+        Parameters
+        ==========
+        spec : str
+            description of where to jump to
+
+        Raises
+        ======
+        ValueError
+            if spec can't be understood
+        """
+        spec = spec.strip()
+        if spec.startswith("#"):
+            self.goto_index(int(spec[1:]))
+            return
+        delta = parse_offset(spec)
+        if delta is not None:
+            self.goto_offset(delta)
+            return
+        try:
+            date_time = parsedate(
+                spec, default=self.current_time.replace(microsecond=0)
+            )
+        except (OverflowError, ValueError) as e:
+            raise ValueError(f"can't seek to {spec!r}: {e}")
+        self.goto_time(date_time)
+
     def change_playback_mode(self):
         """Rotates to the next playback_mode available
         """
@@ -336,14 +605,74 @@ class Playback:
     def flag_current_command(self):
         """toggle the flagged setting for the current Command object
         """
-        if 0 == self.playback_position:
-            self.hist[self.playback_position].flagged = not self.hist[
-                self.playback_position
-            ].flagged
-        else:
-            self.hist[self.playback_position - 1].flagged = not self.hist[
-                self.playback_position - 1
-            ].flagged
+        position = max(self.playback_position - 1, 0)
+        command = self.hist[position]
+        command.flagged = not command.flagged
+
+        i = bisect.bisect_left(self._flagged, position)
+        if command.flagged:
+            self._flagged.insert(i, position)
+        elif i < len(self._flagged) and self._flagged[i] == position:
+            del self._flagged[i]
+        if self.journal:
+            self.journal.record(
+                self.table, self._in_table(position), flagged=command.flagged
+            )
+
+    def comment_current_command(self, comment):
+        """set the comment of the current Command object
+
+        Parameters
+        ==========
+        comment : str
+            new comment
+        """
+        position = max(self.playback_position - 1, 0)
+        self.hist[position].comment = comment
+        if self.journal:
+            self.journal.record(self.table, self._in_table(position), comment=comment)
+
+    def attach_journal(self, journal):
+        """apply a journal's annotations and record later ones to it
+
+        Parameters
+        ==========
+        journal : journal.AnnotationJournal
+            journal of flags and comments made in earlier sessions
+        """
+        journal.apply(self.table)
+        self._flagged = self.hist.flagged_positions()
+        self.journal = journal
+
+    def view(self):
+        """a views.HistoryView of the whole history, to filter
+
+        e.g. playback.play_view(playback.view().user("root").flagged())
+
+        Returns
+        =======
+        view : views.HistoryView
+        """
+        return HistoryView(self.table)
+
+    def play_view(self, view=None):
+        """play only the commands in a view, or the whole history again
+
+        Playback continues from the first command in the view at or after the
+        current playback time.
+
+        Parameters
+        ==========
+        view : views.HistoryView
+            view of this Playback's table to play; None for the whole history
+        """
+        if view is None:
+            view = self.table
+        elif view.table is not self.table:
+            raise ValueError("view must be of this playback's history")
+        current_time = self.current_time
+        self.hist = view
+        self.goto_time(current_time)
 
 
 def merge_history(playbacks):
@@ -352,6 +681,10 @@ def merge_history(playbacks):
     #future: If all playback modes match, the playback mode will remain the same. Otherwise it will
     revert to manual.
 
+    Each history is already sorted, so they are merged in one pass by
+    CommandTable.merged; commands with the same time keep the order of
+    playbacks.  Use iter_merged to stream a merge instead.
+
     Parameters
     ==========
     playbacks : list[playback.Playback]
@@ -363,12 +696,178 @@ def merge_history(playbacks):
         a single Playback that merges all events of input Playbacks
     """
     combined_playback = Playback()
-    for pb in playbacks:
-        try:
-            # can't directly extend the history because of some property masking
-            extended = combined_playback.hist + pb.hist
-            combined_playback.hist = extended
-        except Exception as e:
-            print(e)
-            continue
+    with metrics.timer("hsp_hist_build_seconds", step="merge"):
+        combined_playback.hist = CommandTable.merged(pb.table for pb in playbacks)
     return combined_playback
+
+
+def iter_merged(histories):
+    """Yields the Commands of several time-sorted histories in time order
+
+    A heap-based k-way merge: each history is read once, front to back, so
+    merging is linear in the total number of commands (times log k) and only
+    one pending command per history is held at a time.  Histories can be
+    generators, so a merge never needs every history in memory at once.
+    Commands with the same time come out in the order of their histories.
+
+    Parameters
+    ==========
+    histories : iterable
+        commandtable.CommandTable and views.HistoryView objects or other
+        iterables of Commands, each already sorted by time
+
+    Yields
+    ======
+    command : command.Command
+        the next Command across all histories
+    """
+    streams = []
+    for hist in histories:
+        if isinstance(hist, (CommandTable, HistoryView)):
+            # the table already has its times in seconds
+            streams.append(zip(hist.times, hist))
+        else:
+            streams.append(((to_seconds(c.time), c) for c in hist))
+    for _, command in heapq.merge(*streams, key=itemgetter(0)):
+        yield command
+
+
+def load_playbacks(
+    files, lazy_results=False, workers=None, progress=print, cache_dir=None
+):
+    """Returns a Playback for each history file, loading them in parallel
+
+    Parsing is CPU-bound and the files are independent, so each file is loaded
+    by PBLoader.load_all in a separate process.  Workers send their history
+    back as CommandTable.pack bytes rather than pickled Command objects.
+
+    Parameters
+    ==========
+    files : dict
+        history filename -> histfile_typehint, as returned by parseconfig;
+        a filename may be a glob pattern (e.g. "*") matched in SESSION_FOLDER
+    lazy_results : bool
+        leave command results in the history files until they are displayed
+    workers : int
+        number of processes to load with; None for one per CPU, and 0 (or a
+        single file) loads everything in this process
+    progress : callable
+        called with a line of text as each file starts and finishes loading,
+        and for a file no loader can read (which gets an empty Playback);
+        None for no progress output
+    cache_dir : str
+        folder of a cache.ParseCache to reuse parsed histories from; None to
+        parse every file
+
+    Returns
+    =======
+    playbacks : list[playback.Playback]
+        one Playback per file, in the order of files
+    """
+    progress = progress or (lambda line: None)
+    files = expand_histfiles(files)
+    count = len(files)
+    started = time.monotonic()
+    tables = [None] * count
+
+    def finished(index, table):
+        tables[index] = table
+        done = sum(t is not None for t in tables)
+        progress(
+            f"[{done}/{count}] {files[index][0]}: {len(table)} commands "
+            f"({time.monotonic() - started:.1f}s)"
+        )
+
+    if workers == 0 or count < 2:
+        for index, (fi, hint) in enumerate(files):
+            progress(f"loading {fi}")
+            try:
+                table = _load_table(fi, hint, lazy_results, cache_dir)
+            except UnknownFormatError as e:
+                progress(str(e))
+                table = CommandTable()
+            finished(index, table)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for index, (fi, hint) in enumerate(files):
+                progress(f"loading {fi}")
+                future = pool.submit(
+                    _load_packed, fi, hint, lazy_results, cache_dir, metrics.enabled
+                )
+                futures[future] = index
+            for future in as_completed(futures):
+                try:
+                    data, collected = future.result()
+                except UnknownFormatError as e:
+                    progress(str(e))
+                    finished(futures[future], CommandTable())
+                    continue
+                metrics.merge(collected)
+                finished(futures[future], CommandTable.unpack(data))
+
+    if cache_dir:
+        # only now that this process holds every entry it reads from, so a
+        # worker's store can't evict an entry another worker just returned
+        cache = ParseCache(cache_dir)
+        for table in tables:
+            cache.hold(table)
+        cache.evict()
+
+    playbacks = []
+    for (fi, _), table in zip(files, tables):
+        pb = Playback(lazy_results=lazy_results)
+        pb.histfile = fi
+        pb.hist = table
+        playbacks.append(pb)
+    return playbacks
+
+
+def expand_histfiles(files):
+    """Return (filename, typehint) pairs with glob patterns expanded
+
+    Files that match more than one entry are only loaded once; hidden files
+    and the annotation journal are skipped.
+    """
+    expanded = {}
+    for fi, hint in files.items():
+        if not glob.has_magic(fi):
+            expanded.setdefault(fi, hint)
+            continue
+        for path in sorted(glob.glob(os.path.join(SESSION_FOLDER, fi))):
+            name = os.path.relpath(path, SESSION_FOLDER)
+            if os.path.isfile(path) and path != os.path.normpath(JOURNAL_FILE):
+                expanded.setdefault(name, hint)
+    return list(expanded.items())
+
+
+def _load_table(histfile, histfile_typehint, lazy_results, cache_dir=None):
+    """Load one history file into a CommandTable
+    """
+    hist = PBLoader.load_all(
+        SESSION_FOLDER,
+        histfile,
+        histfile_typehint,
+        lazy=lazy_results,
+        cache=ParseCache(cache_dir, auto_evict=False) if cache_dir else None,
+    )
+    if not isinstance(hist, CommandTable):
+        with metrics.timer("hsp_hist_build_seconds", step="sort"):
+            hist = CommandTable(hist)
+    hist.tag_source(histfile)
+    return hist
+
+
+def _load_packed(
+    histfile, histfile_typehint, lazy_results, cache_dir=None, collect_metrics=False
+):
+    """Worker process entry point
+
+    Returns the loaded history as packed bytes, and the metrics collected
+    while loading it (see metrics.collected) if collect_metrics is True.
+    """
+    if collect_metrics:
+        metrics.reset()
+        metrics.enable()
+    data = _load_table(histfile, histfile_typehint, lazy_results, cache_dir).pack()
+    return data, metrics.collected() if collect_metrics else None
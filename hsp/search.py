@@ -0,0 +1,227 @@
+"""Defines the full-text index used to search a history
+
+The index maps each token (a run of letters, digits and underscores, lower
+cased) in a command or its result to the rows that contain it.  A substring
+query is split into the same tokens: tokens bounded on both sides in the query
+must appear whole, and the partial tokens at its ends are matched against the
+vocabulary by prefix, suffix or substring.  Only the rows that have every token
+are then checked against the query itself, so a search reads the text of a
+handful of commands instead of all of them.
+
+Regex queries are prefiltered the same way on the literal text the pattern
+requires, when it requires any.
+"""
+
+from array import array
+import asyncio
+import bisect
+import re
+
+import lazytext
+
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+_TOKEN = re.compile(r"\w+")
+_WORD = re.compile(r"\w")
+
+INDEX_CHUNK = 2000  # rows indexed between yields to the event loop
+
+
+class SearchIndex:
+    """Inverted token index over the commands and results of a CommandTable
+
+    Rows are indexed in the order they were added, so the index can catch up
+    with a table that is still growing (see update).  Rows that haven't been
+    indexed yet are still searched, just by reading them.
+
+    Attributes
+    ==========
+    table : commandtable.CommandTable
+        history being indexed
+    indexed : int
+        number of rows indexed so far
+
+    Methods
+    =======
+    update(self, limit=None)
+        index rows added since the last update
+    search(self, query, regex=False)
+        positions of the commands whose command or result matches a query
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.indexed = 0
+        self._postings = {}  # token -> array of rows
+        self._vocabulary = None  # sorted tokens, rebuilt after updates
+
+    def _text(self, row):
+        """Return the searchable text of a row
+        """
+        command = self.table._commands.get(row)
+        result = self.table._results.get(row)
+        return f"{_resolve(command)}\n{_resolve(result)}"
+
+    def update(self, limit=None):
+        """index rows added since the last update
+
+        Parameters
+        ==========
+        limit : int
+            most rows to index in this call; None for all of them
+
+        Returns
+        =======
+        count : int
+            number of rows indexed
+        """
+        end = len(self.table._time)
+        if limit is not None:
+            end = min(end, self.indexed + limit)
+        postings = self._postings
+        # every text is read once, so don't push the displayed ones out of
+        # the cache for it
+        with lazytext.uncached():
+            for row in range(self.indexed, end):
+                for token in set(_TOKEN.findall(self._text(row).lower())):
+                    try:
+                        postings[token].append(row)
+                    except KeyError:
+                        postings[token] = array("q", [row])
+        count = end - self.indexed
+        self.indexed = end
+        if count:
+            self._vocabulary = None
+        return count
+
+    def _rows_with(self, token, left_bounded, right_bounded):
+        """Return the set of indexed rows with a token that could match
+        """
+        if left_bounded and right_bounded:
+            return set(self._postings.get(token, ()))
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        vocabulary = self._vocabulary
+        if left_bounded:
+            lo = bisect.bisect_left(vocabulary, token)
+            hi = bisect.bisect_left(vocabulary, token + "\U0010ffff", lo)
+            matches = vocabulary[lo:hi]
+        elif right_bounded:
+            matches = [t for t in vocabulary if t.endswith(token)]
+        else:
+            matches = [t for t in vocabulary if token in t]
+        rows = set()
+        for t in matches:
+            rows.update(self._postings[t])
+        return rows
+
+    def _candidates(self, literal):
+        """Return rows that may contain literal, or None if any row may
+
+        Every row not yet indexed is a candidate.
+        """
+        literal = literal.lower()
+        tokens = list(_TOKEN.finditer(literal))
+        if not tokens:
+            return None
+        rows = None
+        for match in tokens:
+            left = match.start() > 0
+            right = match.end() < len(literal)
+            found = self._rows_with(match.group(), left, right)
+            rows = found if rows is None else rows & found
+            if not rows:
+                break
+        rows.update(range(self.indexed, len(self.table._time)))
+        return rows
+
+    def search(self, query, regex=False):
+        """positions of the commands whose command or result matches a query
+
+        Parameters
+        ==========
+        query : str
+            text to find (case-insensitive), or a regular expression
+        regex : bool
+            treat query as a regular expression (case-sensitive unless it
+            says otherwise)
+
+        Returns
+        =======
+        positions : list[int]
+            sorted positions in the table of the matching commands
+        """
+        if regex:
+            pattern = re.compile(query)
+            literals = _required_literals(query)
+            matches = pattern.search
+        else:
+            literals = [query]
+            needle = query.lower()
+            matches = lambda text: needle in text.lower()
+
+        rows = None
+        for literal in literals:
+            found = self._candidates(literal)
+            if found is not None:
+                rows = found if rows is None else rows & found
+        if rows is None:
+            rows = range(len(self.table._time))
+
+        with lazytext.uncached():
+            positions = [
+                self.table.position(row) for row in rows if matches(self._text(row))
+            ]
+        positions.sort()
+        return positions
+
+
+def _resolve(val):
+    return "" if val is None else str(val)
+
+
+def _required_literals(pattern):
+    """Return literal strings that any match of a regex must contain
+
+    Only runs of plain characters at the top level of the pattern count;
+    a top-level alternation or a case-insensitive flag means nothing is
+    required and every row has to be checked.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+    state = getattr(parsed, "state", None) or parsed.pattern
+    if state.flags & re.IGNORECASE:
+        return []
+    literals = []
+    current = []
+    for op, arg in parsed:
+        if op is sre_parse.LITERAL:
+            current.append(chr(arg))
+            continue
+        if op is sre_parse.BRANCH:
+            return []
+        if current:
+            literals.append("".join(current))
+            current = []
+    if current:
+        literals.append("".join(current))
+    # a literal only narrows the search if it has a word character in it
+    return [literal for literal in literals if _WORD.search(literal)]
+
+
+async def index_in_background(index, interval=1.0):
+    """Keep an index up to date without blocking the event loop
+
+    Indexes INDEX_CHUNK rows at a time, yielding between chunks, then checks
+    for new rows (e.g. from follow mode) every interval seconds.
+    """
+    while True:
+        if index.update(INDEX_CHUNK):
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(interval)
@@ -0,0 +1,228 @@
+"""Defines the binary session format that saved Playbacks are written in
+
+A session file holds a commandtable.CommandTable as its raw columns, so it can
+be opened without deserializing any commands:
+
+    header      magic, format version, command count, section count
+    sections    (offset, length) in bytes of each section below
+    times       int64 time index in seconds, sorted (CommandTable.times)
+    ...         the other fixed-width columns, one section each
+    values      json lists of the distinct users, hosts and sources
+    heap        utf-8 text of the commands, results and comments
+
+Numbers are little-endian and every section starts on an 8 byte boundary.
+load copies the fixed-width columns straight into arrays and leaves the text
+in the file as lazytext.LazyText references, so opening a session costs about
+as much as reading its index and only the commands that are displayed are
+ever read.
+"""
+
+from array import array
+import json
+import mmap
+import struct
+import sys
+
+from commandtable import CommandTable, _CodedColumn, _TextColumn, _HEAP
+
+MAGIC = b"HSPSESS\x00"
+VERSION = 1
+
+_HEADER = struct.Struct("<8sIQI")  # magic, version, count, number of sections
+_SECTION = struct.Struct("<QQ")  # offset, length
+
+# fixed-width sections in file order: (name, array typecode)
+_COLUMNS = [
+    ("times", "q"),
+    ("order", "q"),
+    ("time", "q"),
+    ("users", "i"),
+    ("hosts", "i"),
+    ("sources", "i"),
+    ("commands.source", "i"),
+    ("commands.start", "q"),
+    ("commands.length", "q"),
+    ("results.source", "i"),
+    ("results.start", "q"),
+    ("results.length", "q"),
+    ("comments.source", "i"),
+    ("comments.start", "q"),
+    ("comments.length", "q"),
+]
+_SECTIONS = [name for name, _ in _COLUMNS] + ["flags", "values", "heap"]
+
+_TEXT = 0  # text source code in a session file: the file itself
+
+
+class SessionFormatError(ValueError):
+    """Raised when a file is not a session file this version can read
+    """
+
+
+def save(table, filename):
+    """Write a CommandTable to filename as a session file
+
+    Text that is still a lazytext.LazyText reference is read and written
+    into the session file, so the file doesn't depend on the original
+    history files.
+
+    Parameters
+    ==========
+    table : commandtable.CommandTable
+        history to save
+    filename : str
+        file to write
+    """
+    values = json.dumps(
+        [table._users.values, table._hosts.values, table._sources.values]
+    ).encode("utf-8")
+    heap_offset = _heap_offset(table, values)
+    heap = bytearray()
+    columns = {
+        "times": table.times,
+        "order": table._order,
+        "time": table._time,
+        "users": table._users.codes,
+        "hosts": table._hosts.codes,
+        "sources": table._sources.codes,
+    }
+    for name in ("commands", "results", "comments"):
+        column = getattr(table, "_" + name).materialized()
+        base = heap_offset + len(heap)
+        heap += column.heap
+        columns[name + ".source"] = array(
+            "i", [_TEXT if source == _HEAP else source for source in column.source]
+        )
+        columns[name + ".start"] = array("q", [start + base for start in column.start])
+        columns[name + ".length"] = column.length
+
+    with open(filename, "wb") as outfi:
+        outfi.write(_HEADER.pack(MAGIC, VERSION, len(table), len(_SECTIONS)))
+        offset = _HEADER.size + _SECTION.size * len(_SECTIONS)
+        data = [_little_endian(columns[name]) for name, _ in _COLUMNS]
+        data += [bytes(table._flags), values, bytes(heap)]
+        for section in data:
+            offset = _align(offset)
+            outfi.write(_SECTION.pack(offset, len(section)))
+            offset += len(section)
+        for section in data:
+            outfi.write(bytes(_align(outfi.tell()) - outfi.tell()))
+            outfi.write(section)
+
+
+def load(filename):
+    """Open a session file as a CommandTable
+
+    The fixed-width columns are copied out of a memory map; command, result
+    and comment text stays in the file until it is read.
+
+    Parameters
+    ==========
+    filename : str
+        session file to open
+
+    Returns
+    =======
+    table : commandtable.CommandTable
+        the saved history
+
+    Raises
+    ======
+    SessionFormatError
+        if the file isn't a whole session file of this version
+    """
+    with open(filename, "rb") as infi:
+        try:
+            mm = mmap.mmap(infi.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files can't be mapped
+            raise SessionFormatError(f"{filename} is not a session file")
+    try:
+        if len(mm) < _HEADER.size:
+            raise SessionFormatError(f"{filename} is not a session file")
+        magic, version, count, nsections = _HEADER.unpack_from(mm)
+        if magic != MAGIC:
+            raise SessionFormatError(f"{filename} is not a session file")
+        if version != VERSION:
+            raise SessionFormatError(
+                f"{filename} is session format {version}; expected {VERSION}"
+            )
+        if nsections != len(_SECTIONS):
+            raise SessionFormatError(
+                f"{filename} has {nsections} sections; expected {len(_SECTIONS)}"
+            )
+        if len(mm) < _HEADER.size + nsections * _SECTION.size:
+            raise SessionFormatError(f"{filename} is truncated")
+        sections = {}
+        for i, name in enumerate(_SECTIONS):
+            offset, length = _SECTION.unpack_from(mm, _HEADER.size + i * _SECTION.size)
+            if offset + length > len(mm):
+                raise SessionFormatError(f"{filename} is truncated in its {name}")
+            sections[name] = (offset, length)
+
+        def column(name, typecode):
+            offset, length = sections[name]
+            data = array(typecode)
+            data.frombytes(mm[offset : offset + length])
+            if sys.byteorder == "big":
+                data.byteswap()
+            if len(data) != count:
+                raise SessionFormatError(f"{filename}: bad {name} section")
+            return data
+
+        data = {name: column(name, typecode) for name, typecode in _COLUMNS}
+        offset, length = sections["flags"]
+        flags = bytearray(mm[offset : offset + length])
+        if len(flags) < (count + 7) // 8:
+            raise SessionFormatError(f"{filename}: bad flags section")
+        offset, length = sections["values"]
+        users, hosts, sources = json.loads(mm[offset : offset + length].decode())
+    finally:
+        mm.close()
+
+    table = CommandTable()
+    table.times = data["times"]
+    table._order = data["order"]
+    table._time = data["time"]
+    table._users = _coded(users, data["users"])
+    table._hosts = _coded(hosts, data["hosts"])
+    table._sources = _coded(sources, data["sources"])
+    table._files.code(filename)  # _TEXT
+    for name in ("commands", "results", "comments"):
+        text = _TextColumn(table._files)
+        text.source = data[name + ".source"]
+        text.start = data[name + ".start"]
+        text.length = data[name + ".length"]
+        setattr(table, "_" + name, text)
+    table._flags = flags
+    return table
+
+
+def _coded(values, codes):
+    column = _CodedColumn()
+    column.__setstate__((values, codes))
+    return column
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _heap_offset(table, values):
+    """Return the file offset the heap will start at when table is saved
+
+    Every section before the heap has a size known from the table alone, so
+    text offsets can be written as absolute file offsets in one pass.
+    """
+    count = len(table)
+    offset = _HEADER.size + _SECTION.size * len(_SECTIONS)
+    for _, typecode in _COLUMNS:
+        offset = _align(offset) + count * array(typecode).itemsize
+    offset = _align(offset) + len(table._flags)
+    return _align(_align(offset) + len(values))
+
+
+def _little_endian(data):
+    if sys.byteorder == "big":
+        data = array(data.typecode, data)
+        data.byteswap()
+    return data.tobytes()
@@ -0,0 +1,134 @@
+"""Defines the pane HspApp lists the commands played so far in
+
+TimelineControl shows one line per command, read straight from the
+Playback's hist by position, so it can scroll back over millions of played
+commands while only the rows on screen are ever read or laid out.
+"""
+
+from prompt_toolkit.layout.controls import UIContent, UIControl
+from prompt_toolkit.mouse_events import MouseEventType
+
+SCROLL_LINES = 3  # rows scrolled by a turn of the mouse wheel
+
+
+class TimelineControl(UIControl):
+    """Control listing a Playback's played commands, one per row
+
+    While following, the last row is the command played most recently;
+    scrolling up stops following and scrolling back down to the end starts
+    it again.  Clicking a row seeks the playback so that command is the one
+    just played.
+
+    Attributes
+    ==========
+    playback : playback.Playback
+        playback whose history is listed
+    follow : bool
+        keep the most recently played command on the last row
+    top : int
+        position in playback.hist of the first row shown
+    height : int
+        rows shown at the last redraw
+    on_seek : callable
+        called with no arguments after a click has moved the playback
+
+    Methods
+    =======
+    scroll(self, rows)
+        scroll down (or up, if rows is negative) by rows
+    page_down(self)
+        scroll down by a screenful
+    page_up(self)
+        scroll up by a screenful
+    home(self)
+        scroll to the first command
+    end(self)
+        scroll to the most recently played command and follow it
+    """
+
+    def __init__(self, playback, on_seek=None):
+        self.playback = playback
+        self.on_seek = on_seek
+        self.follow = True
+        self.top = 0
+        self.height = 1
+
+    def _played(self):
+        return min(self.playback.playback_position, len(self.playback.hist))
+
+    def is_focusable(self):
+        return False
+
+    def preferred_height(self, width, max_available_height, wrap_lines):
+        return max_available_height
+
+    def _row(self, position, width, current):
+        """Return the styled fragments of the row for a command
+        """
+        command = self.playback.hist[position]
+        try:
+            first_line = str(command.command).partition("\n")[0]
+            text = (
+                f"{command.time.strftime('%m-%d %H:%M:%S')} "
+                f"{command.hostUUID}:{command.user} > {first_line}"
+            )
+            style = "ansired" if command.flagged else ""
+        except AttributeError:
+            text, style = str(command), ""
+        if position == current:
+            style += " reverse"
+        return [(style, text[:width])]
+
+    def create_content(self, width, height):
+        self.height = height = max(height or 1, 1)
+        played = self._played()
+        if self.follow:
+            self.top = played - height
+        self.top = max(min(self.top, played - height), 0)
+        top, current = self.top, played - 1
+        return UIContent(
+            get_line=lambda i: self._row(top + i, width, current),
+            line_count=min(height, played - top),
+        )
+
+    def mouse_handler(self, mouse_event):
+        if mouse_event.event_type == MouseEventType.SCROLL_DOWN:
+            self.scroll(SCROLL_LINES)
+        elif mouse_event.event_type == MouseEventType.SCROLL_UP:
+            self.scroll(-SCROLL_LINES)
+        elif mouse_event.event_type == MouseEventType.MOUSE_UP:
+            position = self.top + mouse_event.position.y
+            if position < self._played():
+                self.follow = True
+                self.playback.goto_command(position)
+                if self.on_seek is not None:
+                    self.on_seek()
+        else:
+            return NotImplemented
+
+    def scroll(self, rows):
+        """scroll down (or up, if rows is negative) by rows
+        """
+        last = max(self._played() - self.height, 0)
+        self.top = max(min(self.top + rows, last), 0)
+        self.follow = self.top == last
+
+    def page_down(self):
+        """scroll down by a screenful
+        """
+        self.scroll(self.height)
+
+    def page_up(self):
+        """scroll up by a screenful
+        """
+        self.scroll(-self.height)
+
+    def home(self):
+        """scroll to the first command
+        """
+        self.scroll(-self._played())
+
+    def end(self):
+        """scroll to the most recently played command and follow it
+        """
+        self.scroll(self._played())
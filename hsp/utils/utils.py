@@ -1,4 +1,10 @@
+import datetime
 from optparse import OptionParser
+import re
+
+_OFFSET_RE = re.compile(r"^([+-])((?:\d+(?:\.\d+)?[dhms])+)$")
+_OFFSET_PART_RE = re.compile(r"(\d+(?:\.\d+)?)([dhms])")
+_OFFSET_UNITS = {"d": "days", "h": "hours", "m": "minutes", "s": "seconds"}
 
 
 def parseargs():
@@ -26,6 +32,7 @@ def parseconfig(filename):
     """Opens a configuration file and returns a dictionary of parameters
 
     Format of the config file is "history_filename:file_format #comment"
+    where ":file_format" may be left off
     Lines that begin with # are ignored
     Whitespace lines are ignored
     
@@ -45,13 +52,37 @@ def parseconfig(filename):
             if "#" in line:
                 line, comment, *_ = line.split("#")
 
+            line = line.strip()
             if line:
-                try:
-                    filename, file_format = line.split(":")
-                    file_format = file_format.strip()
-                    if not file_format:
-                        file_format = None
-                    files[filename] = file_format
-                except:
-                    pass
+                # the file format is optional; loaders can detect it
+                filename, _, file_format = line.partition(":")
+                files[filename.strip()] = file_format.strip() or None
     return files
+
+
+def parse_offset(text):
+    """Parses a relative time offset such as "+5m", "-30s" or "+1h30m"
+
+    Units are d (days), h (hours), m (minutes) and s (seconds); each may have
+    a decimal part.  The leading sign is required so that offsets can't be
+    mistaken for times of day.
+
+    Parameters
+    ----------
+    text : str
+        offset to parse
+
+    Returns
+    -------
+    delta : datetime.timedelta
+        the parsed offset, or None if text is not an offset
+    """
+    match = _OFFSET_RE.match(text.strip())
+    if not match:
+        return None
+    delta = datetime.timedelta(0)
+    for amount, unit in _OFFSET_PART_RE.findall(match.group(2)):
+        delta += datetime.timedelta(**{_OFFSET_UNITS[unit]: float(amount)})
+    if match.group(1) == "-":
+        delta = -delta
+    return delta
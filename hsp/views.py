@@ -0,0 +1,352 @@
+"""Defines filtered views over a Playback's history
+
+A HistoryView is a time-ordered subset of the commands in a
+commandtable.CommandTable, kept as the sorted positions of those commands in
+the table.  Views never copy Commands: indexing one returns the table's own
+CommandView, so flags and comments set through a view are set on the table.
+
+Filters narrow a view and return a new one, so they compose by chaining:
+
+    view = HistoryView(table).user("root").between(start, end).flagged()
+
+and views over the same table combine with & and |.  User and host filters
+compare the table's dictionary-encoded columns, so they scan small ints
+rather than strings; flagged uses the table's flag bitmap, and time ranges
+are a bisect of the sorted times.
+"""
+
+from array import array
+import bisect
+import heapq
+from itertools import compress
+import re
+import shlex
+
+from dateutil.parser import parse as parsedate
+
+from command import to_seconds
+from lazytext import resolve
+
+
+class HistoryView:
+    """Time-ordered subset of the commands of a CommandTable
+
+    A view can be set as a playback.Playback's hist and played like the full
+    history.  Commands added through the view (as Playback.add_command does)
+    are added to the table and, if they pass the view's filters, to the view;
+    the table should otherwise not be changed while the view is in use.
+
+    Attributes
+    ==========
+    table : commandtable.CommandTable
+        history the view selects from
+    positions : array.array or range
+        sorted positions in table of the commands in the view
+    times : array.array
+        time in seconds of each command in the view; suitable for bisect
+
+    Methods
+    =======
+    user(self, *users)
+        commands run by any of users
+    host(self, *hosts)
+        commands run on any of hosts
+    source(self, *sources)
+        commands loaded from any of sources
+    between(self, start=None, end=None)
+        commands run at or after start and before end
+    flagged(self)
+        flagged commands
+    matching(self, pattern)
+        commands matching a regex
+    base_position(self, position)
+        position in table of the command at a position of the view
+    local_positions(self, positions)
+        positions in the view of the commands at sorted positions of table
+    flagged_positions(self)
+        sorted list of the positions of flagged commands
+    insert(self, command)
+        add a Command to the table and, if it passes the filters, the view
+    """
+
+    def __init__(self, table, positions=None, match=None):
+        self.table = table
+        if positions is None:
+            # the whole table; follows it as it grows
+            self.positions = range(len(table))
+            self.times = table.times
+        else:
+            self.positions = array("q", positions)
+            self.times = array("q", map(table.times.__getitem__, self.positions))
+        self._match = match  # Command -> bool, or None for every command
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self.table[p] for p in self.positions[position]]
+        return self.table[self.positions[position]]
+
+    def __iter__(self):
+        table = self.table
+        for position in self.positions:
+            yield table[position]
+
+    def _narrow(self, keep, match):
+        """Return a view of the positions for which keep is true
+        """
+        return HistoryView(
+            self.table, compress(self.positions, keep), _both(self._match, match)
+        )
+
+    def _coded(self, column, vals):
+        """Return a mask over the view of the rows whose code is one of vals
+        """
+        codes = {column._index[val] for val in vals if val in column._index}
+        if isinstance(self.positions, range):
+            rows = self.table._order[self.positions.start : self.positions.stop]
+        else:
+            rows = map(self.table._order.__getitem__, self.positions)
+        return map(codes.__contains__, map(column.codes.__getitem__, rows))
+
+    def user(self, *users):
+        """commands run by any of users
+
+        Returns
+        =======
+        view : HistoryView
+        """
+        users = set(users)
+        return self._narrow(
+            self._coded(self.table._users, users), lambda c: c.user in users
+        )
+
+    def host(self, *hosts):
+        """commands run on any of hosts
+
+        Returns
+        =======
+        view : HistoryView
+        """
+        hosts = set(hosts)
+        return self._narrow(
+            self._coded(self.table._hosts, hosts), lambda c: c.hostUUID in hosts
+        )
+
+    def source(self, *sources):
+        """commands loaded from any of sources
+
+        Returns
+        =======
+        view : HistoryView
+        """
+        sources = set(sources)
+        return self._narrow(
+            self._coded(self.table._sources, sources), lambda c: c.source in sources
+        )
+
+    def between(self, start=None, end=None):
+        """commands run at or after start and before end
+
+        Parameters
+        ==========
+        start : datetime.datetime
+            earliest time included; None for no lower bound
+        end : datetime.datetime
+            time after the last one included; None for no upper bound
+
+        Returns
+        =======
+        view : HistoryView
+        """
+        lo = 0 if start is None else bisect.bisect_left(self.times, to_seconds(start))
+        hi = (
+            len(self)
+            if end is None
+            else bisect.bisect_left(self.times, to_seconds(end))
+        )
+        match = lambda c: (start is None or c.time >= start) and (
+            end is None or c.time < end
+        )
+        return HistoryView(self.table, self.positions[lo:hi], _both(self._match, match))
+
+    def flagged(self):
+        """flagged commands
+
+        Returns
+        =======
+        view : HistoryView
+        """
+        positions = map(self.base_position, self.flagged_positions())
+        return HistoryView(
+            self.table, positions, _both(self._match, lambda c: c.flagged)
+        )
+
+    def matching(self, pattern):
+        """commands matching a regex
+
+        Parameters
+        ==========
+        pattern : str
+            regular expression searched for in the command text
+
+        Returns
+        =======
+        view : HistoryView
+        """
+        search = re.compile(pattern).search
+        commands = self.table._commands
+        text = lambda p: resolve(commands.get(self.table._order[p])) or ""
+        return self._narrow(
+            map(search, map(text, self.positions)),
+            lambda c: bool(search(c.command or "")),
+        )
+
+    def __and__(self, other):
+        """commands in both views
+        """
+        self._check_table(other)
+        keep = set(other.positions)
+        return self._narrow(map(keep.__contains__, self.positions), other._match)
+
+    def __or__(self, other):
+        """commands in either view
+        """
+        self._check_table(other)
+        if self._match is None or other._match is None:
+            return HistoryView(self.table)
+        first, second = self._match, other._match
+        return HistoryView(
+            self.table,
+            _union(self.positions, other.positions),
+            lambda c: first(c) or second(c),
+        )
+
+    def _check_table(self, other):
+        if other.table is not self.table:
+            raise ValueError("can only combine views of the same table")
+
+    def base_position(self, position):
+        """position in table of the command at a position of the view
+        """
+        return self.positions[position]
+
+    def local_positions(self, positions):
+        """positions in the view of the commands at sorted positions of table
+
+        Commands that aren't in the view are left out.
+
+        Parameters
+        ==========
+        positions : list[int]
+            sorted positions in table, e.g. search matches
+
+        Returns
+        =======
+        positions : list[int]
+            sorted positions in the view
+        """
+        if self._match is None:
+            return list(positions)
+        local = []
+        for position in positions:
+            i = bisect.bisect_left(self.positions, position)
+            if i < len(self.positions) and self.positions[i] == position:
+                local.append(i)
+        return local
+
+    def flagged_positions(self):
+        """sorted list of the positions of flagged commands
+        """
+        return self.local_positions(self.table.flagged_positions())
+
+    def insert(self, command):
+        """add a Command to the table and, if it passes the filters, the view
+
+        Returns
+        =======
+        position : int
+            position of the new command in the view, or None if it was only
+            added to the table
+        """
+        position = self.table.insert(command)
+        if self._match is None:
+            self.positions = range(len(self.table))
+            return position
+        i = bisect.bisect_left(self.positions, position)
+        # commands after the new one in the table have moved down by one
+        for j in range(i, len(self.positions)):
+            self.positions[j] += 1
+        if not self._match(command):
+            return None
+        self.positions.insert(i, position)
+        self.times.insert(i, self.table.times[position])
+        return i
+
+
+def _both(first, second):
+    """Return a predicate true when both predicates are (None is always true)
+    """
+    if first is None:
+        return second
+    return lambda c: first(c) and second(c)
+
+
+def _union(*sorted_positions):
+    """Yield each distinct position of several sorted sequences once, in order
+    """
+    last = None
+    for position in heapq.merge(*sorted_positions):
+        if position != last:
+            yield position
+            last = position
+
+
+def parse_filter(view, spec, default=None):
+    """Narrow a view by a filter typed by the user
+
+    spec is a space-separated list of terms, all of which a command must
+    pass: user=NAME, host=NAME and source=NAME (a comma-separated list
+    matches any of them), from=TIME and to=TIME (a date and/or time; missing
+    parts are taken from default), flagged, and re:PATTERN.  Terms with
+    spaces in them can be quoted.
+
+    Parameters
+    ==========
+    view : HistoryView
+        view to narrow
+    spec : str
+        the filter
+    default : datetime.datetime
+        supplies the parts of a date or time left out of from= and to=
+
+    Returns
+    =======
+    view : HistoryView
+
+    Raises
+    ======
+    ValueError
+        if spec can't be understood
+    """
+    for term in shlex.split(spec):
+        key, sep, val = term.partition("=")
+        if term == "flagged":
+            view = view.flagged()
+        elif term.startswith("re:"):
+            try:
+                view = view.matching(term[len("re:") :])
+            except re.error as e:
+                raise ValueError(f"bad regex in {term!r}: {e}")
+        elif sep and key in ("user", "host", "source"):
+            view = getattr(view, key)(*val.split(","))
+        elif sep and key in ("from", "to"):
+            try:
+                when = parsedate(val, default=default)
+            except (OverflowError, ValueError) as e:
+                raise ValueError(f"can't understand {term!r}: {e}")
+            view = view.between(start=when) if key == "from" else view.between(end=when)
+        else:
+            raise ValueError(f"unknown filter {term!r}")
+    return view
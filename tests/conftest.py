@@ -0,0 +1,5 @@
+import os
+import sys
+
+# hsp's modules import each other by bare name, as when run from the hsp folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "hsp"))
@@ -0,0 +1,23 @@
+import os
+import signal
+
+import bench
+
+
+def _killed(folder, files, arg, limit):
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def _finished(folder, files, arg, limit):
+    return 5, 0.5
+
+
+def test_child_killed_is_an_error():
+    result = bench.run("killed", _killed, None, None, None, 0)
+    assert result["events"] == 0
+    assert result["error"] == f"process killed by signal {signal.SIGKILL}"
+
+
+def test_result_is_returned():
+    result = bench.run("finished", _finished, None, None, None, 0)
+    assert (result["events"], result["rate"], result["error"]) == (5, 10.0, None)
@@ -0,0 +1,61 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import ParseCache
+from commandtable import CommandTable
+from loader import GenericCsvPBLoader
+import lazytext
+
+
+def _history(tmp_path, name, rows):
+    path = tmp_path / name
+    with open(path, "w") as outfi:
+        outfi.write("Time,Host,User,Command,Result,Flagged,Comment\n")
+        for i in range(rows):
+            outfi.write(f"2019-10-26 14:50:{i:02},host1,stark,cmd{i},out{i},False,\n")
+    return str(path)
+
+
+def _table(filename):
+    return CommandTable(GenericCsvPBLoader.load(filename))
+
+
+def test_hit_survives_eviction(tmp_path):
+    directory = str(tmp_path / "cache")
+    first = _history(tmp_path, "first.csv", 20)
+    second = _history(tmp_path, "second.csv", 20)
+    ParseCache(directory).put(first, GenericCsvPBLoader, _table(first))
+    table = ParseCache(directory).get(first, GenericCsvPBLoader)
+    lazytext.clear_cache()
+
+    # another store trims the cache to less than either entry
+    ParseCache(directory, max_bytes=1).put(second, GenericCsvPBLoader, _table(second))
+    assert [c.result for c in table] == [f"out{i}" for i in range(20)]
+
+
+def test_hit_survives_removal_by_another_process(tmp_path):
+    directory = str(tmp_path / "cache")
+    first = _history(tmp_path, "first.csv", 5)
+    cache = ParseCache(directory)
+    cache.put(first, GenericCsvPBLoader, _table(first))
+    table = cache.get(first, GenericCsvPBLoader)
+    lazytext.clear_cache()
+
+    cache.clear()  # as another process's evict would
+    assert [c.command for c in table] == [f"cmd{i}" for i in range(5)]
+
+
+def _get_packed(directory, filename):
+    return ParseCache(directory).get(filename, GenericCsvPBLoader).pack()
+
+
+def test_held_table_from_worker(tmp_path):
+    directory = str(tmp_path / "cache")
+    first = _history(tmp_path, "first.csv", 5)
+    ParseCache(directory).put(first, GenericCsvPBLoader, _table(first))
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        data = pool.submit(_get_packed, directory, first).result()
+    table = CommandTable.unpack(data)
+    cache = ParseCache(directory, max_bytes=1)
+    cache.hold(table)
+    cache.evict()
+    assert [path for _, _, path in cache._entries()] == table.text_files()
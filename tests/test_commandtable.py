@@ -0,0 +1,109 @@
+import datetime as dt
+import pickle
+
+import pytest
+
+from command import Command
+from commandtable import CommandTable
+from lazytext import LazyText
+
+
+def _at(minute, command, **fields):
+    return Command(dt.datetime(2019, 10, 26, 14, minute), command=command, **fields)
+
+
+def _commands(table):
+    return [c.command for c in table]
+
+
+def test_sorted_and_stable_for_equal_times():
+    table = CommandTable([_at(3, "c"), _at(1, "a"), _at(3, "d"), _at(2, "b")])
+    assert _commands(table) == ["a", "b", "c", "d"]
+    assert list(table.times) == sorted(table.times)
+
+
+def test_insert_keeps_order():
+    table = CommandTable([_at(1, "a"), _at(3, "c")])
+    assert table.insert(_at(2, "b")) == 1
+    assert table.insert(_at(3, "d")) == 3  # after commands at the same time
+    assert table.insert(_at(0, "first")) == 0
+    assert _commands(table) == ["first", "a", "b", "c", "d"]
+
+
+def test_row_and_position():
+    table = CommandTable([_at(2, "b"), _at(1, "a")])
+    rows = [table.row(position) for position in range(len(table))]
+    assert [table.position(row) for row in rows] == [0, 1]
+    table.insert(_at(0, "first"))
+    assert [table.position(row) for row in rows] == [1, 2]
+    with pytest.raises(IndexError):
+        table.position(99)
+
+
+def test_set_time_moves_the_row():
+    table = CommandTable([_at(1, "a"), _at(2, "b"), _at(3, "c")])
+    row = table.row(0)
+    table[0].time = dt.datetime(2019, 10, 26, 14, 5)
+    assert _commands(table) == ["b", "c", "a"]
+    assert table.position(row) == 2
+    assert table.version(row) == 1
+
+
+def test_set_time_accepts_ordinals_like_command():
+    table = CommandTable([_at(1, "a"), _at(2, "b")])
+    table[1].time = 737000
+    assert _commands(table) == ["b", "a"]
+    assert table[0].time == dt.datetime.fromordinal(737000)
+
+
+@pytest.mark.parametrize("bad", ["2019-10-26", None, 1.5, 0])
+def test_bad_time_leaves_the_table_alone(bad):
+    table = CommandTable([_at(1, "a"), _at(2, "b")])
+    with pytest.raises((TypeError, ValueError)):
+        table[0].time = bad
+    assert len(table) == 2
+    assert _commands(table) == ["a", "b"]
+    assert [table.position(table.row(p)) for p in range(2)] == [0, 1]
+
+
+def test_fields_round_trip():
+    command = _at(
+        1, "ls", user="stark", hostUUID="host1", result="out", flagged=True, comment="!"
+    )
+    [view] = CommandTable([command])
+    assert (view.time, view.user, view.hostUUID, view.command) == (
+        command.time,
+        "stark",
+        "host1",
+        "ls",
+    )
+    assert (view.result, view.flagged, view.comment) == ("out", True, "!")
+
+
+def test_flagged_positions_follow_changes():
+    table = CommandTable([_at(i, str(i)) for i in range(20)])
+    table[3].flagged = True
+    table[17].flagged = True
+    assert table.flagged_positions() == [3, 17]
+    table[3].flagged = False
+    table.insert(_at(0, "first"))
+    assert table.flagged_positions() == [18]
+
+
+def test_merged_interleaves_in_time_order():
+    first = CommandTable([_at(1, "a1"), _at(3, "a3"), _at(5, "a5")])
+    second = CommandTable([_at(2, "b2"), _at(3, "b3"), _at(6, "b6")])
+    second[0].flagged = True
+    merged = CommandTable.merged([first, second])
+    assert _commands(merged) == ["a1", "b2", "a3", "b3", "a5", "b6"]
+    assert merged.flagged_positions() == [1]
+    assert len(CommandTable.merged([])) == 0
+
+
+def test_lazy_text_and_pack(tmp_path):
+    path = tmp_path / "log"
+    path.write_bytes(b"hello world")
+    table = CommandTable([_at(1, "a", result=LazyText(str(path), 6, 5))])
+    assert table.text_files() == [str(path)]
+    for copy in (CommandTable.unpack(table.pack()), pickle.loads(pickle.dumps(table))):
+        assert [c.result for c in copy] == ["world"]
@@ -0,0 +1,58 @@
+import datetime as dt
+
+import pytest
+
+from command import Command
+from export import Writer, export
+from loader import GenericCsvPBLoader
+
+
+def _commands(year):
+    return [
+        Command(
+            dt.datetime(year, 1, 1, 0, i),
+            hostUUID="host1",
+            user="stark",
+            command=f"cmd{i}",
+            result=f"line 1\nline {i}",
+            flagged=i == 1,
+            comment="seen" if i == 2 else "",
+        )
+        for i in range(3)
+    ]
+
+
+@pytest.mark.parametrize("year", [1, 999, 2019])
+def test_csv_round_trip(tmp_path, year):
+    commands = _commands(year)
+    filename = str(tmp_path / "out.csv")
+    assert export(commands, "csv", filename) == {filename: 3}
+    loaded = GenericCsvPBLoader.load(filename)
+    fields = lambda c: (
+        c.time,
+        c.hostUUID,
+        c.user,
+        c.command,
+        c.result,
+        c.flagged,
+        c.comment,
+    )
+    assert [fields(c) for c in loaded] == [fields(c) for c in commands]
+
+
+def test_writer_must_implement_write():
+    class Incomplete(Writer):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete(None)
+
+
+def test_split_by_user(tmp_path):
+    commands = _commands(2019)
+    commands[1].user = "root"
+    counts = export(commands, "jsonl", str(tmp_path / "out.jsonl"), split="user")
+    assert counts == {
+        str(tmp_path / "out.stark.jsonl"): 2,
+        str(tmp_path / "out.root.jsonl"): 1,
+    }
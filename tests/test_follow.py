@@ -0,0 +1,84 @@
+import os
+
+from follow import FileFollower
+import loader
+from loader import GenericCsvPBLoader, OffPromptPBLoader, WinEventLogCsvPBLoader
+
+EVENT_HEADER = (
+    "#TYPE System.Diagnostics.EventLogEntry\n"
+    '"MachineName","TimeGenerated","UserName","Message"\n'
+)
+MESSAGE = 'An account was logged on.\n\nSubject:\n\tAccount Name:\t"stark"'
+EVENT_ROW = '"host1","10/26/2019 2:50:37 PM","CORP\\stark","{}"\n'.format(
+    MESSAGE.replace('"', '""')
+)
+CSV_HEADER = "Time,Host,User,Command,Result,Flagged,Comment\n"
+CSV_ROW = '2019-10-26 14:50:37,host1,stark,nmap,"line 1\nline 2\nline 3",False,\n'
+
+
+def _append(path, text):
+    with open(path, "a", newline="") as outfi:
+        outfi.write(text)
+
+
+def test_event_message_spanning_lines(tmp_path):
+    path = tmp_path / "events.csv"
+    path.write_text(EVENT_HEADER)
+    follower = FileFollower(str(path), WinEventLogCsvPBLoader)
+    _append(path, EVENT_ROW)
+    [command] = follower.poll()
+    assert command.hostUUID == "host1"
+    assert command.user == "CORP\\stark"
+    assert command.time.year == 2019
+    assert command.result == MESSAGE
+
+
+def test_row_split_across_appends(tmp_path):
+    path = tmp_path / "hist.csv"
+    path.write_text(CSV_HEADER)
+    follower = FileFollower(str(path), GenericCsvPBLoader)
+    cut = CSV_ROW.index("line 2")
+    _append(path, CSV_ROW[:cut])
+    assert follower.poll() == []  # the quoted Result is still open
+    _append(path, CSV_ROW[cut:])
+    [command] = follower.poll()
+    assert command.command == "nmap"
+    assert command.result == "line 1\nline 2\nline 3"
+
+
+def test_rows_after_multiline_row(tmp_path):
+    path = tmp_path / "hist.csv"
+    path.write_text(CSV_HEADER)
+    follower = FileFollower(str(path), GenericCsvPBLoader)
+    _append(path, CSV_ROW + "2019-10-26 14:51:00,host1,stark,id,uid=0,False,\n")
+    assert [c.command for c in follower.poll()] == ["nmap", "id"]
+
+
+def test_catch_up_matches_load_and_keeps_pending_command(tmp_path):
+    original = os.path.join(os.path.dirname(loader.__file__), "sessions")
+    data = open(os.path.join(original, "stark_host3_20191025_2"), "rb").read()
+    path = tmp_path / "msf.log"
+    path.write_bytes(data)
+    loaded = OffPromptPBLoader.load(str(path))
+    follower = FileFollower(str(path), OffPromptPBLoader, from_start=True)
+    caught_up = follower.catch_up()
+    assert [(c.time, c.command, c.result) for c in caught_up] == [
+        (c.time, c.command, c.result) for c in loaded
+    ]
+
+    # a command whose result is written after the file was read
+    _append(
+        path,
+        "===================\n2019-10-28 20:00:00,000\n[COMMAND][USER: stark]\nsessions -l\n\n",
+    )
+    assert follower.poll() == []
+    _append(
+        path,
+        "===================\n2019-10-28 20:00:01,000\n[RESULT]\nNo active sessions.\n",
+    )
+    assert follower.poll() == []
+    [command] = follower.poll()
+    assert (command.command, command.result) == (
+        "sessions -l",
+        "\nNo active sessions.\n",
+    )
@@ -0,0 +1,53 @@
+import datetime as dt
+import json
+
+from command import Command
+from commandtable import CommandTable
+from journal import AnnotationJournal
+
+
+def _table():
+    return CommandTable(
+        [
+            Command(dt.datetime(2019, 10, 26, 14, 50, 37), user="stark", command="ls"),
+            Command(dt.datetime(2019, 10, 26, 14, 50, 38), user="stark", command="id"),
+        ]
+    )
+
+
+def test_corrupt_records_are_skipped(tmp_path):
+    table = _table()
+    filename = str(tmp_path / "annotations.journal")
+    journal = AnnotationJournal(filename)
+    journal.record(table, 0, flagged=True)
+    journal.close()
+    key = json.loads(open(filename).read())["key"]
+    with open(filename, "a") as outfi:
+        for line in ["5", '"text"', "[1, 2]", '{"key": [[1]]}', "null", "{"]:
+            outfi.write(line + "\n")
+        outfi.write(json.dumps({"key": key, "comment": "seen"}) + "\n")
+
+    assert AnnotationJournal(filename).apply(table) == [0]
+    assert table[0].flagged
+    assert table[0].comment == "seen"
+
+
+def test_only_annotations_are_applied(tmp_path):
+    table = _table()
+    filename = str(tmp_path / "annotations.journal")
+    journal = AnnotationJournal(filename)
+    journal.record(table, 1, comment="ok")
+    journal.close()
+    key = json.loads(open(filename).read())["key"]
+    with open(filename, "a") as outfi:
+        record = {"key": key, "time": "now", "user": "root", "flagged": "yes"}
+        outfi.write(json.dumps(record) + "\n")
+
+    AnnotationJournal(filename).apply(table)
+    command = table[1]
+    assert (command.user, command.time) == (
+        "stark",
+        dt.datetime(2019, 10, 26, 14, 50, 38),
+    )
+    assert not command.flagged
+    assert command.comment == "ok"
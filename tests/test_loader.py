@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from loader import GenericJsonPBLoader, PBLoader, UnknownFormatError
+import playback
+
+GOOD = [
+    {"time": "2019-10-26 14:50:37", "user": "stark", "command": "ls"},
+    {"time": "2019-10-26 14:50:38", "user": "stark", "command": "id"},
+]
+BAD = [{"command": "no time"}, 5, "text", {"time": 1e30, "command": "far future"}]
+
+
+def _write(tmp_path, text):
+    path = tmp_path / "hist.json"
+    path.write_text(text)
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, GenericJsonPBLoader.CHUNK_SIZE])
+def test_array_skips_bad_records(tmp_path, monkeypatch, chunk_size):
+    monkeypatch.setattr(GenericJsonPBLoader, "CHUNK_SIZE", chunk_size)
+    records = [GOOD[0]] + BAD + [GOOD[1]]
+    filename = _write(tmp_path, json.dumps(records, indent=2))
+    table = GenericJsonPBLoader.load(filename)
+    assert [c.command for c in table] == ["ls", "id"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test_array_chunk_boundaries(tmp_path, monkeypatch, chunk_size):
+    monkeypatch.setattr(GenericJsonPBLoader, "CHUNK_SIZE", chunk_size)
+    records = [
+        {"time": 1572101437 + i, "command": f"echo {i}", "result": "é" * i}
+        for i in range(30)
+    ]
+    filename = _write(tmp_path, json.dumps(records))
+    table = GenericJsonPBLoader.load(filename)
+    assert [c.command for c in table] == [f"echo {i}" for i in range(30)]
+    assert [c.result for c in table] == ["é" * i for i in range(30)]
+
+
+def test_json_lines_skips_bad_records(tmp_path):
+    lines = [GOOD[0]] + BAD + [GOOD[1]]
+    text = "\n".join(json.dumps(line) for line in lines) + "\n{not json\n"
+    table = GenericJsonPBLoader.load(_write(tmp_path, text))
+    assert [c.command for c in table] == ["ls", "id"]
+
+
+def test_out_of_order_batches_are_merged(tmp_path, monkeypatch):
+    monkeypatch.setattr(GenericJsonPBLoader, "LOAD_BATCH", 4)
+    # two hosts logged in interleaved blocks, each block going back in time
+    times = [1572101437 + (i % 5) * 60 + i // 5 for i in range(40)]
+    records = [{"time": t, "command": f"cmd{i}"} for i, t in enumerate(times)]
+    table = GenericJsonPBLoader.load(_write(tmp_path, json.dumps(records)))
+    assert len(table) == 40
+    assert list(table.times) == sorted(table.times)
+    expected = sorted(range(40), key=lambda i: times[i])
+    assert [c.command for c in table] == [f"cmd{i}" for i in expected]
+
+
+def test_unrecognized_file_is_reported_not_printed(tmp_path, monkeypatch, capsys):
+    (tmp_path / "notes.txt").write_text("just some text\n")
+    with pytest.raises(UnknownFormatError):
+        PBLoader.load_all(str(tmp_path), "notes.txt")
+    with pytest.raises(UnknownFormatError):
+        PBLoader.load_all(str(tmp_path), "notes.txt", "no_such_format")
+
+    monkeypatch.setattr(playback, "SESSION_FOLDER", str(tmp_path))
+    lines = []
+    [loaded] = playback.load_playbacks({"notes.txt": None}, progress=lines.append)
+    assert len(loaded.hist) == 0
+    assert any(line.startswith("no loader for") for line in lines)
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,94 @@
+import datetime as dt
+
+from command import Command
+from commandtable import CommandTable
+import lazytext
+from lazytext import LazyText
+from search import SearchIndex, _required_literals
+
+
+def _index(pairs):
+    table = CommandTable(
+        [
+            Command(dt.datetime(2019, 10, 26, 14, 50, i), command=c, result=r)
+            for i, (c, r) in enumerate(pairs)
+        ]
+    )
+    index = SearchIndex(table)
+    index.update()
+    return index
+
+
+HISTORY = [
+    ("nmap -sV 10.0.0.1", "22/tcp open ssh"),
+    ("use exploit/multi/handler", "Payload => windows/meterpreter_reverse_https"),
+    ("cat /etc/passwd", "root:x:0:0:root:/root:/bin/bash"),
+    ("Get-Process", None),
+]
+
+
+def test_tokens_are_whole_words_ignoring_case():
+    index = _index(HISTORY)
+    assert index.search("SSH") == [0]
+    assert index.search("open ssh") == [0]
+    assert index.search("get-process") == [3]
+    assert index.search("nothing here") == []
+
+
+def test_partial_tokens_match_by_prefix_suffix_and_substring():
+    index = _index(HISTORY)
+    assert index.search("meterp") == [1]  # suffix of the query is partial
+    assert index.search("preter_reverse") == [1]  # prefix is partial
+    assert index.search("xploi") == [1]  # both ends are partial
+    assert index.search("s/meterpreter_") == [1]
+    assert index.search("/bin/ba") == [2]
+
+
+def test_rows_not_yet_indexed_are_searched():
+    index = _index(HISTORY[:1])
+    index.table.insert(
+        Command(dt.datetime(2019, 10, 26, 15, 0, 0), command="whoami", result="root")
+    )
+    assert index.search("whoami") == [1]
+    assert index.update() == 1
+    assert index.search("whoami") == [1]
+
+
+def test_regex_search():
+    index = _index(HISTORY)
+    assert index.search(r"\d+/tcp", regex=True) == [0]
+    assert index.search(r"(?i)PASSWD", regex=True) == [2]
+    assert index.search(r"root|ssh", regex=True) == [0, 2]
+
+
+def test_required_literals():
+    assert _required_literals(r"nmap -sV \d+") == ["nmap -sV "]
+    assert _required_literals(r"cat .*passwd") == ["cat ", "passwd"]
+    assert _required_literals(r"root|ssh") == []
+    assert _required_literals(r"(?i)root") == []
+    assert _required_literals(r"\d+\.\d+") == []
+    assert _required_literals(r"[") == []
+
+
+def test_indexing_leaves_the_display_cache_alone(tmp_path):
+    path = tmp_path / "log"
+    path.write_bytes(b"first result\nsecond result\n")
+    lazytext.clear_cache()
+    table = CommandTable(
+        [
+            Command(
+                dt.datetime(2019, 10, 26),
+                command="a",
+                result=LazyText(str(path), 0, 12),
+            ),
+            Command(
+                dt.datetime(2019, 10, 27),
+                command="b",
+                result=LazyText(str(path), 13, 13),
+            ),
+        ]
+    )
+    index = SearchIndex(table)
+    index.update()
+    assert index.search("second") == [1]
+    assert not lazytext._cache
@@ -0,0 +1,58 @@
+import datetime as dt
+import struct
+
+import pytest
+
+from command import Command
+from commandtable import CommandTable
+import sessionfile
+from sessionfile import SessionFormatError
+
+
+def _saved(tmp_path):
+    table = CommandTable(
+        [
+            Command(dt.datetime(2019, 10, 26, 14, 50, i), user="stark", command=f"c{i}")
+            for i in range(3)
+        ]
+    )
+    table[1].flagged = True
+    table[2].result = "output"
+    path = str(tmp_path / "saved.hsp")
+    sessionfile.save(table, path)
+    return path
+
+
+def test_round_trip(tmp_path):
+    table = sessionfile.load(_saved(tmp_path))
+    assert [c.command for c in table] == ["c0", "c1", "c2"]
+    assert [c.flagged for c in table] == [False, True, False]
+    assert table[2].result == "output"
+
+
+@pytest.mark.parametrize("size", [0, 10, 40, 100, -1])
+def test_truncated_file(tmp_path, size):
+    path = _saved(tmp_path)
+    data = open(path, "rb").read()
+    with open(path, "wb") as outfi:
+        outfi.write(data[:size])
+    with pytest.raises(SessionFormatError):
+        sessionfile.load(path)
+
+
+def test_wrong_section_count(tmp_path):
+    path = _saved(tmp_path)
+    data = bytearray(open(path, "rb").read())
+    magic, version, count, nsections = struct.unpack_from("<8sIQI", data)
+    struct.pack_into("<8sIQI", data, 0, magic, version, count, nsections - 1)
+    with open(path, "wb") as outfi:
+        outfi.write(data)
+    with pytest.raises(SessionFormatError):
+        sessionfile.load(path)
+
+
+def test_not_a_session_file(tmp_path):
+    path = tmp_path / "other"
+    path.write_bytes(b"=" * 200)
+    with pytest.raises(SessionFormatError):
+        sessionfile.load(str(path))
@@ -0,0 +1,45 @@
+import datetime as dt
+
+from prompt_toolkit.layout.screen import Point
+from prompt_toolkit.mouse_events import MouseEvent, MouseEventType
+
+from command import Command
+from playback import Playback
+from timeline import TimelineControl
+
+
+def _playback(count):
+    playback = Playback()
+    playback.hist = [
+        Command(dt.datetime(2019, 10, 26, 14, i), command=f"cmd{i}")
+        for i in range(count)
+    ]
+    playback.goto_index(count)  # everything played
+    return playback
+
+
+def test_click_seeks_to_the_clicked_command():
+    playback = _playback(10)
+    seeks = []
+    timeline = TimelineControl(playback, on_seek=lambda: seeks.append(True))
+    timeline.create_content(80, 4)  # rows 6 to 9 shown
+    timeline.mouse_handler(MouseEvent(Point(0, 1), MouseEventType.MOUSE_UP))
+    assert playback.playback_position == 8  # cmd7 just played
+    # the clock is at cmd7's time, so cmd8 isn't due yet
+    assert playback.current_time == playback.hist[7].time
+    assert playback.current_time < playback.hist[8].time
+    assert seeks == [True]
+
+
+def test_scrolling_stops_and_resumes_following():
+    playback = _playback(10)
+    timeline = TimelineControl(playback)
+    timeline.create_content(80, 4)
+    assert timeline.top == 6
+    timeline.scroll(-3)
+    assert (timeline.top, timeline.follow) == (3, False)
+    timeline.end()
+    assert (timeline.top, timeline.follow) == (6, True)
+    content = timeline.create_content(80, 4)
+    assert content.line_count == 4
+    assert "cmd9" in content.get_line(3)[0][1]